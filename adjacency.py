@@ -0,0 +1,72 @@
+import numpy as np
+
+# Direction codes follow the order of solve.WindRose: N, E, S, W
+N, E, S, W = range(4)
+DELTAS = ((-1, 0), (0, 1), (1, 0), (0, -1))
+OPPOSITE = (S, W, N, E)
+BITS = (1, 2, 4, 8)
+
+# Number of open directions for every possible bitmask
+DEGREE = tuple(bin(mask).count("1") for mask in range(16))
+
+# Direction code of a bitmask with a single bit set
+BIT_DIRECTION = {bit: direction for direction, bit in enumerate(BITS)}
+
+
+def adjacency_map(grid: np.ndarray) -> np.ndarray:
+    """Bitmask of traversable neighbours for every path cell, walls are 0."""
+    grid = np.asarray(grid, dtype=bool)
+    padded = np.pad(grid, 1)
+    shifted = (
+        padded[:-2, 1:-1],  # N
+        padded[1:-1, 2:],  # E
+        padded[2:, 1:-1],  # S
+        padded[1:-1, :-2],  # W
+    )
+    adjacency = np.zeros(grid.shape, dtype=np.uint8)
+    for neighbours, bit in zip(shifted, BITS):
+        adjacency += neighbours.astype(np.uint8) * np.uint8(bit)
+    adjacency[~grid] = 0
+    return adjacency
+
+
+def degree_map(adjacency: np.ndarray) -> np.ndarray:
+    """Number of traversable neighbours for every cell of an adjacency map."""
+    return np.asarray(DEGREE, dtype=np.uint8)[adjacency]
+
+
+def border_exits(north: np.ndarray, east: np.ndarray, south: np.ndarray, west: np.ndarray) -> list[tuple[int, int]]:
+    """Path cells on the borders of a grid, given as boolean vectors. Ordered like
+    Maze.find_exit_cells: by column along north and south (north first), then
+    by row along east and west (east first)."""
+    height, width = len(east), len(north)
+    cols = np.flatnonzero(north | south)
+    rows = np.flatnonzero(east | west)
+    vertical = np.stack([  # (row, col) pairs, north and south interleaved per column
+        np.where(np.stack([north[cols], south[cols]], axis=1), [0, height - 1], -1).ravel(),
+        np.repeat(cols, 2),
+    ], axis=1)
+    horizontal = np.stack([
+        np.repeat(rows, 2),
+        np.where(np.stack([east[rows], west[rows]], axis=1), [width - 1, 0], -1).ravel(),
+    ], axis=1)
+    cells = np.concatenate([vertical[vertical[:, 0] >= 0], horizontal[horizontal[:, 1] >= 0]])
+    return [(row, col) for row, col in cells.tolist()]
+
+
+def corridor_runs(mask: np.ndarray, steps, flat: int, direction: int, end: int) -> list[tuple[int, int]]:
+    """(direction, steps) of the straight stretches of the corridor leaving flat
+    cell `flat` in `direction`, up to flat cell `end`, without listing its cells.
+    `mask` is a flattened adjacency map and `steps` the flat offset of every
+    direction code."""
+    runs, run, d = [], 0, direction
+    while True:
+        flat += steps[d]
+        run += 1
+        if flat == end:
+            runs.append((d, run))
+            return runs
+        turn = BIT_DIRECTION.get(mask.item(flat) ^ BITS[OPPOSITE[d]], d)
+        if turn != d:
+            runs.append((d, run))
+            d, run = turn, 0
@@ -0,0 +1,104 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+from errors import MazeError
+from formats import EXTENSIONS
+
+SOLVED_SUFFIX = " - solved.png"
+
+
+def find_mazes(patterns: list[str]) -> list[str]:
+    """Maze files in the given directories or matching the given globs."""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = [file for ext in EXTENSIONS for file in glob.glob(os.path.join(pattern, "*" + ext))]
+        else:
+            found = glob.glob(pattern)
+        files += sorted(
+            file for file in found
+            if os.path.isfile(file) and not file.endswith(SOLVED_SUFFIX)
+        )
+    return files
+
+
+def warm_up() -> None:
+    """Import the heavy modules once per worker instead of once per maze."""
+    import numpy  # noqa: F401
+    import PIL.Image  # noqa: F401
+    import matrix2image  # noqa: F401
+    import solve  # noqa: F401
+
+
+def solve_one(
+    path: str,
+    engine: str = "nodes",
+    output_dir: Optional[str] = None,
+    render: bool = True,
+    cache_dir: Optional[str] = None,
+) -> dict:
+    """Load, validate, solve and render one maze. Never raises, failures are
+    reported in the returned record."""
+    import matrix2image as m2i
+    from cache import MazeCache
+    from solve import solve_file
+
+    record = {"file": path, "engine": engine}
+    start = time.perf_counter()
+    try:
+        maze = solve_file(path, engine=engine, cache=MazeCache(cache_dir) if cache_dir else None)
+        record["solved"] = time.perf_counter() - start
+        record["length"] = maze.solution_length
+        if render:
+            name = os.path.splitext(os.path.basename(path))[0] + SOLVED_SUFFIX
+            target = os.path.join(output_dir or os.path.dirname(path), name)
+            m2i.create_png(target, maze.mx, maze.solution)
+            record["output"] = target
+    except MazeError as error:
+        record["error"] = type(error).__name__
+        record["message"] = str(error)
+    except Exception as error:  # keep the batch going, but tell invalid mazes apart from crashes
+        record["error"] = type(error).__name__
+        record["message"] = str(error)
+        record["crashed"] = True
+    record["time"] = time.perf_counter() - start
+    return record
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from solve import Maze
+
+    parser = argparse.ArgumentParser(description="Solve a directory of mazes on a process pool")
+    parser.add_argument("paths", nargs="+", help="directories or glob patterns of maze images")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--engine", choices=Maze.ENGINES, default="nodes")
+    parser.add_argument("--output-dir", help="write solved images here instead of next to the mazes")
+    parser.add_argument("--no-render", action="store_true", help="don't write solved images")
+    parser.add_argument("--cache-dir", help="reuse parsed mazes and solutions from this directory")
+    args = parser.parse_args(argv)
+
+    files = find_mazes(args.paths)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=warm_up) as pool:
+        futures = [
+            pool.submit(solve_one, file, args.engine, args.output_dir, not args.no_render, args.cache_dir)
+            for file in files
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            failed += "error" in record
+            print(json.dumps(record), flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
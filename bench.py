@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Optional
+
+import numpy as np
+
+import generate
+
+SIZES = (100, 500, 1000, 2000)
+LARGE_SIZES = (10000,)  # minutes per case, run with --large
+TOPOLOGIES = ("perfect", "braided", "rooms", "corridor")
+
+# Topologies with loops, the node engine walks in circles on them
+LOOPED = ("braided", "rooms")
+LOOP_ENGINES = ("graph", "bfs", "astar", "dijkstra")
+
+
+def _perfect(size: int, rng: np.random.Generator) -> np.ndarray:
+    return generate.generate(size | 1, size | 1, algorithm="kruskal", seed=rng)
+
+
+def _braided(size: int, rng: np.random.Generator) -> np.ndarray:
+    return generate.generate(size | 1, size | 1, algorithm="kruskal", braid=0.5, seed=rng)
+
+
+def _rooms(size: int, rng: np.random.Generator) -> np.ndarray:
+    """Braided maze with open rectangular rooms cleared into it."""
+    grid = _braided(size, rng)
+    height, width = grid.shape
+    for _ in range(max(size // 50, 1)):
+        room_h, room_w = rng.integers(3, max(height // 6, 4), size=2)
+        row, col = rng.integers(1, max(height - room_h - 1, 2)), rng.integers(1, max(width - room_w - 1, 2))
+        grid[row:row + room_h, col:col + room_w] = True
+    grid[[0, -1], :] = grid[:, [0, -1]] = False
+    grid[0, 1] = grid[-1, -2] = True
+    return grid
+
+
+def _corridor(size: int, rng: np.random.Generator) -> np.ndarray:
+    """One corridor winding through every row of cells."""
+    cells_h = cells_w = size // 2
+    grid = np.zeros((2 * cells_h + 1, 2 * cells_w + 1), dtype=bool)
+    grid[1::2, 1:-1] = True
+    for row in range(cells_h - 1):
+        col = 2 * cells_w - 1 if row % 2 == 0 else 1
+        grid[2 * row + 2, col] = True
+    grid[0, 1] = grid[-1, -2] = True
+    return grid
+
+
+GENERATORS: dict[str, Callable[[int, np.random.Generator], np.ndarray]] = {
+    "perfect": _perfect,
+    "braided": _braided,
+    "rooms": _rooms,
+    "corridor": _corridor,
+}
+
+
+def _stages(path: str, engine: str, output: str) -> tuple[list[tuple[str, Callable[[], None]]], dict]:
+    """Stages of the pipeline in order, and the dict they leave their results in."""
+    import image2matrix as i2m
+    import matrix2image as m2i
+    from solve import Maze, Matrix, Validator
+
+    state = {}
+    stages = [
+        ("load", lambda: state.update(grid=i2m.load_grid(path))),
+        ("validate", lambda: Validator.validate(state["grid"])),
+        ("maze", lambda: state.update(maze=Maze(Matrix(state["grid"])))),
+        ("find_exit_cells", lambda: state["maze"].find_exit_cells()),
+    ]
+    if engine == "nodes":
+        stages += [
+            ("create_nodes", lambda: state["maze"].create_nodes()),
+            ("find_solution", lambda: state["maze"].find_solution()),
+        ]
+    else:
+        stages.append(("solve", lambda: state["maze"].solve(engine=engine)))
+    stages.append(("create_png", lambda: m2i.create_png(output, state["maze"].mx, state["maze"].solution)))
+    return stages, state
+
+
+def run_case(size: int, topology: str, engine: str, seed: int = 0, memory: bool = True) -> dict:
+    """Generate one maze and time every stage of solving it. Meant to run in a
+    fresh process, so the peak RSS belongs to this case alone."""
+    record = {"size": size, "topology": topology, "engine": engine, "seed": seed}
+    if topology in LOOPED and engine not in LOOP_ENGINES:
+        record["skipped"] = "engine needs a maze without loops"
+        return record
+
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as directory:
+        path, output = os.path.join(directory, "maze.png"), os.path.join(directory, "solved.png")
+        grid = GENERATORS[topology](size, np.random.default_rng(seed))
+        Image.fromarray(grid).save(path)
+        record["shape"] = list(grid.shape)
+        del grid
+
+        record["stages"] = {}
+        stages, state = _stages(path, engine, output)
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage()
+            record["stages"][name] = time.perf_counter() - start
+        record["length"] = state["maze"].solution_length
+        record["total"] = sum(record["stages"].values())
+        del stages, state
+
+        if memory:  # separate pass, tracing slows every allocation down
+            record["tracemalloc"] = {}
+            stages, _ = _stages(path, engine, output)
+            for name, stage in stages:
+                tracemalloc.start()
+                stage()
+                record["tracemalloc"][name] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+    rss = _peak_rss()
+    if rss is None and record.get("tracemalloc"):
+        rss = max(record["tracemalloc"].values())  # the largest traced peak, lacking a real one
+    if rss is not None:
+        record["rss"] = rss
+    return record
+
+
+def _peak_rss() -> Optional[int]:
+    """Peak resident set size of this process in bytes, None where the resource
+    module doesn't exist (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run(sizes, topologies, engine: str, repeat: int = 1, seed: int = 0, memory: bool = True) -> dict:
+    results = []
+    for size in sizes:
+        for topology in topologies:
+            runs = []
+            for i in range(repeat):
+                # one fresh process per run keeps peak RSS and caches apart
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    runs.append(pool.submit(run_case, size, topology, engine, seed, memory and i == 0).result())
+            record = runs[0]
+            if "stages" in record:
+                for name in record["stages"]:
+                    record["stages"][name] = min(r["stages"][name] for r in runs)
+                record["total"] = sum(record["stages"].values())
+                if any("rss" in r for r in runs):
+                    record["rss"] = max(r["rss"] for r in runs if "rss" in r)
+            results.append(record)
+            print(_summary(record), file=sys.stderr, flush=True)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, floor: float = 0.005) -> list[str]:
+    """Regressions of `current` against `baseline`: stages that got slower by
+    more than `threshold` (and by more than `floor` seconds), and peak memory
+    that grew by more than `threshold`."""
+    key = lambda record: (record["size"], record["topology"], record["engine"])  # noqa: E731
+    before = {key(record): record for record in baseline["results"] if "stages" in record}
+    regressions = []
+    for record in current["results"]:
+        old = before.get(key(record))
+        if old is None or "stages" not in record:
+            continue
+        case = "{}x{} {} {}".format(record["size"], record["size"], record["topology"], record["engine"])
+        for name, seconds in record["stages"].items():
+            previous = old["stages"].get(name)
+            if previous is not None and seconds > previous * (1 + threshold) and seconds - previous > floor:
+                regressions.append(f"{case}: {name} {previous:.4f}s -> {seconds:.4f}s")
+        for metric in ("rss",):
+            if metric in old and metric in record and record[metric] > old[metric] * (1 + threshold):
+                regressions.append(f"{case}: {metric} {old[metric]} -> {record[metric]} bytes")
+        for name, peak in record.get("tracemalloc", {}).items():
+            previous = old.get("tracemalloc", {}).get(name)
+            if previous and peak > previous * (1 + threshold) and peak - previous > 1 << 20:
+                regressions.append(f"{case}: {name} peak {previous} -> {peak} bytes")
+    return regressions
+
+
+def _summary(record: dict) -> str:
+    case = "{:>6} {:<9} {:<8}".format(record["size"], record["topology"], record["engine"])
+    if "skipped" in record:
+        return f"{case} skipped: {record['skipped']}"
+    stages = " ".join(f"{name}={seconds:.3f}" for name, seconds in record["stages"].items())
+    rss = f" rss={record['rss'] >> 20}MB" if "rss" in record else ""
+    return f"{case} total={record['total']:.3f}s{rss} {stages}"
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from solve import Maze
+
+    parser = argparse.ArgumentParser(description="Benchmark the maze pipeline stage by stage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark and write JSON")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="maze sizes in pixels")
+    run_parser.add_argument("--large", action="store_true", help="also run 10000x10000 mazes")
+    run_parser.add_argument("--topologies", nargs="+", choices=TOPOLOGIES, default=TOPOLOGIES)
+    run_parser.add_argument("--engine", choices=Maze.ENGINES, default="nodes")
+    run_parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest counts")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    run_parser.add_argument("--output", "-o", help="write results here instead of stdout")
+    run_parser.add_argument("--baseline", help="compare against these results afterwards")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown, 0.1 = 10%%")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown, 0.1 = 10%%")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        sizes = list(args.sizes) + [size for size in LARGE_SIZES if args.large and size not in args.sizes]
+        current = run(sizes, args.topologies, args.engine, args.repeat, args.seed, not args.no_memory)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(current, file, indent=2)
+        else:
+            print(json.dumps(current, indent=2))
+        if not args.baseline:
+            return 0
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+
+    regressions = compare(baseline, current, threshold=args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+# Bump whenever the layout or meaning of the cached arrays changes
+CACHE_VERSION = 2
+
+
+class MazeCache:
+    """On-disk cache of parsed mazes, keyed by the content hash of the source file.
+
+    Every entry is a directory of generations, each holding a `meta.json` and one
+    `.npy` file per array, so arrays can be memory-mapped on load instead of
+    parsed. A generation is never changed once written: extending an entry writes
+    the next one beside it, so files other processes may have mapped are never
+    replaced or deleted underneath them (which Windows refuses anyway).
+    Generations are evicted least recently used first once the cache outgrows
+    `max_bytes`, the superseded ones of an entry being the least recently used."""
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(path) -> str:
+        """SHA-256 of a file, or of the bytes of one."""
+        if isinstance(path, bytes):
+            return hashlib.sha256(path).hexdigest()
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def generations(self, key: str) -> list[int]:
+        """Numbers of the generations of an entry written by this CACHE_VERSION, oldest first."""
+        prefix = f"v{CACHE_VERSION}-"
+        try:
+            names = os.listdir(os.path.join(self.directory, key))
+        except OSError:
+            return []
+        return sorted(
+            int(name[len(prefix):]) for name in names
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        )
+
+    def entry(self, key: str, generation: Optional[int] = None) -> Optional[str]:
+        """Directory of a generation of an entry, by default the newest one.
+        None on a miss."""
+        if generation is None:
+            generations = self.generations(key)
+            if not generations:
+                return
+            generation = generations[-1]
+        return os.path.join(self.directory, key, f"v{CACHE_VERSION}-{generation}")
+
+    def load(self, key: str) -> Optional[tuple[dict, dict[str, np.ndarray]]]:
+        """Meta data and memory-mapped arrays of an entry, None on a miss."""
+        entry = self.entry(key)
+        if entry is None:
+            return
+        try:
+            with open(os.path.join(entry, "meta.json")) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return
+        if meta.get("version") != CACHE_VERSION:
+            return
+
+        arrays = {}
+        for name in os.listdir(entry):
+            if name.endswith(".npy"):
+                arrays[name[:-4]] = np.load(os.path.join(entry, name), mmap_mode="r")
+        os.utime(os.path.join(entry, "meta.json"))  # mark as recently used
+        return meta, arrays
+
+    def store(self, key: str, meta: dict, arrays: dict[str, np.ndarray]) -> None:
+        """Write (or extend) an entry as its next generation. Arrays are written
+        to a temporary directory first and moved in place, so readers never see
+        a partial entry. If another process stored the same generation first,
+        or the move fails otherwise, the existing entry is kept."""
+        generations = self.generations(key)
+        cached = self.load(key)
+        if cached:
+            meta = {**cached[0], **meta}
+            arrays = {**{name: np.asarray(array) for name, array in cached[1].items()}, **arrays}
+
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), np.asarray(array))
+        with open(os.path.join(staging, "meta.json"), "w") as file:
+            json.dump({**meta, "version": CACHE_VERSION}, file)
+        del cached, arrays  # close the maps of the previous generation
+
+        os.makedirs(os.path.join(self.directory, key), exist_ok=True)
+        try:
+            os.replace(staging, self.entry(key, generations[-1] + 1 if generations else 0))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict(keep=key)
+
+    @staticmethod
+    def size(directory: str) -> int:
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove least recently used generations until the cache fits
+        `max_bytes`, never the newest generation of `keep`. Superseded
+        generations and those of other cache versions go first. Removal is best
+        effort: a generation another process still has mapped on Windows stays
+        until a later eviction."""
+        entries = []
+        for key in os.listdir(self.directory):
+            if key.startswith("."):
+                continue  # staging directories
+            current = self.entry(key)
+            if os.path.isfile(os.path.join(self.directory, key, "meta.json")):  # written before generations
+                directory = os.path.join(self.directory, key)
+                entries.append((-1.0, directory, self.size(directory)))
+                continue
+            try:
+                names = os.listdir(os.path.join(self.directory, key))
+            except OSError:
+                continue
+            for name in names:
+                directory = os.path.join(self.directory, key, name)
+                meta = os.path.join(directory, "meta.json")
+                if not os.path.isfile(meta):
+                    continue
+                if directory == current:
+                    if key == keep:
+                        entries.append((float("inf"), directory, self.size(directory)))
+                        continue
+                    used = os.path.getmtime(meta)
+                else:
+                    used = -1.0
+                entries.append((used, directory, self.size(directory)))
+
+        total = sum(size for *_, size in entries)
+        for used, directory, size in sorted(entries):
+            if total <= self.max_bytes or used == float("inf"):
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            if not os.path.exists(directory):
+                total -= size
+                parent = os.path.dirname(directory)
+                if parent != self.directory:
+                    try:
+                        os.rmdir(parent)  # after the last generation of an entry
+                    except OSError:
+                        pass
@@ -0,0 +1,62 @@
+import numpy as np
+
+Cell = tuple[int, int]
+
+
+def components(n_nodes: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Union-find on arrays by hooking and pointer jumping: the smallest node of
+    the component every node is in, for edges `a[i]`-`b[i]`."""
+    label = np.arange(n_nodes, dtype=np.int32 if n_nodes < 1 << 31 else np.int64)
+    while True:
+        label_a, label_b = label[a], label[b]
+        differ = label_a != label_b
+        if not differ.any():
+            return label
+        np.minimum.at(label, np.maximum(label_a, label_b)[differ], np.minimum(label_a, label_b)[differ])
+        while True:
+            jumped = label[label]
+            if np.array_equal(jumped, label):
+                break
+            label = jumped
+
+
+def label_runs(grid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Horizontal runs of path as union-find nodes, joined wherever runs touch
+    vertically: the run every cell is in (undefined for walls) and the
+    component of every run. A maze costs a few passes over its rows rather
+    than a walk over its cells."""
+    grid = np.asarray(grid, dtype=bool)
+    starts = grid.copy()
+    starts[:, 1:] &= ~grid[:, :-1]
+    runs = np.cumsum(starts, axis=None, dtype=np.int64).reshape(grid.shape) - 1
+
+    below = grid[:-1] & grid[1:]
+    return runs, components(int(starts.sum()), runs[:-1][below], runs[1:][below])
+
+
+def label_components(grid: np.ndarray) -> np.ndarray:
+    """Connected component of every path cell, -1 for walls."""
+    grid = np.asarray(grid, dtype=bool)
+    runs, labels = label_runs(grid)
+    return np.where(grid, labels[runs], -1)
+
+
+def connected(grid: np.ndarray, a: Cell, b: Cell) -> bool:
+    """Whether a route joins two path cells, by the labels of their runs."""
+    grid = np.asarray(grid, dtype=bool)
+    if not (grid[a] and grid[b]):
+        return False
+    runs, labels = label_runs(grid)
+    return bool(labels[runs[a]] == labels[runs[b]])
+
+
+def crop_to_component(grid: np.ndarray, cell: Cell, labels: np.ndarray = None) -> tuple[np.ndarray, Cell]:
+    """The bounding box of the component `cell` is in, with a margin of wall
+    where the grid allows, and its top left corner in `grid`. Other components
+    are walled up, so no new exits appear on the borders of the crop."""
+    if labels is None:
+        labels = label_components(grid)
+    component = labels == labels[cell]
+    rows, cols = np.flatnonzero(component.any(axis=1)), np.flatnonzero(component.any(axis=0))
+    row, col = max(rows[0] - 1, 0), max(cols[0] - 1, 0)
+    return component[row:rows[-1] + 2, col:cols[-1] + 2], (int(row), int(col))
@@ -0,0 +1,232 @@
+import heapq
+import math
+from typing import Optional
+
+import numpy as np
+
+import adjacency as adj
+import search
+from graph import JunctionGraph
+from solution import Solution
+
+Cell = tuple[int, int]
+
+INF = math.inf
+
+
+class DynamicMaze:
+    """Maze whose cells can be opened and closed after it was solved. The
+    junction graph is kept as editable edge dicts (flat vertex cell to
+    {direction: (vertex, length)}); an edit only rewalks the corridors around
+    the cell changed, and `solve` repairs the previous search with Lifelong
+    Planning A* (LPA*) instead of starting over.
+
+        maze = DynamicMaze(grid)
+        maze.solve()
+        maze.clear_cell((5, 7))
+        maze.solve()  # only revisits vertices whose distance changed
+
+    Solutions run from the end to the start, like those of Maze."""
+    def __init__(self, matrix, exits: Optional[list[Cell]] = None):
+        grid = np.array(getattr(matrix, "array", matrix), dtype=bool)  # a copy, edited in place
+        self.grid = grid
+        self.height, self.width = grid.shape
+        self.adjacency = adj.adjacency_map(grid)
+        self.walker = search.CorridorWalker(self.adjacency)
+        if exits is None:
+            exits = adj.border_exits(grid[0], grid[:, -1], grid[-1], grid[:, 0])
+        self.start, self.end = (self.walker.flat(cell) for cell in exits[:2])
+
+        graph = JunctionGraph.build(grid, adjacency=self.adjacency)
+        vertices = graph.vertices.tolist()
+        self.edges: dict[int, dict[int, tuple[int, int]]] = {v: {} for v in vertices}
+        sources = np.repeat(graph.vertices, np.diff(graph.indptr)).tolist()
+        edges = zip(sources, graph.directions.tolist(), graph.indices.tolist(), graph.lengths.tolist())
+        for u, d, v, length in edges:
+            self.edges[u][d] = (vertices[v], length)
+
+        # LPA* state: distance estimates, one step lookaheads and the open queue
+        self.g: dict[int, float] = {}
+        self.rhs: dict[int, float] = {self.start: 0}
+        self.queue: list[tuple[tuple[float, float], int]] = []
+        self.queued: dict[int, tuple[float, float]] = {}
+        self._push(self.start)
+
+        self.solution = Solution()
+        self.solution_length: Optional[int] = None
+        self.expanded = 0  # vertices the last solve expanded
+
+    def set_cell(self, cell: Cell, path: bool = True) -> None:
+        """Make a cell path (or wall with `path=False`) and update the corridors
+        and junctions around it."""
+        row, col = cell
+        if not (0 < row < self.height - 1 and 0 < col < self.width - 1):
+            raise ValueError(f"Only cells inside the border can change: {cell}")
+        if self.grid[row, col] == path:
+            return
+
+        region = [(row, col)] + [(row + d_row, col + d_col) for d_row, d_col in adj.DELTAS]
+        region = [self.walker.flat(cell) for cell in region]
+        affected = self._corridor_ends(region)
+        touched = set(affected)
+        for a in affected:
+            for v, _ in self.edges[a].values():
+                touched.add(v)
+                self.edges[v] = {d: edge for d, edge in self.edges[v].items() if edge[0] != a}
+            self.edges[a] = {}
+
+        self.grid[row, col] = path
+        for flat in region:
+            self.adjacency.flat[flat] = self._mask(flat)
+            is_vertex = self.grid.flat[flat] and adj.DEGREE[self.adjacency.flat[flat]] != 2
+            if is_vertex and flat not in self.edges:
+                self.edges[flat] = {}
+                affected.add(flat)
+            elif not is_vertex and flat in self.edges:
+                del self.edges[flat]
+                affected.discard(flat)
+                touched.discard(flat)
+                for state in (self.g, self.rhs, self.queued):
+                    state.pop(flat, None)
+
+        mask, bits = self.walker.mask, adj.BITS
+        for a in affected:
+            for d in range(4):
+                if mask.item(a) & bits[d] and d not in self.edges[a]:
+                    v, length, _, entry = self.walker.follow(a, d)
+                    self.edges[a][d] = (v, length)
+                    self.edges[v][entry] = (a, length)
+                    touched.add(v)
+
+        for v in touched | affected:
+            self._update(v)
+
+    def clear_cell(self, cell: Cell) -> None:
+        """Turn a cell into wall."""
+        self.set_cell(cell, path=False)
+
+    def solve(self) -> Solution:
+        """Shortest route from the end to the start, empty when there is none.
+        Reuses every distance the edits since the last solve left valid."""
+        self.expanded = 0
+        g, rhs = self.g, self.rhs
+        while True:
+            top = self._top()
+            if top is None:
+                break
+            key, v = top
+            if key >= self._key(self.end) and rhs.get(self.end, INF) == g.get(self.end, INF):
+                break
+            heapq.heappop(self.queue)
+            del self.queued[v]
+            self.expanded += 1
+            if g.get(v, INF) > rhs.get(v, INF):
+                g[v] = rhs[v]
+            else:
+                g.pop(v, None)
+                self._update(v)
+            for u, _ in self.edges[v].values():
+                self._update(u)
+        return self._extract()
+
+    def _key(self, v: int) -> tuple[float, float]:
+        k = min(self.g.get(v, INF), self.rhs.get(v, INF))
+        row, col = divmod(v, self.width)
+        end_row, end_col = divmod(self.end, self.width)
+        return k + abs(row - end_row) + abs(col - end_col), k
+
+    def _update(self, v: int) -> None:
+        """Recompute the lookahead of `v` and queue it when it is inconsistent."""
+        if v != self.start:
+            g = self.g
+            best = min((g.get(u, INF) + length for u, length in self.edges[v].values()), default=INF)
+            if best < INF:
+                self.rhs[v] = best
+            else:
+                self.rhs.pop(v, None)
+        if self.g.get(v, INF) != self.rhs.get(v, INF):
+            self._push(v)
+        else:
+            self.queued.pop(v, None)  # its heap entry goes stale
+
+    def _push(self, v: int) -> None:
+        key = self._key(v)
+        self.queued[v] = key
+        heapq.heappush(self.queue, (key, v))
+
+    def _top(self) -> Optional[tuple[tuple[float, float], int]]:
+        """Smallest queue entry that is still current, dropping stale ones."""
+        queue, queued = self.queue, self.queued
+        while queue:
+            key, v = queue[0]
+            if queued.get(v) == key:
+                return key, v
+            heapq.heappop(queue)
+        return None
+
+    def _extract(self) -> Solution:
+        g = self.g
+        if g.get(self.end, INF) == INF:
+            self.solution, self.solution_length = Solution(), None
+            return self.solution
+
+        runs = []
+        v = self.end
+        while v != self.start:
+            d, (u, length) = min(self.edges[v].items(), key=lambda item: (g.get(item[1][0], INF) + item[1][1], item[0]))
+            runs += self._corridor_runs(v, d, length)
+            v = u
+        self.solution = Solution(self.walker.cell(self.end), *zip(*runs))
+        self.solution_length = self.solution.length
+        return self.solution
+
+    def _corridor_runs(self, v: int, d: int, length: int) -> list[tuple[int, int]]:
+        """(direction, steps) of the straight stretches of a corridor."""
+        mask, steps = self.walker.mask, self.walker.steps
+        bits, opposite, bit_direction = adj.BITS, adj.OPPOSITE, adj.BIT_DIRECTION
+        runs, run, cell = [], 0, v
+        for _ in range(length):
+            cell += steps[d]
+            run += 1
+            turn = bit_direction.get(mask.item(cell) ^ bits[opposite[d]], d)
+            if turn != d:
+                runs.append((d, run))
+                d, run = turn, 0
+        if run:
+            runs.append((d, run))
+        return runs
+
+    def _corridor_ends(self, cells: list[int]) -> set[int]:
+        """Vertices at the ends of every corridor through `cells`, and the
+        vertices among `cells` with everything they connect to."""
+        ends = set()
+        walker, mask, bits = self.walker, self.walker.mask, adj.BITS
+        for flat in cells:
+            if flat in self.edges:
+                ends.add(flat)
+                ends.update(v for v, _ in self.edges[flat].values())
+                continue
+            if not self.grid.flat[flat]:
+                continue
+            walker.stops.add(flat)  # a corridor without vertices ends back here
+            try:
+                for d in range(4):
+                    if mask.item(flat) & bits[d]:
+                        v = walker.follow(flat, d)[0]
+                        if v in self.edges:
+                            ends.add(v)
+            finally:
+                walker.stops.discard(flat)
+        return ends
+
+    def _mask(self, flat: int) -> int:
+        """Adjacency bitmask of a cell from the grid around it."""
+        row, col = divmod(flat, self.width)
+        if not self.grid[row, col]:
+            return 0
+        mask = 0
+        for d, (d_row, d_col) in enumerate(adj.DELTAS):
+            r, c = row + d_row, col + d_col
+            if 0 <= r < self.height and 0 <= c < self.width and self.grid[r, c]:
+                mask |= adj.BITS[d]
+        return mask
@@ -1,14 +1,22 @@
-class MatrixSizeError(Exception):
+class MazeError(Exception):
     ...
 
 
-class PathExitAmountError(Exception):
+class MatrixSizeError(MazeError):
     ...
 
 
-class PathCornerError(Exception):
+class PathExitAmountError(MazeError):
     ...
 
 
-class PathExitSpacingError(Exception):
+class PathCornerError(MazeError):
+    ...
+
+
+class PathExitSpacingError(MazeError):
+    ...
+
+
+class PathDisconnectedError(MazeError):
     ...
@@ -0,0 +1,203 @@
+import argparse
+import io
+import math
+import os
+import re
+import struct
+import sys
+from typing import Optional, Union
+
+import numpy as np
+
+# Every loader takes the path of a maze file, or the bytes of one (as sent to
+# server.py), whose format is told by its first bytes.
+Source = Union[str, bytes]
+
+# Maze files other than PNG, none of which needs PIL or any decoding:
+#   .pbm  PBM P4, rows packed 8 cells per byte with 1 for black, i.e. wall
+#   .npy  NumPy boolean array, True for path, memory-mapped as it is
+#   .mzb  MZB header (magic, version, height, width) followed by rows packed
+#         8 cells per byte with 1 for path, the layout of tiled.write_bitmap
+MZB_MAGIC = b"MAZEBITS"
+MZB_VERSION = 1
+MZB_HEADER = struct.Struct("<8sIIQQ")  # 32 bytes, so the rows start aligned
+
+# magic, width and height separated by whitespace and comments, then a single
+# whitespace character before the rows
+_SEPARATOR = rb"(?:\s|#[^\r\n]*[\r\n])+"
+PBM_HEADER = re.compile(rb"P4" + _SEPARATOR + rb"(\d+)" + _SEPARATOR + rb"(\d+)\s")
+
+EXTENSIONS = (".png", ".pbm", ".npy", ".mzb")
+PACKED = (".pbm", ".mzb")  # loaded bit-packed by load_packed, 1 bit per cell
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def extension(source: Source) -> str:
+    """Format of a maze file by its extension, or of the bytes of one by its
+    magic number. Bytes in none of the formats are left to PIL, as a PNG."""
+    if isinstance(source, bytes):
+        if source.startswith(NPY_MAGIC):
+            return ".npy"
+        if source.startswith(MZB_MAGIC):
+            return ".mzb"
+        if PBM_HEADER.match(source[:1024]):
+            return ".pbm"
+        return ".png"
+    ext = os.path.splitext(source)[1].lower()
+    if ext not in EXTENSIONS:
+        raise ValueError(f"Unknown maze format: {source}")
+    return ext
+
+
+def load_grid(source: Source) -> np.ndarray:
+    """Load a maze file of any supported format as a boolean array, True for
+    path. `.npy` files come back memory-mapped and read-only, bit-packed files
+    are memory-mapped and unpacked in one pass."""
+    ext = extension(source)
+    if ext == ".png":
+        import image2matrix as i2m
+
+        return i2m.load_grid(io.BytesIO(source) if isinstance(source, bytes) else source)
+    if ext == ".npy":
+        return read_npy(source)
+    packed, width = read_pbm(source) if ext == ".pbm" else read_mzb(source)
+    grid = np.asarray(np.unpackbits(packed, axis=1, count=width)).view(bool)
+    if ext == ".pbm":
+        np.logical_not(grid, out=grid)
+    return grid
+
+
+def load_packed(source: Source) -> tuple[np.ndarray, int]:
+    """Memory-mapped rows of a `.mzb` file, packed 8 cells per byte with 1 for
+    path as `solve.PackedMatrix.from_packed` takes them, and the width. PBM
+    rows are the other way around, so they are inverted into memory."""
+    ext = extension(source)
+    if ext == ".mzb":
+        return read_mzb(source)
+    if ext == ".pbm":
+        packed, width = read_pbm(source)
+        return np.invert(packed), width
+    grid = load_grid(source)
+    return np.packbits(grid, axis=1), grid.shape[1]
+
+
+def save_grid(path: str, grid) -> None:
+    """Write a maze (a boolean array or a Matrix) in the format of the extension."""
+    ext = extension(path)
+    grid = getattr(grid, "array", grid)
+    if ext == ".png":
+        from PIL import Image
+
+        Image.fromarray(np.asarray(grid, dtype=bool)).save(path)
+    elif ext == ".npy":
+        write_npy(path, grid)
+    elif ext == ".pbm":
+        write_pbm(path, grid)
+    else:
+        write_mzb(path, grid)
+
+
+def read_npy(source: Source) -> np.ndarray:
+    if isinstance(source, bytes):
+        grid = np.load(io.BytesIO(source))
+    else:
+        grid = np.load(source, mmap_mode="r")
+    if grid.ndim != 2:
+        raise ValueError(f"Expecting a 2 dimensional array in {_name(source)}")
+    return grid if grid.dtype == bool else grid != 0
+
+
+def write_npy(path: str, grid) -> None:
+    np.save(path, np.asarray(grid, dtype=bool))
+
+
+def read_pbm(source: Source) -> tuple[np.ndarray, int]:
+    """Memory-mapped rows of a PBM P4 file as stored (1 for wall) and the width."""
+    match = PBM_HEADER.match(_header(source, 1024))
+    if not match:
+        raise ValueError(f"Not a PBM P4 file: {_name(source)}")
+    width, height = int(match[1]), int(match[2])
+    return _rows(source, match.end(), (height, math.ceil(width / 8))), width
+
+
+def write_pbm(path: str, grid, strip: int = 4096) -> None:
+    height, width = np.shape(grid)
+    with open(path, "wb") as file:
+        file.write(f"P4\n{width} {height}\n".encode())
+        for row in range(0, height, strip):
+            file.write(np.packbits(~np.asarray(grid[row:row + strip], dtype=bool), axis=1).tobytes())
+
+
+def read_mzb(source: Source) -> tuple[np.ndarray, int]:
+    """Memory-mapped rows of an MZB file (1 for path) and the width."""
+    header = _header(source, MZB_HEADER.size)
+    if len(header) < MZB_HEADER.size:
+        raise ValueError(f"Not an MZB file: {_name(source)}")
+    magic, version, _, height, width = MZB_HEADER.unpack(header)
+    if magic != MZB_MAGIC:
+        raise ValueError(f"Not an MZB file: {_name(source)}")
+    if version != MZB_VERSION:
+        raise ValueError(f"Unsupported MZB version {version}: {_name(source)}")
+    return _rows(source, MZB_HEADER.size, (height, math.ceil(width / 8))), width
+
+
+def _name(source: Source) -> str:
+    return "maze data" if isinstance(source, bytes) else source
+
+
+def _header(source: Source, size: int) -> bytes:
+    if isinstance(source, bytes):
+        return source[:size]
+    with open(source, "rb") as file:
+        return file.read(size)
+
+
+def _rows(source: Source, offset: int, shape: tuple[int, int]) -> np.ndarray:
+    """Packed rows after the header, memory-mapped from a file or viewed in bytes."""
+    if isinstance(source, bytes):
+        if len(source) < offset + shape[0] * shape[1]:
+            raise ValueError(f"Truncated maze data, expecting {shape[0]} rows of {shape[1]} bytes")
+        return np.frombuffer(source, dtype=np.uint8, count=shape[0] * shape[1], offset=offset).reshape(shape)
+    return np.memmap(source, dtype=np.uint8, mode="r", offset=offset, shape=shape)
+
+
+def write_mzb(path: str, grid, strip: int = 4096) -> None:
+    height, width = np.shape(grid)
+    with open(path, "wb") as file:
+        file.write(MZB_HEADER.pack(MZB_MAGIC, MZB_VERSION, 0, height, width))
+        for row in range(0, height, strip):
+            file.write(np.packbits(np.asarray(grid[row:row + strip], dtype=bool), axis=1).tobytes())
+
+
+def convert(source: str, target: str) -> None:
+    save_grid(target, load_grid(source))
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from batch import find_mazes
+
+    parser = argparse.ArgumentParser(description="Convert maze files between formats")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser("convert", help="transcode mazes, e.g. a directory of PNGs to MZB")
+    convert_parser.add_argument("paths", nargs="+", help="maze files, directories or glob patterns")
+    convert_parser.add_argument("--to", choices=[ext[1:] for ext in EXTENSIONS], default="mzb")
+    convert_parser.add_argument("--output-dir", help="write converted mazes here instead of next to the sources")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for source in find_mazes(args.paths):
+        name = os.path.splitext(os.path.basename(source))[0] + "." + args.to
+        target = os.path.join(args.output_dir or os.path.dirname(source), name)
+        if os.path.abspath(target) == os.path.abspath(source):
+            continue
+        try:
+            convert(source, target)
+            print(target, flush=True)
+        except (OSError, ValueError) as error:
+            failed += 1
+            print(f"{source}: {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import argparse
+import itertools
+from typing import Iterator, Optional
+
+import numpy as np
+
+from connectivity import components
+
+ALGORITHMS = ("backtracker", "kruskal", "eller")
+
+Seed = Optional[int | np.random.Generator]
+
+# Every order the four directions N, E, S, W can be tried in
+PERMUTATIONS = tuple(itertools.permutations(range(4)))
+
+# Edge keys hold a random priority above the edge id, so ties can't happen
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+_NO_EDGE = np.iinfo(np.int64).max
+
+
+def generate(
+    height: int,
+    width: int,
+    algorithm: str = "kruskal",
+    braid: float = 0.0,
+    seed: Seed = None,
+) -> np.ndarray:
+    """Random maze as a boolean grid Validator accepts: path cells on odd rows and
+    columns, walls around, the entrance at (0, 1) and the exit at (H - 1, W - 2).
+
+    Sizes are in pixels and rounded down to odd. `braid` is the share of dead
+    ends opened up into loops, 0 gives a perfect maze. The same seed gives the
+    same maze."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+    cells_h, cells_w = _cells(height), _cells(width)
+    rng = np.random.default_rng(seed)
+    if algorithm == "eller":
+        return np.array(list(eller_rows(cells_h, cells_w, rng, braid=braid)))
+
+    grid = backtracker(cells_h, cells_w, rng) if algorithm == "backtracker" else kruskal(cells_h, cells_w, rng)
+    if braid:
+        open_dead_ends(grid, braid, rng)
+    grid[0, 1] = grid[-1, -2] = True
+    return grid
+
+
+def backtracker(cells_h: int, cells_w: int, rng: np.random.Generator) -> np.ndarray:
+    """Recursive backtracker (randomized depth first search) on an explicit stack.
+    Long winding corridors, but one Python step per cell: keep it for mazes up
+    to a few thousand pixels."""
+    grid = _empty(cells_h, cells_w)
+    size = cells_h * cells_w
+    order = rng.integers(0, len(PERMUTATIONS), size=size, dtype=np.uint8).tolist()
+    tried = bytearray(size)
+    visited = bytearray(size)
+    passages = []
+    steps = (-cells_w, 1, cells_w, -1)
+    pixel_width = 2 * cells_w + 1
+
+    visited[0] = 1
+    stack = [0]
+    while stack:
+        cell = stack[-1]
+        k = tried[cell]
+        if k == 4:
+            stack.pop()
+            continue
+        tried[cell] = k + 1
+        d = PERMUTATIONS[order[cell]][k]
+        row, col = divmod(cell, cells_w)
+        if d == 0 and row == 0 or d == 2 and row == cells_h - 1 or d == 3 and col == 0 or d == 1 and col == cells_w - 1:
+            continue
+        neighbour = cell + steps[d]
+        if visited[neighbour]:
+            continue
+        visited[neighbour] = 1
+        # the wall pixel between the two cells
+        passages.append((2 * row + 1 + (d == 2) - (d == 0)) * pixel_width + 2 * col + 1 + (d == 1) - (d == 3))
+        stack.append(neighbour)
+
+    grid.ravel()[passages] = True
+    return grid
+
+
+def kruskal(cells_h: int, cells_w: int, rng: np.random.Generator) -> np.ndarray:
+    """Kruskal's algorithm over randomly weighted walls, run as Borůvka rounds
+    on arrays: every component opens its cheapest wall per round, which is the
+    same minimum spanning tree Kruskal picks, in O(log n) vectorized passes."""
+    grid = _empty(cells_h, cells_w)
+    cell_ids = np.arange(cells_h * cells_w, dtype=np.int32).reshape(cells_h, cells_w)
+    east_u, south_u = cell_ids[:, :-1].ravel(), cell_ids[:-1, :].ravel()
+    n_east = len(east_u)
+    u = np.concatenate([east_u, south_u])
+    v = np.concatenate([east_u + 1, south_u + cells_w])
+    del cell_ids, east_u, south_u
+
+    ids = spanning_forest(cells_h * cells_w, u, v, rng)
+    east = ids < n_east
+    rows, cols = np.divmod(ids[east], cells_w - 1)
+    grid[2 * rows + 1, 2 * cols + 2] = True
+    rows, cols = np.divmod(ids[~east] - n_east, cells_w)
+    grid[2 * rows + 2, 2 * cols + 1] = True
+    return grid
+
+
+def eller_rows(
+    cells_h: int,
+    cells_w: int,
+    rng: np.random.Generator,
+    braid: float = 0.0,
+    strip: int = 256,
+) -> Iterator[np.ndarray]:
+    """Eller's algorithm, yielding the maze one pixel row at a time. Only the
+    set labels of the current row are kept, so mazes can be arbitrarily tall.
+    With `braid`, dead ends are opened up strip by strip, holding back the rows
+    a later strip may still change."""
+    pixel_width = 2 * cells_w + 1
+    top = np.zeros(pixel_width, dtype=bool)
+    top[1] = True
+    rows = _eller_cell_rows(cells_h, cells_w, rng)
+    if not braid:
+        yield top
+        yield from rows
+        return
+
+    # braid a strip once it ends in a wall row, holding back its last cell row
+    # (and the walls around it) until the cells below it exist
+    buffer, remaining = [top], 2 * cells_h
+    for row in rows:
+        buffer.append(row)
+        remaining -= 1
+        if len(buffer) % 2 == 0 or len(buffer) < strip + 3 and remaining:
+            continue
+        window = np.array(buffer)
+        held_back = 0 if not remaining else 3
+        last = None if not remaining else len(window) // 2 - 1
+        open_dead_ends(window, braid, rng, last=last)
+        yield from window[:len(window) - held_back]
+        buffer = list(window[len(window) - held_back:])
+
+
+def _eller_cell_rows(cells_h: int, cells_w: int, rng: np.random.Generator) -> Iterator[np.ndarray]:
+    pixel_width = 2 * cells_w + 1
+    labels = np.arange(cells_w)
+    for row in range(cells_h):
+        last = row == cells_h - 1
+        # join neighbours of different sets, all of them on the last row
+        join = np.ones(cells_w - 1, dtype=bool) if last else rng.random(cells_w - 1) < 0.5
+        positions = np.flatnonzero(join & (labels[:-1] != labels[1:]))
+        n_sets = int(labels.max()) + 1
+        selected = spanning_forest(n_sets, labels[positions], labels[positions + 1], rng)
+        east = positions[selected]
+        labels = components(n_sets, labels[east], labels[east + 1])[labels]
+
+        cells = np.zeros(pixel_width, dtype=bool)
+        cells[1::2] = True
+        cells[2 * east + 2] = True
+        yield cells
+
+        below = np.zeros(pixel_width, dtype=bool)
+        if last:
+            below[-2] = True
+            yield below
+            return
+        # every set goes on downwards through at least one random cell
+        down = rng.random(cells_w) < 0.5
+        keys = rng.random(cells_w)
+        first = np.full(n_sets, np.inf)
+        np.minimum.at(first, labels, keys)
+        down |= keys == first[labels]
+        below[2 * np.flatnonzero(down) + 1] = True
+        yield below
+
+        fresh = n_sets + np.arange(cells_w)
+        labels = np.unique(np.where(down, labels, fresh), return_inverse=True)[1].ravel()
+
+
+def open_dead_ends(
+    grid: np.ndarray,
+    amount: float,
+    rng: np.random.Generator,
+    last: Optional[int] = None,
+) -> np.ndarray:
+    """Braid a maze in place: open a random wall of `amount` of the dead ends
+    (of the cell rows above `last` only, if given) towards a neighbouring cell."""
+    cells = grid[1::2, 1::2]
+    walls = (
+        grid[0:-1:2, 1::2],  # N
+        grid[1::2, 2::2],  # E
+        grid[2::2, 1::2],  # S
+        grid[1::2, 0:-1:2],  # W
+    )
+    degree = sum(wall.astype(np.uint8) for wall in walls)
+    dead = cells & (degree == 1)
+    if last is not None:
+        dead[last:] = False
+    rows, cols = np.nonzero(dead & (rng.random(dead.shape) < amount))
+
+    cells_h, cells_w = cells.shape
+    closed = np.stack([~wall[rows, cols] for wall in walls], axis=1)
+    closed[:, 0] &= rows > 0
+    closed[:, 1] &= cols < cells_w - 1
+    closed[:, 2] &= rows < cells_h - 1
+    closed[:, 3] &= cols > 0
+    scores = rng.random(closed.shape) * closed
+    chosen = np.argmax(scores, axis=1)
+    valid = closed.any(axis=1)
+    rows, cols, chosen = rows[valid], cols[valid], chosen[valid]
+    d_row = np.array((-1, 0, 1, 0))[chosen]
+    d_col = np.array((0, 1, 0, -1))[chosen]
+    grid[2 * rows + 1 + d_row, 2 * cols + 1 + d_col] = True
+    return grid
+
+
+def spanning_forest(n_nodes: int, u: np.ndarray, v: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Indexes of the edges `u[i]`-`v[i]` of a random minimum spanning forest
+    (Borůvka). Every round contracts the components found, so later rounds get
+    cheaper."""
+    keys = rng.integers(0, 1 << 30, size=len(u), dtype=np.int64)
+    keys <<= _ID_BITS
+    keys |= np.arange(len(u))
+    selected = []
+    while len(keys):
+        cheapest = np.full(n_nodes, _NO_EDGE)
+        np.minimum.at(cheapest, u, keys)
+        np.minimum.at(cheapest, v, keys)
+        # every node points across its cheapest edge, the two ends of an edge
+        # chosen from both sides point at the smaller one
+        parent = np.arange(n_nodes, dtype=np.int32)
+        by_u, by_v = cheapest[u] == keys, cheapest[v] == keys
+        parent[u[by_u]] = v[by_u]
+        parent[v[by_v]] = u[by_v]
+        selected.append(keys[by_u | by_v] & _ID_MASK)
+        nodes = np.arange(n_nodes, dtype=np.int32)
+        mutual = (parent[parent] == nodes) & (nodes < parent)
+        parent[mutual] = nodes[mutual]
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+        is_root = parent == nodes
+        compact = (np.cumsum(is_root, dtype=np.int32) - 1)[parent]
+        n_nodes = int(is_root.sum())
+        u, v = compact[u], compact[v]
+        between = u != v
+        keys, u, v = keys[between], u[between], v[between]
+    return np.concatenate(selected) if selected else np.zeros(0, dtype=np.int64)
+
+
+def write_raw(path: str, rows: Iterator[np.ndarray]) -> int:
+    """Write pixel rows as a raw bitmap (see tiled.open_bitmap), returns the height."""
+    height = 0
+    with open(path, "wb") as file:
+        for row in rows:
+            file.write(np.packbits(row).tobytes())
+            height += 1
+    return height
+
+
+def _cells(pixels: int) -> int:
+    if pixels < 3:
+        raise ValueError("Maze must be at least 3x3")
+    return (pixels - 1) // 2
+
+
+def _empty(cells_h: int, cells_w: int) -> np.ndarray:
+    grid = np.zeros((2 * cells_h + 1, 2 * cells_w + 1), dtype=bool)
+    grid[1::2, 1::2] = True
+    return grid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a random maze")
+    parser.add_argument("file", help="png image, or .raw for a raw bitmap (streamed with --algorithm eller)")
+    parser.add_argument("--size", type=int, default=401, help="width and height in pixels")
+    parser.add_argument("--height", type=int, help="height in pixels, overrides --size")
+    parser.add_argument("--width", type=int, help="width in pixels, overrides --size")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="kruskal")
+    parser.add_argument("--braid", type=float, default=0.0, help="share of dead ends to open up, 0 to 1")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    height, width = args.height or args.size, args.width or args.size
+    if args.file.endswith(".raw"):
+        if args.algorithm == "eller":
+            rows = eller_rows(_cells(height), _cells(width), np.random.default_rng(args.seed), braid=args.braid)
+        else:
+            rows = generate(height, width, args.algorithm, args.braid, args.seed)
+        height = write_raw(args.file, rows)
+        print(f"{args.file}: --height {height} --width {2 * _cells(width) + 1}")
+    else:
+        from PIL import Image
+
+        Image.fromarray(generate(height, width, args.algorithm, args.braid, args.seed)).save(args.file)
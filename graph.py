@@ -0,0 +1,476 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Sequence
+
+import numpy as np
+
+import adjacency as adj
+
+Cell = tuple[int, int]
+
+
+class JunctionGraph:
+    """Maze reduced to a graph in compressed sparse row form. Junctions and dead
+    ends are vertices, the corridors between them are edges.
+
+    Vertex `v` sits at flat cell index `vertices[v]`, its outgoing edges are
+    `indptr[v]:indptr[v + 1]`. Every edge stores its target vertex, its length
+    in steps and the direction code it leaves its source in."""
+    def __init__(
+        self,
+        adjacency: np.ndarray,
+        vertices: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        lengths: np.ndarray,
+        directions: np.ndarray,
+    ):
+        self.adjacency = adjacency
+        self.shape = adjacency.shape
+        self.vertices = vertices
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.directions = directions
+
+    @property
+    def n_vertices(self) -> int:
+        return len(self.vertices)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    @classmethod
+    def build(
+        cls,
+        grid: np.ndarray,
+        adjacency: Optional[np.ndarray] = None,
+        forced: Optional[np.ndarray] = None,
+    ) -> "JunctionGraph":
+        """Reduce a boolean grid to its junction graph. Cells set in `forced`
+        become vertices even when they lie inside a corridor."""
+        grid = np.asarray(grid, dtype=bool)
+        if adjacency is None:
+            adjacency = adj.adjacency_map(grid)
+        is_vertex = grid & (adj.degree_map(adjacency) != 2)
+        if forced is not None:
+            is_vertex |= grid & forced
+        vertices = np.flatnonzero(is_vertex)
+
+        edges = _walk_corridors(adjacency, is_vertex, vertices)
+        return cls.from_edges(adjacency, vertices, *edges)
+
+    @classmethod
+    def build_parallel(
+        cls,
+        grid: np.ndarray,
+        adjacency: Optional[np.ndarray] = None,
+        workers: Optional[int] = None,
+        strips: Optional[int] = None,
+    ) -> "JunctionGraph":
+        """Same graph as `build`, built by `workers` processes on horizontal strips
+        of the maze held in shared memory. Every strip fills in its rows of the
+        adjacency map (unless it is given), finds its vertices and walks its
+        corridors up to the cells whose corridor crosses its top or bottom edge.
+        Neighbouring strips are then merged pairwise in rounds, again in the
+        workers, stitching the pieces of corridors across the boundary between
+        them. The parent only concatenates what the workers return."""
+        grid = np.asarray(grid, dtype=bool)
+        height = grid.shape[0]
+        workers = workers or os.cpu_count()
+        strips = min(strips or workers, height)
+        bounds = np.linspace(0, height, strips + 1).astype(int).tolist()
+
+        grid_memory = _share(grid)
+        adjacency_memory = _share(np.zeros(grid.shape, dtype=np.uint8) if adjacency is None else adjacency)
+        names = (grid_memory.name, adjacency_memory.name, grid.shape)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                jobs = [
+                    pool.submit(_strip_edges, *names, top, bottom, adjacency is None)
+                    for top, bottom in zip(bounds, bounds[1:])
+                ]
+                results = [job.result() for job in jobs]
+
+                stitched = []
+                groups = [(top, bottom, result[-1]) for top, bottom, result in zip(bounds, bounds[1:], results)]
+                while len(groups) > 1:
+                    jobs = [pool.submit(_merge_strips, *names, upper, lower) for upper, lower in zip(groups[::2], groups[1::2])]
+                    merged = [job.result() for job in jobs]
+                    stitched += [edges for edges, _ in merged]
+                    pairs = zip(groups[::2], groups[1::2], merged)
+                    groups = [(upper[0], lower[1], pieces) for upper, lower, (_, pieces) in pairs] + groups[len(jobs) * 2:]
+            if adjacency is None:
+                adjacency = np.ndarray(grid.shape, dtype=np.uint8, buffer=adjacency_memory.buf).copy()
+        finally:
+            for memory in (grid_memory, adjacency_memory):
+                memory.close()
+                memory.unlink()
+
+        # strips return their edges sorted and numbered from 0, so they only
+        # need to be shifted and put one after the other
+        offsets = np.cumsum([0] + [len(result[0]) for result in results])
+        vertices = np.concatenate([result[0] for result in results])
+        counts = np.concatenate([result[1] for result in results])
+        sources, targets = (
+            np.concatenate([result[i] + offset for result, offset in zip(results, offsets)]) for i in (2, 3)
+        )
+        lengths, directions = (np.concatenate([result[i] for result in results]) for i in (4, 5))
+
+        # corridors across strips go in where their source and direction sort
+        extra = [np.concatenate(columns) for columns in zip(*stitched)] if stitched else [np.zeros(0, dtype=np.int64)] * 4
+        extra_sources, extra_targets = np.searchsorted(vertices, extra[0]), np.searchsorted(vertices, extra[1])
+        keys = extra_sources * 4 + extra[3]
+        order = np.argsort(keys)
+        at = np.searchsorted(sources * 4 + directions, keys[order])
+        sources = np.insert(sources, at, extra_sources[order])
+        targets = np.insert(targets, at, extra_targets[order])
+        lengths = np.insert(lengths, at, extra[2][order])
+        directions = np.insert(directions, at, extra[3][order])
+        np.add.at(counts, extra_sources, 1)
+
+        indptr = np.zeros(len(vertices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            adjacency=adjacency,
+            vertices=vertices,
+            indptr=indptr,
+            indices=targets.astype(np.int32),
+            lengths=lengths.astype(np.int32),
+            directions=directions.astype(np.uint8),
+        )
+
+    @classmethod
+    def from_edges(
+        cls,
+        adjacency: np.ndarray,
+        vertices: np.ndarray,
+        sources: np.ndarray,
+        targets: np.ndarray,
+        lengths: np.ndarray,
+        directions: np.ndarray,
+    ) -> "JunctionGraph":
+        """Assemble the CSR arrays from an unordered edge list. Edges are sorted
+        by source and direction, so equal edge lists give equal graphs."""
+        order = np.lexsort((directions, sources))
+        counts = np.bincount(sources, minlength=len(vertices))
+        indptr = np.zeros(len(vertices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            adjacency=adjacency,
+            vertices=vertices,
+            indptr=indptr,
+            indices=np.asarray(targets, dtype=np.int32)[order],
+            lengths=np.asarray(lengths, dtype=np.int32)[order],
+            directions=np.asarray(directions, dtype=np.uint8)[order],
+        )
+
+    def vertex(self, cell: Cell) -> int:
+        """Vertex id of a cell, raises KeyError if the cell is not a vertex."""
+        flat = np.ravel_multi_index(cell, self.shape)
+        v = int(np.searchsorted(self.vertices, flat))
+        if v == len(self.vertices) or self.vertices[v] != flat:
+            raise KeyError(f"Not a vertex: {cell}")
+        return v
+
+    def cell(self, v: int) -> Cell:
+        row, col = divmod(int(self.vertices[v]), self.shape[1])
+        return row, col
+
+    def edges(self, v: int) -> range:
+        return range(self.indptr[v], self.indptr[v + 1])
+
+    def edge(self, u: int, v: int) -> int:
+        """Shortest edge from `u` to `v`."""
+        edges = [e for e in self.edges(u) if self.indices[e] == v]
+        if not edges:
+            raise KeyError(f"No edge between vertices {u} and {v}")
+        return min(edges, key=lambda e: self.lengths[e])
+
+    def find_path(self, source: int, target: int) -> list[int]:
+        """Vertices from `source` to `target` on the first route an exhaustive
+        traversal reaches `target` by, empty when it can't be reached."""
+        indptr, indices = self.indptr.tolist(), self.indices.tolist()
+        pred = [-1] * self.n_vertices
+        pred[source] = source
+        stack = [source]
+        while stack:
+            u = stack.pop()
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                if pred[v] < 0:
+                    pred[v] = u
+                    stack.append(v)
+
+        if pred[target] < 0:
+            return []
+        path = [target]
+        while path[-1] != source:
+            path.append(pred[path[-1]])
+        return path[::-1]
+
+    def expand(self, path: Sequence[int], edges: Optional[Sequence[int]] = None) -> list[Cell]:
+        """Cells along a path of vertices, both end points included. Takes the
+        shortest edge between two vertices unless the `edges` to take are given."""
+        if not path:
+            return []
+        if edges is None:
+            edges = [self.edge(u, v) for u, v in zip(path, path[1:])]
+        cells = [self.cell(path[0])]
+        for e in edges:
+            self.walk(cells[-1], int(self.directions[e]), int(self.lengths[e]), save_path_to=cells)
+        return cells
+
+    def runs(self, path: Sequence[int], edges: Optional[Sequence[int]] = None) -> list[tuple[int, int]]:
+        """(direction, steps) of the straight stretches along a path of vertices,
+        the route `expand` lists the cells of."""
+        if edges is None:
+            edges = [self.edge(u, v) for u, v in zip(path, path[1:])]
+        mask, width = self.adjacency.ravel(), self.shape[1]
+        steps = (-width, 1, width, -1)
+        vertices, directions = self.vertices.tolist(), self.directions.tolist()
+        runs = []
+        for u, v, e in zip(path, path[1:], edges):
+            runs += adj.corridor_runs(mask, steps, vertices[u], directions[e], vertices[v])
+        return runs
+
+    def walk(self, cell: Cell, direction: int, length: int, save_path_to: list) -> Cell:
+        """Follow a corridor for `length` steps, leaving `cell` in `direction`."""
+        row, col = cell
+        for _ in range(length):
+            d_row, d_col = adj.DELTAS[direction]
+            row += d_row
+            col += d_col
+            save_path_to.append((row, col))
+            mask = self.adjacency.item(row, col) ^ adj.BITS[adj.OPPOSITE[direction]]
+            if mask in adj.BIT_DIRECTION:
+                direction = adj.BIT_DIRECTION[mask]
+        return row, col
+
+
+def _walk_corridors(
+    adjacency: np.ndarray,
+    is_vertex: np.ndarray,
+    vertices: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Walk every corridor once, from the vertex it is first reached from.
+    Returns edge sources, targets, lengths and directions, both ways."""
+    width = adjacency.shape[1]
+    steps = (-width, 1, width, -1)
+    bits, opposite, bit_direction = adj.BITS, adj.OPPOSITE, adj.BIT_DIRECTION
+    mask = adjacency.ravel().tolist()
+    stop = is_vertex.ravel().tolist()
+    ids = dict(zip(vertices.tolist(), range(len(vertices))))
+
+    done = bytearray(len(vertices) * 4)
+    sources, targets, lengths, directions = [], [], [], []
+    for u, start in enumerate(vertices.tolist()):
+        for d in range(4):
+            if not mask[start] & bits[d] or done[u * 4 + d]:
+                continue
+            cell, direction, length = start, d, 0
+            while True:
+                cell += steps[direction]
+                length += 1
+                if stop[cell]:
+                    break
+                direction = bit_direction[mask[cell] ^ bits[opposite[direction]]]
+
+            v = ids[cell]
+            back = opposite[direction]
+            done[u * 4 + d] = done[v * 4 + back] = 1
+            sources += (u, v)
+            targets += (v, u)
+            lengths += (length, length)
+            directions += (d, back)
+
+    return (
+        np.asarray(sources, dtype=np.int64),
+        np.asarray(targets, dtype=np.int64),
+        np.asarray(lengths, dtype=np.int64),
+        np.asarray(directions, dtype=np.int64),
+    )
+
+
+def _share(array: np.ndarray) -> SharedMemory:
+    """Copy an array into a new block of shared memory."""
+    memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[:] = array
+    return memory
+
+
+def _strip_edges(
+    grid_name: str,
+    adjacency_name: str,
+    shape: tuple[int, int],
+    top: int,
+    bottom: int,
+    fill_adjacency: bool,
+) -> tuple[np.ndarray, ...]:
+    """Vertices (flat) of rows `top:bottom` of the maze in shared memory, their
+    number of edges inside the strip, and those edges sorted by source and
+    direction, with vertices numbered from 0 in the strip. With
+    `fill_adjacency`, the strip's rows of the shared adjacency map are
+    computed first. Cells on the strip edges whose corridor leads out of the
+    strip are stops too. The corridor pieces that start or end at one are
+    returned last, for _merge_strips."""
+    height, width = shape
+    grid_memory, adjacency_memory = SharedMemory(name=grid_name), SharedMemory(name=adjacency_name)
+    try:
+        grid = np.ndarray(shape, dtype=bool, buffer=grid_memory.buf)
+        adjacency = np.ndarray(shape, dtype=np.uint8, buffer=adjacency_memory.buf)
+        if fill_adjacency:
+            above, below = max(top - 1, 0), min(bottom + 1, height)
+            adjacency[top:bottom] = adj.adjacency_map(grid[above:below])[top - above:bottom - above]
+        strip = adjacency[top:bottom].copy()
+        is_vertex = grid[top:bottom] & (adj.degree_map(strip) != 2)
+        del grid, adjacency
+    finally:
+        grid_memory.close()
+        adjacency_memory.close()
+
+    vertices = np.flatnonzero(is_vertex)
+    stop = is_vertex.copy()
+    stop[0] |= (strip[0] & adj.BITS[adj.N]).astype(bool) & (top > 0)
+    stop[-1] |= (strip[-1] & adj.BITS[adj.S]).astype(bool) & (bottom < height)
+    stop &= strip > 0
+    # directions that leave the strip are not walked here, _merge_strips crosses them
+    leaving = np.zeros(strip.shape, dtype=np.uint8)
+    leaving[0] |= adj.BITS[adj.N] if top > 0 else 0
+    leaving[-1] |= adj.BITS[adj.S] if bottom < height else 0
+    mask = strip.ravel().tolist()
+    closed = leaving.ravel().tolist()
+
+    steps = (-width, 1, width, -1)
+    bits, opposite, bit_direction = adj.BITS, adj.OPPOSITE, adj.BIT_DIRECTION
+    is_stop = bytearray(stop.ravel().tobytes())
+    done = set()
+    starts, ends, lengths, departures, arrivals = [], [], [], [], []
+    for start in np.flatnonzero(stop).tolist():
+        for d in range(4):
+            if not mask[start] & bits[d] & ~closed[start] or start * 4 + d in done:
+                continue
+            cell, direction, length = start, d, 0
+            while True:
+                cell += steps[direction]
+                length += 1
+                if is_stop[cell]:
+                    break
+                direction = bit_direction[mask[cell] ^ bits[opposite[direction]]]
+
+            done.add(cell * 4 + opposite[direction])
+            starts += (start, cell)
+            ends += (cell, start)
+            lengths += (length, length)
+            departures += (d, opposite[direction])
+            arrivals += (direction, opposite[d])
+
+    starts, ends, lengths, departures, arrivals = (
+        np.asarray(column, dtype=np.int64) for column in (starts, ends, lengths, departures, arrivals)
+    )
+    vertex = is_vertex.ravel()
+    start_vertex, end_vertex = vertex[starts], vertex[ends]
+    whole = start_vertex & end_vertex
+    order = np.lexsort((departures[whole], starts[whole]))
+    sources = np.searchsorted(vertices, starts[whole][order])
+    rest = ~whole
+    offset = top * width
+    pieces = (
+        starts[rest] + offset,
+        departures[rest],
+        ends[rest] + offset,
+        lengths[rest],
+        arrivals[rest],
+        start_vertex[rest],
+        end_vertex[rest],
+    )
+    return (
+        vertices + offset,
+        np.bincount(sources, minlength=len(vertices)),
+        sources,
+        np.searchsorted(vertices, ends[whole][order]),
+        lengths[whole][order],
+        departures[whole][order],
+        pieces,
+    )
+
+
+def _merge_strips(
+    grid_name: str,
+    adjacency_name: str,
+    shape: tuple[int, int],
+    upper: tuple[int, int, tuple[np.ndarray, ...]],
+    lower: tuple[int, int, tuple[np.ndarray, ...]],
+) -> tuple[tuple[np.ndarray, ...], tuple[np.ndarray, ...]]:
+    """Join the corridor pieces of two neighbouring groups of strips, each given
+    as (top, bottom, pieces), across the boundary between them. Returns the
+    edges (flat source and target, length, direction) of the corridors that
+    now run from vertex to vertex, and the pieces of the merged group, which
+    start or end at a cell whose corridor leads out of it."""
+    height, width = shape
+    top, boundary, bottom = upper[0], upper[1], lower[1]
+    adjacency_memory = SharedMemory(name=adjacency_name)
+    try:
+        adjacency = np.ndarray(shape, dtype=np.uint8, buffer=adjacency_memory.buf)
+        # corridor pieces only start or end on the outer rows of a group
+        rows = {row: adjacency[row].tolist() for row in (top, boundary - 1, boundary, bottom - 1)}
+        del adjacency
+    finally:
+        adjacency_memory.close()
+
+    steps = (-width, 1, width, -1)
+    bits, opposite, bit_direction, degree = adj.BITS, adj.OPPOSITE, adj.BIT_DIRECTION, adj.DEGREE
+    columns = [np.concatenate(pair) for pair in zip(upper[2], lower[2])]
+    pieces = dict(zip(
+        (columns[0] * 4 + columns[1]).tolist(),
+        zip(columns[2].tolist(), columns[3].tolist(), columns[4].tolist(), columns[6].tolist()),
+    ))
+
+    def crosses(cell: int, direction: int) -> int:
+        """0 inside the group, 1 across the boundary, 2 out of the group."""
+        row = cell // width
+        if direction == adj.N and row == top and top > 0 or direction == adj.S and row == bottom - 1 and bottom < height:
+            return 2
+        return int(direction == adj.S and row == boundary - 1 or direction == adj.N and row == boundary)
+
+    def turn(cell: int, direction: int) -> int:
+        return bit_direction[rows[cell // width][cell % width] ^ bits[opposite[direction]]]
+
+    # corridors are followed from vertices, and from the cells on the outer rows
+    # whose corridor leads out of the group, back into it
+    firsts = [(start, d, True) for start, d in zip(columns[0][columns[5]].tolist(), columns[1][columns[5]].tolist())]
+    for row, d, vertex in ((boundary - 1, adj.S, True), (boundary, adj.N, True), (top, adj.N, False), (bottom - 1, adj.S, False)):
+        if not vertex and crosses(row * width, d) != 2:
+            continue
+        masks = np.asarray(rows[row], dtype=np.uint8)
+        cols = np.flatnonzero((masks & bits[d]).astype(bool) & ((adj.degree_map(masks) != 2) == vertex))
+        cells = (row * width + cols).tolist()
+        firsts += [(cell, d if vertex else turn(cell, opposite[d]), vertex) for cell in cells]
+
+    edges, joined = [], []
+    for start, d, start_vertex in firsts:
+        cell, direction, length = start, d, 0
+        while True:
+            if crosses(cell, direction) == 1:
+                cell += steps[direction]
+                length += 1
+                at_vertex = degree[rows[cell // width][cell % width]] != 2
+            else:
+                cell, piece, direction, at_vertex = pieces[cell * 4 + direction]
+                length += piece
+            if at_vertex:
+                break
+            leaving = turn(cell, direction)
+            if crosses(cell, leaving) == 2:
+                break
+            direction = leaving
+        if start_vertex and at_vertex:
+            edges.append((start, cell, length, d))
+        else:
+            joined.append((start, d, cell, length, direction, start_vertex, at_vertex))
+
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 4).T
+    joined = np.asarray(joined, dtype=np.int64).reshape(-1, 7).T
+    return tuple(edges), (*joined[:5], joined[5].astype(bool), joined[6].astype(bool))
@@ -1,21 +1,32 @@
 import numpy as np
 
-from PIL import Image
 
+def load_grid(png: str, inverted: bool = False, packed: bool = False) -> np.ndarray:
+    """Load a maze image as a boolean array where white pixels are path.
+    With `packed`, rows are returned bit-packed as by `np.packbits(..., axis=1)`."""
+    from PIL import Image  # only here, so importing the solver doesn't load PIL
 
-def get_maze_path(png: str, inverted: bool = False):
-    with Image.open(png).convert("RGB") as img:
-        array = np.array(img).tolist()
-
-        wall = [255, 255, 255]
+    with Image.open(png) as img:
+        if img.mode == "1":
+            grid = np.array(img)
+        elif img.mode == "L":
+            grid = np.array(img) == 255
+        elif img.mode in ("RGB", "RGBA"):
+            grid = (np.array(img)[..., :3] == 255).all(axis=-1)
+        else:
+            grid = (np.array(img.convert("RGB")) == 255).all(axis=-1)
 
-        maze_wall_matrix = []
-        for row in array:
-            maze_wall_matrix.append((cell == wall for cell in row))
+    if inverted:
+        grid = ~grid
+    if packed:
+        return np.packbits(grid, axis=1)
+    return grid
 
-        maze_wall_matrix = tuple((tuple(row) for row in maze_wall_matrix))
 
-        return maze_wall_matrix
+def get_maze_path(png: str, inverted: bool = False):
+    """Load a maze image as a tuple matrix of bools. Kept for callers that
+    expect the tuple form, prefer `load_grid`."""
+    return tuple(tuple(row) for row in load_grid(png, inverted=inverted).tolist())
 
 
 def print_maze(matrix, ch="H", sep=" "):
@@ -0,0 +1,123 @@
+import cProfile
+import json
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ExitStack
+from functools import wraps
+from types import ModuleType
+from typing import Optional
+
+# Stages of solving that are timed. Phases nest: "solve" includes the others
+PHASES = (
+    "solve",
+    "prune_dead_ends",
+    "find_exit_cells",
+    "create_nodes",
+    "find_solution",
+    "build_graph",
+    "solve_graph",
+    "solve_search",
+    "solve_shortest",
+)
+
+
+class Instrument:
+    """Opt-in counters, timings and allocation peaks for every Maze solved while
+    the context is active:
+
+        with Instrument() as instrument:
+            maze = solve_file("maze.png")
+        print(instrument.to_json())
+
+    Counting is done by the solver itself (see solve.COUNTS), in the adjacency
+    and node index lookups every engine runs, and is switched on by setting
+    `solve.counters`. Phases are timed by wrapping their methods, which are put
+    back on exit, so solving costs nothing extra outside the context. With
+    `profile`, a cProfile of the "solve" phase is written there. `module` is the
+    solve module to instrument, for when it runs as __main__."""
+    def __init__(self, memory: bool = True, profile: Optional[str] = None, module: Optional[ModuleType] = None):
+        if module is None:
+            import solve as module
+        self.module = module
+        self.memory = memory
+        self.profile = profile
+        self.counts: Counter = Counter(dict.fromkeys(module.COUNTS, 0))
+        self.phases: dict[str, dict] = {}
+        self._running: list[list] = []  # [name, start time, traced at start, peak so far]
+        self._profiler: Optional[cProfile.Profile] = None
+        self._stack: Optional[ExitStack] = None
+
+    def __enter__(self) -> "Instrument":
+        maze, validator = self.module.Maze, self.module.Validator
+        self._stack = ExitStack()
+        self._set(self.module, "counters", self.counts)
+        for name in PHASES:
+            self._wrap(maze, name, self._phase(name, getattr(maze, name)))
+        self._wrap(validator, "validate", self._phase("validate", validator.validate))
+        for name in ("load_grid", "load_packed"):
+            self._wrap(self.module.formats, name, self._phase("load_grid", getattr(self.module.formats, name)))
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._stack.callback(tracemalloc.stop)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stack.close()
+
+    def report(self) -> dict:
+        """Every counter, zero when nothing was counted, and the phases that ran."""
+        return {"counts": {name: self.counts[name] for name in self.module.COUNTS}, "phases": self.phases}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.report(), **kwargs)
+
+    def _set(self, owner, name: str, value) -> None:
+        """Set an attribute until the context exits."""
+        original = vars(owner)[name]
+        setattr(owner, name, value)
+        self._stack.callback(setattr, owner, name, original)
+
+    def _wrap(self, owner, name: str, wrapper) -> None:
+        if isinstance(vars(owner).get(name), staticmethod):
+            wrapper = staticmethod(wrapper)
+        self._set(owner, name, wrapper)
+
+    def _phase(self, name: str, function):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            self._enter_phase(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._exit_phase(name)
+        return timed
+
+    def _enter_phase(self, name: str) -> None:
+        traced = 0
+        if tracemalloc.is_tracing():
+            traced, peak = tracemalloc.get_traced_memory()
+            if self._running:
+                self._running[-1][3] = max(self._running[-1][3], peak)
+            tracemalloc.reset_peak()
+        if name == "solve" and self.profile and self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._running.append([name, time.perf_counter(), traced, traced])
+
+    def _exit_phase(self, name: str) -> None:
+        _, start, traced, peak = self._running.pop()
+        elapsed = time.perf_counter() - start
+        if self._profiler is not None and name == "solve" and not any(p[0] == "solve" for p in self._running):
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile)
+            self._profiler = None
+
+        phase = self.phases.setdefault(name, {"calls": 0, "time": 0.0})
+        phase["calls"] += 1
+        phase["time"] += elapsed
+        if tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            phase["peak"] = max(phase.get("peak", 0), peak - traced)
+            if self._running:
+                self._running[-1][3] = max(self._running[-1][3], peak)
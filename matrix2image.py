@@ -1,22 +1,153 @@
-from PIL import Image, ImageDraw, ImageOps
+import struct
+import zlib
+from typing import Callable, Iterator, Optional
 
+import numpy as np
 
-def create_png(path: str, size: tuple[int, int], matrix: list, solution: list):
-    png = Image.new(mode="RGB", size=size, color=(0, 0, 0))
-    draw = ImageDraw.Draw(png, mode="RGB")
-    for cell in matrix:
-        draw.point(xy=cell, fill=(255, 255, 255))
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
-    red_base, green_base = 255, 0
-    gradient_increment = 255 / len(solution)
-    for i, cell in enumerate(solution):
-        red = red_base - round(i * gradient_increment)
-        green = green_base + round(i * gradient_increment)
-        red = 0 if red < 0 else red
-        green = 255 if green > 255 else green
-        draw.point(xy=cell, fill=(red, green, 0))
+# PNG colour types and row filters
+GREYSCALE, RGB, PALETTE = 0, 2, 3
+FILTER_NONE, FILTER_UP = 0, 2
 
-    png = png.rotate(angle=270)  # row/col != xy
-    png = ImageOps.mirror(png)
 
-    png.save(path)
+def gradient(indexes: np.ndarray, length: int) -> np.ndarray:
+    """Green component of the solution gradient at the given solution indexes,
+    red is its complement. Matches `round(i * 255 / length)`."""
+    return np.rint(np.asarray(indexes) * (255 / length)).astype(np.uint8)
+
+
+def render(grid, solution) -> np.ndarray:
+    """RGB array of a maze: paths white, walls black and the solution as a
+    gradient from red at its first cell to green at its last."""
+    grid = np.asarray(getattr(grid, "array", grid), dtype=bool)
+    pixels = np.zeros(grid.shape + (3,), dtype=np.uint8)
+    pixels[grid] = 255
+
+    cells = np.asarray(solution, dtype=np.int64).reshape(-1, 2)
+    if len(cells):
+        green = np.rint(np.linspace(0, 255, len(cells), endpoint=False)).astype(np.uint8)
+        pixels[cells[:, 0], cells[:, 1]] = np.stack([255 - green, green, np.zeros_like(green)], axis=1)
+    return pixels
+
+
+def create_png(path: str, grid, solution) -> None:
+    """Save a maze with its solution drawn on it. `grid` is a boolean array (or
+    a Matrix), `solution` a sequence of (row, col) cells."""
+    from PIL import Image
+
+    Image.fromarray(render(grid, solution), mode="RGB").save(path)
+
+
+def stream_png(
+    path: str,
+    grid,
+    solution,
+    width: Optional[int] = None,
+    strip: int = 256,
+    layer_path: Optional[str] = None,
+    level: int = 6,
+) -> None:
+    """Save a maze with its solution like `create_png`, encoding it strip by strip
+    so memory stays proportional to a strip of rows instead of the image.
+
+    `grid` is a boolean array, a Matrix or, when `width` is given, rows packed
+    with `np.packbits(..., axis=1)` (e.g. a memory-mapped raw bitmap). With
+    `layer_path`, `path` becomes a 1-bit black and white image of the maze and
+    the solution is written to `layer_path` as a palette image that is
+    transparent everywhere else, to be laid over the maze."""
+    rows, height, width = _row_reader(grid, width)
+    cells = np.asarray(solution, dtype=np.int64).reshape(-1, 2)
+    strips = _solution_strips(cells, height, strip)
+
+    if layer_path is None:
+        header = _header(width, height, bit_depth=8, colour_type=RGB)
+        _write_png(path, header, _rgb_rows(rows, height, width, strip, strips, len(cells)), level)
+        return
+
+    header = _header(width, height, bit_depth=1, colour_type=PALETTE)
+    palette = _chunk(b"PLTE", bytes((0, 0, 0, 255, 255, 255)))
+    _write_png(path, header + palette, _bit_rows(rows, height, strip), level)
+
+    # index 0 is transparent, 1 to 255 spread the red to green gradient
+    green = np.rint(np.arange(255) * (255 / 254)).astype(np.uint8)
+    colours = np.stack([255 - green, green, np.zeros_like(green)], axis=1)
+    palette = _chunk(b"PLTE", bytes(3) + colours.tobytes()) + _chunk(b"tRNS", b"\x00")
+    header = _header(width, height, bit_depth=8, colour_type=PALETTE)
+    _write_png(layer_path, header + palette, _layer_rows(height, width, strip, strips, len(cells)), level)
+
+
+def _row_reader(grid, width: Optional[int]) -> tuple[Callable[[int, int], np.ndarray], int, int]:
+    """Function returning rows `start:end` packed 8 cells per byte, with the
+    height and width of the grid."""
+    if width is None and hasattr(grid, "packed"):
+        grid, width = grid.packed, grid.width
+    if width is not None:
+        return lambda start, end: np.asarray(grid[start:end]), grid.shape[0], width
+
+    grid = np.asarray(getattr(grid, "matrix", grid), dtype=bool)
+    return lambda start, end: np.packbits(grid[start:end], axis=1), grid.shape[0], grid.shape[1]
+
+
+def _solution_strips(cells: np.ndarray, height: int, strip: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Solution cells and their indexes along the solution, grouped per strip."""
+    order = np.argsort(cells[:, 0], kind="stable")
+    bounds = np.searchsorted(cells[order, 0], np.arange(0, height + strip, strip))
+    return [(cells[order[a:b]], order[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+
+def _rgb_rows(rows, height: int, width: int, strip: int, strips, length: int) -> Iterator[bytes]:
+    previous = np.zeros((1, width * 3), dtype=np.uint8)
+    for i, start in enumerate(range(0, height, strip)):
+        end = min(start + strip, height)
+        grid = np.unpackbits(rows(start, end), axis=1, count=width).view(bool)
+        pixels = np.zeros((end - start, width, 3), dtype=np.uint8)
+        pixels[grid] = 255
+        cells, indexes = strips[i]
+        if len(cells):
+            green = gradient(indexes, length)
+            pixels[cells[:, 0] - start, cells[:, 1]] = np.stack([255 - green, green, np.zeros_like(green)], axis=1)
+
+        pixels = pixels.reshape(end - start, width * 3)
+        filtered = pixels - np.concatenate([previous, pixels[:-1]])  # wraps modulo 256
+        previous = pixels[-1:]
+        yield _filtered(filtered, FILTER_UP)
+
+
+def _bit_rows(rows, height: int, strip: int) -> Iterator[bytes]:
+    for start in range(0, height, strip):
+        yield _filtered(rows(start, min(start + strip, height)), FILTER_NONE)
+
+
+def _layer_rows(height: int, width: int, strip: int, strips, length: int) -> Iterator[bytes]:
+    for i, start in enumerate(range(0, height, strip)):
+        end = min(start + strip, height)
+        layer = np.zeros((end - start, width), dtype=np.uint8)
+        cells, indexes = strips[i]
+        if len(cells):
+            layer[cells[:, 0] - start, cells[:, 1]] = 1 + (gradient(indexes, length).astype(np.uint16) * 254 + 127) // 255
+        yield _filtered(layer, FILTER_NONE)
+
+
+def _filtered(rows: np.ndarray, filter_type: int) -> bytes:
+    """Rows prefixed with their filter type byte, as PNG expects them."""
+    return np.hstack([np.full((len(rows), 1), filter_type, dtype=np.uint8), rows]).tobytes()
+
+
+def _header(width: int, height: int, bit_depth: int, colour_type: int) -> bytes:
+    return _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, colour_type, 0, 0, 0))
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _write_png(path: str, header: bytes, rows: Iterator[bytes], level: int) -> None:
+    compressor = zlib.compressobj(level)
+    with open(path, "wb") as file:
+        file.write(PNG_SIGNATURE + header)
+        for data in rows:
+            compressed = compressor.compress(data)
+            if compressed:
+                file.write(_chunk(b"IDAT", compressed))
+        file.write(_chunk(b"IDAT", compressor.flush()) + _chunk(b"IEND", b""))
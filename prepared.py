@@ -0,0 +1,256 @@
+import heapq
+import math
+from collections import defaultdict
+from typing import Iterable, Optional
+
+import numpy as np
+
+import adjacency as adj
+import connectivity
+import search
+from graph import JunctionGraph
+
+Cell = tuple[int, int]
+
+# (vertex, corridor length to it, direction leaving the cell, direction entering the vertex from)
+Attachment = tuple[int, int, int, int]
+
+
+class PreparedMaze:
+    """Maze preprocessed once to answer many shortest path queries between
+    arbitrary path cells. Builds the junction graph and the distances from a few
+    landmark vertices, which give A* a lower bound on the remaining distance
+    through the triangle inequality (ALT).
+
+    A loop without any junction gets one of its cells as a vertex, so its cells
+    attach to the graph like those of any other corridor."""
+    def __init__(self, matrix, landmarks: int = 8):
+        grid = np.asarray(getattr(matrix, "array", matrix), dtype=bool)
+        self.grid = grid
+        self.adjacency = adj.adjacency_map(grid)
+        loops = self.loop_cells(grid, self.adjacency)
+        forced = np.zeros(grid.shape, dtype=bool)
+        forced.flat[loops] = True
+        self.graph = JunctionGraph.build(grid, adjacency=self.adjacency, forced=forced)
+        self.walker = search.CorridorWalker(self.adjacency, stops=loops.tolist())
+        self.neighbours = search.graph_neighbours(self.graph)
+        self.landmarks, self.landmark_dist = self.select_landmarks(landmarks)
+
+    @staticmethod
+    def loop_cells(grid: np.ndarray, adjacency: np.ndarray) -> np.ndarray:
+        """Flat index of the first cell of every component that is a single loop,
+        one with no junction or dead end in it."""
+        labels = connectivity.label_components(grid)
+        ends = np.unique(labels[grid & (adj.degree_map(adjacency) != 2)])
+        components, first = np.unique(labels.ravel(), return_index=True)
+        return first[(components >= 0) & ~np.isin(components, ends)]
+
+    def select_landmarks(self, amount: int) -> tuple[list[int], np.ndarray]:
+        """Pick landmarks far apart: every next one is the vertex farthest from
+        those already picked. Returns them with their distances to every vertex,
+        one row per landmark, vertex major so a vertex's distances are contiguous."""
+        if not self.graph.n_vertices:
+            return [], np.zeros((0, 0), dtype=np.int64)
+        landmarks = [0]
+        dist = [search.distances(self.graph, 0)]
+        nearest = np.where(dist[0] < 0, -1, dist[0])
+        while len(landmarks) < min(amount, self.graph.n_vertices):
+            v = int(np.argmax(nearest))
+            if nearest[v] <= 0:
+                break
+            landmarks.append(v)
+            dist.append(search.distances(self.graph, v))
+            nearest = np.where(dist[-1] < 0, nearest, np.minimum(nearest, dist[-1]))
+        return landmarks, np.ascontiguousarray(np.stack(dist, axis=1))
+
+    def attach(self, cell: Cell) -> list[Attachment]:
+        """Graph vertices a path cell connects to, with the corridor to each."""
+        row, col = cell
+        if not self.grid[row, col]:
+            raise ValueError(f"Not a path cell: {cell}")
+        flat = self.walker.flat(cell)
+        mask = self.adjacency.item(row, col)
+        if adj.DEGREE[mask] != 2 or flat in self.walker.stops:
+            return [(self.graph.vertex(cell), 0, -1, -1)]
+
+        attachments = []
+        self.walker.stops.add(flat)  # a corridor closing on itself ends here
+        try:
+            for d in range(4):
+                if mask & adj.BITS[d]:
+                    vertex, length, _, entry = self.walker.follow(flat, d)
+                    if vertex != flat:
+                        attachments.append((self.graph.vertex(self.walker.cell(vertex)), length, d, entry))
+        finally:
+            self.walker.stops.discard(flat)
+        return attachments
+
+    def distance(self, a: Cell, b: Cell) -> Optional[int]:
+        """Length of the shortest path from `a` to `b`, None if unreachable."""
+        found = self._query(a, b)
+        return found[0] if found else None
+
+    def shortest_path(self, a: Cell, b: Cell) -> list[Cell]:
+        """Cells on the shortest path from `a` to `b`, both included, empty if
+        unreachable."""
+        found = self._query(a, b)
+        if not found:
+            return []
+        _, direct, route, first, last = found
+        if direct is not None:
+            return direct
+        cells = [a]
+        if first[1]:
+            self.graph.walk(a, first[2], first[1], save_path_to=cells)
+        for e in route.via:
+            self.graph.walk(cells[-1], int(self.graph.directions[e]), int(self.graph.lengths[e]), save_path_to=cells)
+        if last[1]:
+            self.graph.walk(cells[-1], last[3], last[1], save_path_to=cells)
+        return cells
+
+    def distances(self, pairs: Iterable[tuple[Cell, Cell]]) -> np.ndarray:
+        """Shortest path lengths for many (a, b) pairs, -1 where unreachable.
+        Pairs are grouped by `a`, so every distinct start is searched only once."""
+        pairs = list(pairs)
+        result = np.full(len(pairs), -1, dtype=np.int64)
+        by_source: dict[Cell, list[int]] = defaultdict(list)
+        for i, (a, _) in enumerate(pairs):
+            by_source[tuple(a)].append(i)
+
+        for a, indexes in by_source.items():
+            sources = self.attach(a)
+            targets = {i: self.attach(pairs[i][1]) for i in indexes}
+            settled = self._settle(sources, {v for attachments in targets.values() for v, *_ in attachments})
+            for i, attachments in targets.items():
+                best = self._direct_length(a, sources, pairs[i][1], attachments)
+                for v, length, *_ in attachments:
+                    if v in settled and (best is None or settled[v] + length < best):
+                        best = settled[v] + length
+                if best is not None:
+                    result[i] = best
+        return result
+
+    def _query(self, a: Cell, b: Cell):
+        """Shortest path as (length, direct cells, route, first attachment, last
+        attachment). Direct cells are set when `a` and `b` share a corridor and
+        following it is shortest."""
+        a, b = tuple(a), tuple(b)
+        if a == b:
+            if not self.grid[a]:
+                raise ValueError(f"Not a path cell: {a}")
+            return 0, [a], None, None, None
+        sources, targets = self.attach(a), self.attach(b)
+        direct = self._direct_length(a, sources, b, targets)
+        found = self._astar(sources, targets, bound=direct)
+        if found is None or (direct is not None and direct <= found[0]):
+            if direct is None:
+                return
+            return direct, self._direct_cells(a, sources, b, targets), None, None, None
+        length, route, first, last = found
+        return length, None, route, first, last
+
+    def _astar(self, sources: list[Attachment], targets: list[Attachment], bound: Optional[int] = None):
+        """A* from the vertices around the start to those around the goal, with
+        the landmark lower bound as heuristic."""
+        if not sources or not targets:
+            return
+        heuristic = self._heuristic(targets)
+        ends = {}
+        for attachment in sorted(targets, key=lambda attachment: -attachment[1]):
+            ends[attachment[0]] = attachment  # shortest corridor to a vertex wins
+        dist, pred, via, first = {}, {}, {}, {}
+        heap = []
+        for attachment in sources:
+            v, length = attachment[0], attachment[1]
+            if length < dist.get(v, length + 1):
+                dist[v], pred[v], first[v] = length, None, attachment
+                heapq.heappush(heap, (length + heuristic(v), length, v))
+
+        best, best_vertex = bound, None
+        while heap:
+            f, g, u = heapq.heappop(heap)
+            if best is not None and f >= best:
+                break
+            if g > dist[u]:
+                continue  # outdated heap entry
+            if u in ends and (best is None or g + ends[u][1] < best):
+                best, best_vertex = g + ends[u][1], u
+            for v, length, e, _ in self.neighbours(u, -1):
+                g_v = g + length
+                if g_v < dist.get(v, g_v + 1):
+                    dist[v], pred[v], via[v], first[v] = g_v, u, e, first[u]
+                    heapq.heappush(heap, (g_v + heuristic(v), g_v, v))
+
+        if best_vertex is None:
+            return
+        vertices, labels = [best_vertex], []
+        while pred[vertices[-1]] is not None:
+            labels.append(via[vertices[-1]])
+            vertices.append(pred[vertices[-1]])
+        route = search.Route(vertices=vertices[::-1], via=labels[::-1], length=best, settled=len(dist))
+        return best, route, first[best_vertex], ends[best_vertex]
+
+    def _heuristic(self, targets: list[Attachment]):
+        """Lower bound on the distance to the nearest target through the landmarks.
+        A vertex a landmark reaches while it doesn't reach a target (or the other
+        way around) is in another component and gets an infinite bound."""
+        landmark_dist = self.landmark_dist
+        goals = [(landmark_dist[v].tolist(), length) for v, length, *_ in targets]
+
+        def heuristic(v: int) -> float:
+            dist = landmark_dist[v].tolist()
+            best = math.inf
+            for goal, offset in goals:
+                bound = 0
+                for d_v, d_goal in zip(dist, goal):
+                    if (d_v < 0) != (d_goal < 0):
+                        bound = math.inf
+                        break
+                    if abs(d_v - d_goal) > bound:
+                        bound = abs(d_v - d_goal)
+                best = min(best, bound + offset)
+            return best
+
+        return heuristic
+
+    def _settle(self, sources: list[Attachment], targets: set[int]) -> dict[int, int]:
+        """Dijkstra from the start until every target vertex is settled."""
+        settled, heap = {}, [(length, v) for v, length, *_ in sources]
+        heapq.heapify(heap)
+        remaining = set(targets)
+        while heap and remaining:
+            g, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled[u] = g
+            remaining.discard(u)
+            for v, length, *_ in self.neighbours(u, -1):
+                if v not in settled:
+                    heapq.heappush(heap, (g + length, v))
+        return settled
+
+    @staticmethod
+    def _direct_length(a: Cell, sources, b: Cell, targets) -> Optional[int]:
+        """Distance along the corridor when `a` and `b` lie in the same one."""
+        ends_a = {(v, entry): length for v, length, _, entry in sources if entry >= 0}
+        lengths = [
+            abs(ends_a[v, entry] - length)
+            for v, length, _, entry in targets
+            if (v, entry) in ends_a
+        ]
+        return min(lengths) if lengths else None
+
+    def _direct_cells(self, a: Cell, sources, b: Cell, targets) -> list[Cell]:
+        """Cells along the corridor `a` and `b` share, on its shortest side."""
+        ends_b = {(v, entry): length for v, length, _, entry in targets if entry >= 0}
+        shared = [
+            (abs(length - ends_b[v, entry]), length > ends_b[v, entry], direction)
+            for v, length, direction, entry in sources
+            if (v, entry) in ends_b
+        ]
+        length, a_is_farther, direction = min(shared, key=lambda side: (side[0], not side[1]))
+        if not a_is_farther:
+            return self._direct_cells(b, targets, a, sources)[::-1]
+        cells = [a]
+        self.graph.walk(a, direction, length, save_path_to=cells)
+        return cells
@@ -0,0 +1,38 @@
+from typing import Iterable
+
+import numpy as np
+
+import adjacency as adj
+
+
+def fill_dead_ends(grid: np.ndarray, keep: Iterable[tuple[int, int]] = ()) -> np.ndarray:
+    """Return a copy of `grid` with every dead end filled in with wall, until only
+    the corridors between the `keep` cells and loops remain. Dead ends are found
+    in one vectorized pass, then filled from a worklist as they shrink."""
+    grid = np.array(grid, dtype=bool)
+    width = grid.shape[1]
+    steps = (-width, 1, width, -1)
+    bits, opposite = adj.BITS, adj.OPPOSITE
+
+    adjacency = adj.adjacency_map(grid)
+    degree = adj.degree_map(adjacency)
+    kept = {row * width + col for row, col in keep}
+
+    mask = adjacency.ravel().tolist()
+    degrees = degree.ravel().tolist()
+    worklist = [i for i in np.flatnonzero(grid & (degree <= 1)).tolist() if i not in kept]
+    filled = []
+    while worklist:
+        i = worklist.pop()
+        filled.append(i)
+        for d in range(4):
+            if not mask[i] & bits[d]:
+                continue
+            j = i + steps[d]
+            mask[j] ^= bits[opposite[d]]
+            degrees[j] -= 1
+            if degrees[j] == 1 and j not in kept:
+                worklist.append(j)
+
+    grid.ravel()[filled] = False
+    return grid
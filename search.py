@@ -0,0 +1,324 @@
+import heapq
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+import adjacency as adj
+from graph import JunctionGraph
+
+Cell = tuple[int, int]
+
+# Callable returning (vertex, length, via, entry) for every corridor leaving a
+# vertex, given the entry the vertex was reached with (or -1). `via` labels the
+# corridor taken: its direction code for a CorridorWalker, its edge id in a graph.
+Neighbours = Callable[[int, int], Iterable[tuple[int, int, int, int]]]
+
+
+@dataclass
+class Route:
+    vertices: list[int]
+    via: list[int]  # corridor taken from each vertex towards the next one
+    length: int
+    settled: int
+
+
+class CorridorWalker:
+    """Follows corridors of an adjacency map lazily, only when a search asks for
+    the neighbours of a vertex. Vertices are flat cell indices."""
+    def __init__(self, adjacency: np.ndarray, stops: Iterable[int] = ()):
+        self.shape = adjacency.shape
+        self.width = adjacency.shape[1]
+        self.size = adjacency.size
+        self.mask = adjacency.ravel()
+        self.steps = (-self.width, 1, self.width, -1)
+        self.stops = set(stops)
+
+    def flat(self, cell: Cell) -> int:
+        row, col = cell
+        return row * self.width + col
+
+    def cell(self, flat: int) -> Cell:
+        row, col = divmod(flat, self.width)
+        return row, col
+
+    def neighbours(self, vertex: int, entry: int = -1) -> list[tuple[int, int, int, int]]:
+        mask = self.mask.item(vertex)
+        return [self.follow(vertex, d) for d in range(4) if mask & adj.BITS[d] and d != entry]
+
+    def follow(self, vertex: int, direction: int) -> tuple[int, int, int, int]:
+        """Walk a corridor to the next vertex. Returns that vertex, the corridor
+        length, the direction it was left in and the direction it was entered from."""
+        mask, steps, stops = self.mask, self.steps, self.stops
+        bits, opposite, degree = adj.BITS, adj.OPPOSITE, adj.DEGREE
+        cell, d, length = vertex, direction, 0
+        while True:
+            cell += steps[d]
+            length += 1
+            m = mask.item(cell)
+            if degree[m] != 2 or cell in stops:
+                return cell, length, direction, opposite[d]
+            d = adj.BIT_DIRECTION[m ^ bits[opposite[d]]]
+
+    def expand(self, route: Route) -> list[Cell]:
+        """Cells along a route, both end points included."""
+        cells = [self.cell(route.vertices[0])]
+        mask, bits, opposite = self.mask, adj.BITS, adj.OPPOSITE
+        row, col = cells[0]
+        for v, d in zip(route.vertices[1:], route.via):
+            while True:
+                d_row, d_col = adj.DELTAS[d]
+                row += d_row
+                col += d_col
+                cells.append((row, col))
+                if row * self.width + col == v:
+                    break
+                d = adj.BIT_DIRECTION[mask.item(row * self.width + col) ^ bits[opposite[d]]]
+        return cells
+
+    def runs(self, route: Route) -> list[tuple[int, int]]:
+        """(direction, steps) of the straight stretches along a route, the cells
+        of which `expand` lists."""
+        runs = []
+        for u, v, d in zip(route.vertices, route.vertices[1:], route.via):
+            runs += adj.corridor_runs(self.mask, self.steps, u, d, v)
+        return runs
+
+
+def bfs(neighbours: Neighbours, source: int, target: int, size: int) -> Optional[Route]:
+    """Breadth first search on a deque, by number of corridors. Stops as soon as
+    `target` is reached."""
+    dist, pred, via, entry = _arrays(size, source)
+    if source == target:
+        return _route(dist, pred, via, source, target, 0)
+    queue = deque([source])
+    settled = 0
+    while queue:
+        u = queue.popleft()
+        settled += 1
+        for v, length, label, entered in neighbours(u, entry.item(u)):
+            if pred.item(v):
+                continue
+            dist[v] = dist.item(u) + length
+            pred[v] = u + 1
+            via[v] = label
+            entry[v] = entered
+            if v == target:  # first discovery is final in a breadth first search
+                return _route(dist, pred, via, source, target, settled)
+            queue.append(v)
+
+
+def astar(
+    neighbours: Neighbours,
+    source: int,
+    target: int,
+    size: int,
+    heuristic: Callable[[int], int] = lambda _: 0,
+) -> Optional[Route]:
+    """A* on a binary heap with corridor lengths as edge weights. Stops as soon
+    as `target` is settled. Dijkstra without a heuristic."""
+    dist, pred, via, entry = _arrays(size, source)
+    heap = [(heuristic(source), 0, source)]
+    settled = 0
+    while heap:
+        _, g, u = heapq.heappop(heap)
+        if g > dist.item(u):
+            continue  # outdated heap entry
+        settled += 1
+        if u == target:
+            return _route(dist, pred, via, source, target, settled)
+        for v, length, label, entered in neighbours(u, entry.item(u)):
+            g_v = g + length
+            if not pred.item(v) or g_v < dist.item(v):
+                dist[v] = g_v
+                pred[v] = u + 1
+                via[v] = label
+                entry[v] = entered
+                heapq.heappush(heap, (g_v + heuristic(v), g_v, v))
+
+
+def manhattan(walker: CorridorWalker, target: int) -> Callable[[int], int]:
+    row_target, col_target = walker.cell(target)
+    width = walker.width
+
+    def heuristic(v: int) -> int:
+        row, col = divmod(v, width)
+        return abs(row - row_target) + abs(col - col_target)
+
+    return heuristic
+
+
+def graph_neighbours(graph: JunctionGraph) -> Neighbours:
+    """Neighbours of a junction graph vertex, labelled by edge id."""
+    indptr, indices, lengths = graph.indptr.tolist(), graph.indices.tolist(), graph.lengths.tolist()
+
+    def neighbours(u: int, _: int) -> list[tuple[int, int, int, int]]:
+        return [(indices[e], lengths[e], e, -1) for e in range(indptr[u], indptr[u + 1])]
+
+    return neighbours
+
+
+def graph_manhattan(graph: JunctionGraph, target: int) -> Callable[[int], int]:
+    width = graph.shape[1]
+    vertices = graph.vertices.tolist()
+    row_target, col_target = divmod(vertices[target], width)
+
+    def heuristic(v: int) -> int:
+        row, col = divmod(vertices[v], width)
+        return abs(row - row_target) + abs(col - col_target)
+
+    return heuristic
+
+
+def shortest_path(graph: JunctionGraph, source: int, target: int) -> Optional[Route]:
+    """Shortest route by corridor length between two vertices of a junction graph,
+    found with A* and a Manhattan heuristic. Route.via holds edge ids."""
+    return astar(graph_neighbours(graph), source, target, graph.n_vertices, graph_manhattan(graph, target))
+
+
+def distances(graph: JunctionGraph, source: int) -> np.ndarray:
+    """Corridor length from `source` to every vertex (Dijkstra), -1 if unreachable."""
+    indptr, indices, lengths = graph.indptr.tolist(), graph.indices.tolist(), graph.lengths.tolist()
+    dist = [-1] * graph.n_vertices
+    heap = [(0, source)]
+    while heap:
+        g, u = heapq.heappop(heap)
+        if dist[u] >= 0:
+            continue
+        dist[u] = g
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            if dist[v] < 0:
+                heapq.heappush(heap, (g + lengths[e], v))
+    return np.asarray(dist, dtype=np.int64)
+
+
+def distances_between(graph: JunctionGraph, vertices: list[int]) -> np.ndarray:
+    """Corridor length from every one of `vertices` to every other (Dijkstra
+    from each), over routes that pass none of the others, -1 where there is
+    no such route."""
+    n = graph.n_vertices
+    indptr, indices, lengths = graph.indptr.tolist(), graph.indices.tolist(), graph.lengths.tolist()
+    edges = [list(zip(indices[indptr[u]:indptr[u + 1]], lengths[indptr[u]:indptr[u + 1]])) for u in range(n)]
+    position = [-1] * n
+    for i, vertex in enumerate(vertices):
+        position[vertex] = i
+    result = []
+    for source in vertices:
+        found = [-1] * len(vertices)
+        dist = [-1] * n
+        heap = [(0, source)]
+        while heap:
+            g, u = heapq.heappop(heap)
+            if dist[u] >= 0:
+                continue
+            dist[u] = g
+            if position[u] >= 0:
+                found[position[u]] = g
+                if u != source:
+                    continue  # leave routes through another vertex to its own search
+            for v, length in edges[u]:
+                if dist[v] < 0:
+                    heapq.heappush(heap, (g + length, v))
+        result.append(found)
+    return np.array(result, dtype=np.int64).reshape(len(vertices), len(vertices))
+
+
+def k_shortest_paths(graph: JunctionGraph, source: int, target: int, k: int) -> list[Route]:
+    """Up to `k` shortest loopless routes, shortest first (Yen's algorithm)."""
+    first = shortest_path(graph, source, target)
+    if first is None:
+        return []
+    neighbours = graph_neighbours(graph)
+    heuristic = graph_manhattan(graph, target)
+    lengths = graph.lengths.tolist()
+    routes = [first]
+    candidates: list[tuple[int, list[int], list[int]]] = []
+    seen = {tuple(first.via)}
+    while len(routes) < k:
+        previous = routes[-1]
+        banned_vertices: set[int] = set()
+        sharing = routes  # routes with the same root as `previous` up to the spur
+        root_length = 0
+        for j, spur in enumerate(previous.vertices[:-1]):
+            if j:
+                banned_vertices.add(previous.vertices[j - 1])
+                root_length += lengths[previous.via[j - 1]]
+                sharing = [
+                    route for route in sharing
+                    if len(route.via) > j and route.via[j - 1] == previous.via[j - 1]
+                ]
+            banned_edges = {route.via[j] for route in sharing}
+            route = _spur_search(neighbours, spur, target, heuristic, banned_vertices, banned_edges)
+            if route is None:
+                continue
+            via = previous.via[:j] + route.via
+            if tuple(via) in seen:
+                continue
+            seen.add(tuple(via))
+            heapq.heappush(candidates, (root_length + route.length, previous.vertices[:j] + route.vertices, via))
+
+        if not candidates:
+            break
+        length, vertices, via = heapq.heappop(candidates)
+        routes.append(Route(vertices=vertices, via=via, length=length, settled=0))
+    return routes
+
+
+def _spur_search(
+    neighbours: Neighbours,
+    source: int,
+    target: int,
+    heuristic: Callable[[int], int],
+    banned_vertices: set[int],
+    banned_edges: set[int],
+) -> Optional[Route]:
+    """A* around banned vertices and edges. Spur searches are many and mostly
+    local, so their state lives in dicts instead of graph sized arrays."""
+    dist, pred, via = {source: 0}, {source: source}, {}
+    heap = [(heuristic(source), 0, source)]
+    settled = 0
+    while heap:
+        _, g, u = heapq.heappop(heap)
+        if g > dist[u]:
+            continue  # outdated heap entry
+        settled += 1
+        if u == target:
+            vertices, labels = [target], []
+            while vertices[-1] != source:
+                labels.append(via[vertices[-1]])
+                vertices.append(pred[vertices[-1]])
+            return Route(vertices=vertices[::-1], via=labels[::-1], length=g, settled=settled)
+        for v, length, label, _ in neighbours(u, -1):
+            if v in banned_vertices or label in banned_edges:
+                continue
+            g_v = g + length
+            if g_v < dist.get(v, g_v + 1):
+                dist[v] = g_v
+                pred[v] = u
+                via[v] = label
+                heapq.heappush(heap, (g_v + heuristic(v), g_v, v))
+
+
+def _arrays(size: int, source: int) -> tuple[np.ndarray, ...]:
+    """Distance, predecessor, corridor and entry arrays of a search from `source`.
+    Predecessors are stored plus one so every array can start out as zeros, which
+    leaves the pages a search never touches unallocated."""
+    dist = np.zeros(size, dtype=np.int64)
+    pred = np.zeros(size, dtype=np.int64)
+    via = np.zeros(size, dtype=np.int32)
+    entry = np.zeros(size, dtype=np.int8)
+    pred[source] = source + 1
+    entry[source] = -1
+    return dist, pred, via, entry
+
+
+def _route(dist, pred, via, source, target, settled) -> Route:
+    vertices, labels = [target], []
+    while vertices[-1] != source:
+        labels.append(via.item(vertices[-1]))
+        vertices.append(pred.item(vertices[-1]) - 1)
+    vertices.reverse()
+    labels.reverse()
+    return Route(vertices=vertices, via=labels, length=dist.item(target), settled=settled)
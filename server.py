@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from cache import MazeCache
+from errors import MazeError
+
+# Protocol: one JSON object per line each way, over a Unix domain socket.
+#   {"op": "solve", "path": "maze.png"}  or  {"op": "solve", "data": "<base64 maze file>"}
+#     in any format of formats.py, told by the extension of the path or the first bytes of the data,
+#     optional "engine" ("graph" by default) and "id", answered with {"ok": true, "length": ...,
+#     "solution": {"start": ..., "directions": ..., "runs": ...}, "cached": ...}
+#     (see solution.Solution.from_json) or {"ok": false, "error": ..., "message": ...}
+#   {"op": "stats"}  counters, cache and queue depth
+#   {"op": "ping"}
+DEFAULT_SOCKET = "/tmp/maze-solver.sock"
+DEFAULT_ENGINE = "graph"  # unlike "nodes", terminates on mazes with loops
+
+
+def solve_maze(
+    source,
+    engine: str = DEFAULT_ENGINE,
+    cache_dir: Optional[str] = None,
+    cache_bytes: int = 1 << 30,
+) -> dict:
+    """Load, validate and solve one maze file, given by its path or its bytes,
+    in a worker. With `cache_dir`, the parsed maze and its junction graph are
+    kept in a MazeCache there, so any worker solving it with another engine
+    memory-maps them instead. Never raises, invalid mazes and crashes are
+    reported in the result like batch.solve_one."""
+    from solve import solve_file
+
+    start = time.perf_counter()
+    try:
+        cache = MazeCache(cache_dir, max_bytes=cache_bytes) if cache_dir else None
+        maze = solve_file(source, engine=engine, cache=cache)
+        result = {
+            "ok": True,
+            "shape": [maze.mx.height, maze.mx.width],
+            "length": maze.solution_length,
+            "solution": json.loads(maze.solution.to_json()),
+        }
+    except MazeError as error:
+        result = {"ok": False, "error": type(error).__name__, "message": str(error)}
+    except Exception as error:
+        result = {"ok": False, "error": type(error).__name__, "message": str(error), "crashed": True}
+    result["solve_time"] = time.perf_counter() - start
+    return result
+
+
+class SolveServer:
+    """Solves mazes sent over a Unix socket on a pool of worker processes
+    (`workers=0` solves on a thread of the server instead).
+
+    Results are kept in an LRU keyed by the SHA-256 of the maze and the engine,
+    so a maze seen before is answered without touching the pool, and identical
+    requests in flight share one solve. The workers keep the parsed mazes and
+    their junction graphs in a MazeCache in `cache_dir` (a temporary directory
+    removed on close by default), so a maze solved before with another engine
+    is not parsed or prepared again. At most `max_in_flight` mazes are
+    solved at once; up to `max_queue` more wait for a slot, beyond that
+    requests are turned away with a "Busy" error."""
+    def __init__(
+        self,
+        path: str = DEFAULT_SOCKET,
+        workers: Optional[int] = None,
+        cache_size: int = 256,
+        max_in_flight: Optional[int] = None,
+        max_queue: int = 1024,
+        cache_dir: Optional[str] = None,
+        cache_bytes: int = 1 << 30,
+    ):
+        self.path = path
+        self.workers = os.cpu_count() if workers is None else workers
+        self.cache_size = cache_size
+        self.max_in_flight = max_in_flight or max(self.workers, 1) * 2
+        self.max_queue = max_queue
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self.owns_cache_dir = False
+        self.cache: OrderedDict[tuple[str, str], dict] = OrderedDict()
+        self.running: dict[tuple[str, str], asyncio.Future] = {}
+        self.stats = dict.fromkeys(
+            ("connections", "requests", "solved", "errors", "cache_hits", "cache_misses", "rejected"), 0
+        )
+        self.queued = 0
+        self.in_flight = 0
+        self.executor: Optional[Executor] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> None:
+        if self.cache_dir is None:
+            self.cache_dir = tempfile.mkdtemp(prefix="maze-server-")
+            self.owns_cache_dir = True
+        if self.workers:
+            from batch import warm_up
+
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left over by a server that was killed
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path)
+
+    async def serve(self) -> None:
+        await self.start()
+        # closing removes the socket and the temporary cache, on kill too
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        if self.owns_cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            self.cache_dir, self.owns_cache_dir = None, False
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of one connection in order until it closes."""
+        self.stats["connections"] += 1
+        try:
+            while line := await reader.readline():
+                request = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request must be a JSON object")
+                    response = await self.dispatch(request)
+                except (ValueError, KeyError, TypeError, OSError) as error:  # bad request, not a bad maze
+                    response = {"ok": False, "error": type(error).__name__, "message": str(error)}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: dict) -> dict:
+        self.stats["requests"] += 1
+        op = request.get("op", "solve")
+        if op == "solve":
+            return await self.solve(request)
+        if op == "stats":
+            return {"ok": True, **self.metrics()}
+        if op == "ping":
+            return {"ok": True}
+        raise ValueError(f"Unknown op: {op}")
+
+    async def solve(self, request: dict) -> dict:
+        source = base64.b64decode(request["data"]) if "data" in request else request["path"]
+        # files are read and hashed on a thread, the pool only gets the path
+        digest = await asyncio.get_running_loop().run_in_executor(None, MazeCache.key, source)
+        key = (digest, request.get("engine", DEFAULT_ENGINE))
+
+        if key in self.cache:
+            self.stats["cache_hits"] += 1
+            self.cache.move_to_end(key)
+            return {**self.cache[key], "cached": True}
+        self.stats["cache_misses"] += 1
+        if key in self.running:  # the same maze is being solved for another request
+            return {**await asyncio.shield(self.running[key]), "cached": True}
+        if self.queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            return {"ok": False, "error": "Busy", "message": f"{self.queued} requests waiting already"}
+
+        future = asyncio.get_running_loop().create_future()
+        self.running[key] = future
+        try:
+            result = await self._run(source, key[1])
+            future.set_result(result)
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # retrieved, waiters get it from shield
+            raise
+        finally:
+            del self.running[key]
+
+        self.stats["solved" if result["ok"] else "errors"] += 1
+        if not result.get("crashed"):
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return {**result, "cached": False}
+
+    async def _run(self, source, engine: str) -> dict:
+        """Wait for a free slot, then solve on the pool."""
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, solve_maze, source, engine, self.cache_dir, self.cache_bytes
+            )
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "cache_entries": len(self.cache),
+            "workers": self.workers,
+        }
+
+
+class Client:
+    """Blocking client keeping one connection to a SolveServer open:
+
+        with Client() as client:
+            result = client.solve(path="maze.png")
+            solution = Solution.from_json(json.dumps(result["solution"]))"""
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: Optional[float] = None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+
+    def request(self, payload: dict) -> dict:
+        self.file.write(json.dumps(payload).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return json.loads(line)
+
+    def solve(self, path: Optional[str] = None, data: Optional[bytes] = None, engine: str = DEFAULT_ENGINE) -> dict:
+        """Solve a maze file the server can read at `path`, or one sent as bytes."""
+        if (path is None) == (data is None):
+            raise ValueError("Pass either a path or the maze data")
+        if data is not None:
+            return self.request({"op": "solve", "data": base64.b64encode(data).decode(), "engine": engine})
+        return self.request({"op": "solve", "path": os.path.abspath(path), "engine": engine})
+
+    def stats(self) -> dict:
+        return self.request({"op": "stats"})
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from solve import Maze
+
+    parser = argparse.ArgumentParser(description="Solve mazes on a long running server over a Unix socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="path of the Unix domain socket")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the server until interrupted")
+    serve_parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(), help="worker processes, 0 for none")
+    serve_parser.add_argument("--cache-size", type=int, default=256, help="solved mazes kept in memory")
+    serve_parser.add_argument("--max-in-flight", type=int, help="mazes solved at once, twice the workers by default")
+    serve_parser.add_argument("--max-queue", type=int, default=1024, help="requests waiting before Busy is returned")
+    serve_parser.add_argument("--cache-dir", help="parsed mazes and junction graphs, a temporary directory by default")
+    serve_parser.add_argument("--cache-bytes", type=int, default=1 << 30, help="size limit of the cache directory")
+
+    solve_parser = commands.add_parser("solve", help="solve mazes on a running server, one JSON line each")
+    solve_parser.add_argument("files", nargs="+")
+    solve_parser.add_argument("--engine", choices=Maze.ENGINES, default=DEFAULT_ENGINE)
+    solve_parser.add_argument("--send", action="store_true", help="send the file's bytes instead of the path")
+
+    commands.add_parser("stats", help="print the server's counters")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = SolveServer(
+            args.socket,
+            args.workers,
+            args.cache_size,
+            args.max_in_flight,
+            args.max_queue,
+            cache_dir=args.cache_dir,
+            cache_bytes=args.cache_bytes,
+        )
+        try:
+            asyncio.run(server.serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        return 0
+
+    with Client(args.socket) as client:
+        if args.command == "stats":
+            print(json.dumps(client.stats()))
+            return 0
+        failed = 0
+        for file in args.files:
+            if args.send:
+                with open(file, "rb") as maze:
+                    result = client.solve(data=maze.read(), engine=args.engine)
+            else:
+                result = client.solve(path=file, engine=args.engine)
+            failed += not result["ok"]
+            print(json.dumps({"file": file, **result}), flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
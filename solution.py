@@ -0,0 +1,175 @@
+import json
+import struct
+from collections.abc import Sequence
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+import adjacency as adj
+
+Cell = tuple[int, int]
+
+# Binary format: magic, start row and col (-1 when empty), number of segments,
+# then the segment directions as bytes and the runs as little endian uint32
+MAGIC = b"MZS1"
+HEADER = struct.Struct("<4siiI")
+
+LETTERS = "NESW"  # direction codes of adjacency.py in JSON
+
+# Direction code of a unit step, indexed by (d_row + 1) * 3 + d_col + 1
+_STEP_DIRECTION = np.full(9, -1, dtype=np.int8)
+for _direction, (_d_row, _d_col) in enumerate(adj.DELTAS):
+    _STEP_DIRECTION[(_d_row + 1) * 3 + _d_col + 1] = _direction
+_DELTAS = np.array(adj.DELTAS, dtype=np.int64)
+_OPPOSITE = np.array(adj.OPPOSITE, dtype=np.uint8)
+
+
+class Solution(Sequence):
+    """Route through a maze stored as straight segments: from `start`, move
+    `runs[i]` cells in `directions[i]` (adjacency.py codes) for every segment.
+
+    Behaves like the list of cells it stands for (len, indexing, iteration and
+    comparison with lists of (row, col) tuples), but cells are only produced on
+    demand: lazily by iterating, or all at once as an array by `to_cells`."""
+    def __init__(self, start: Optional[Cell] = None, directions: Iterable[int] = (), runs: Iterable[int] = ()):
+        directions = np.asarray(directions, dtype=np.uint8).ravel()
+        runs = np.asarray(runs, dtype=np.int64).ravel()
+        if len(directions) != len(runs):
+            raise ValueError("Every segment needs a direction and a run")
+        if start is None and len(runs):
+            raise ValueError("Segments need a start cell")
+
+        # merge successive segments in one direction, so every boundary is a turn
+        directions, runs = directions[runs > 0], runs[runs > 0]
+        if len(runs):
+            first = np.flatnonzero(np.r_[True, directions[1:] != directions[:-1]])
+            directions, runs = directions[first], np.add.reduceat(runs, first)
+
+        self.start = None if start is None else (int(start[0]), int(start[1]))
+        self.directions = directions
+        self.runs = runs.astype(np.uint32)
+        self.ends = np.cumsum(runs)  # index of the last cell of every segment
+        moves = _DELTAS[directions] * runs[:, None]
+        starts = np.cumsum(np.vstack([np.array([self.start or (0, 0)]), moves[:-1]]), axis=0)
+        self.rows, self.cols = starts[:, 0], starts[:, 1]
+
+    @classmethod
+    def from_cells(cls, cells) -> "Solution":
+        """Compress a sequence of neighbouring (row, col) cells."""
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        if not len(cells):
+            return cls()
+        steps = np.diff(cells, axis=0)
+        keys = (steps[:, 0] + 1) * 3 + steps[:, 1] + 1
+        valid = (np.abs(steps) <= 1).all(axis=1)
+        directions = np.where(valid, _STEP_DIRECTION[np.where(valid, keys, 0)], -1)
+        if (directions < 0).any():
+            raise ValueError("Successive cells must be neighbours")
+        return cls(cells[0], directions, np.ones(len(directions), dtype=np.int64))
+
+    @property
+    def length(self) -> int:
+        """Number of steps from the first to the last cell."""
+        return int(self.ends[-1]) if len(self.ends) else 0
+
+    def __len__(self) -> int:
+        return 0 if self.start is None else self.length + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [tuple(cell) for cell in self.to_cells()[index].tolist()]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("Solution index out of range")
+        if index == 0:
+            return self.start
+        segment = int(np.searchsorted(self.ends, index))
+        steps = index - int(self.ends[segment]) + int(self.runs[segment])
+        d_row, d_col = adj.DELTAS[self.directions[segment]]
+        return int(self.rows[segment]) + d_row * steps, int(self.cols[segment]) + d_col * steps
+
+    def __iter__(self) -> Iterator[Cell]:
+        if self.start is None:
+            return
+        yield self.start
+        segments = zip(self.rows.tolist(), self.cols.tolist(), self.directions.tolist(), self.runs.tolist())
+        for row, col, direction, run in segments:
+            d_row, d_col = adj.DELTAS[direction]
+            for step in range(1, run + 1):
+                yield row + d_row * step, col + d_col * step
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Solution):
+            return (
+                self.start == other.start
+                and np.array_equal(self.directions, other.directions)
+                and np.array_equal(self.runs, other.runs)
+            )
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Solution(start={self.start}, segments={len(self.runs)}, length={self.length})"
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        cells = self.to_cells()
+        return cells if dtype is None else cells.astype(dtype)
+
+    def to_cells(self) -> np.ndarray:
+        """Every cell in order as an (n, 2) int64 array."""
+        if self.start is None:
+            return np.empty((0, 2), dtype=np.int64)
+        steps = np.repeat(_DELTAS[self.directions], self.runs, axis=0)
+        return np.cumsum(np.vstack([np.array([self.start]), steps]), axis=0)
+
+    def turns(self) -> np.ndarray:
+        """Cells where the route changes direction as an (n, 2) array, without
+        the first and last cell."""
+        return np.stack([self.rows[1:], self.cols[1:]], axis=1)
+
+    def reversed(self) -> "Solution":
+        """The same route walked from its last cell to its first."""
+        if self.start is None:
+            return Solution()
+        d_row, d_col = adj.DELTAS[self.directions[-1]] if len(self.runs) else (0, 0)
+        run = int(self.runs[-1]) if len(self.runs) else 0
+        end = (int(self.rows[-1]) + d_row * run, int(self.cols[-1]) + d_col * run)
+        return Solution(end, _OPPOSITE[self.directions[::-1]], self.runs[::-1])
+
+    def shifted(self, rows: int, cols: int) -> "Solution":
+        """The same route moved by `rows` and `cols`."""
+        if self.start is None:
+            return Solution()
+        return Solution((self.start[0] + rows, self.start[1] + cols), self.directions, self.runs)
+
+    def to_bytes(self) -> bytes:
+        row, col = self.start or (-1, -1)
+        header = HEADER.pack(MAGIC, row, col, len(self.runs))
+        return header + self.directions.tobytes() + self.runs.astype("<u4").tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Solution":
+        data = bytes(data)
+        magic, row, col, count = HEADER.unpack_from(data)
+        if magic != MAGIC or len(data) != HEADER.size + 5 * count:
+            raise ValueError("Not a serialized solution")
+        directions = np.frombuffer(data, dtype=np.uint8, count=count, offset=HEADER.size)
+        runs = np.frombuffer(data, dtype="<u4", count=count, offset=HEADER.size + count)
+        return cls(None if row < 0 else (row, col), directions, runs)
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps({
+            "start": self.start,
+            "directions": "".join(LETTERS[d] for d in self.directions.tolist()),
+            "runs": self.runs.tolist(),
+        }, **kwargs)
+
+    @classmethod
+    def from_json(cls, text: str) -> "Solution":
+        data = json.loads(text)
+        return cls(data["start"], [LETTERS.index(letter) for letter in data["directions"]], data["runs"])
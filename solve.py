@@ -1,14 +1,23 @@
+import argparse
 import enum
 import os
-import sys
+from collections import Counter, deque
 from typing import Optional, Iterable
-from dataclasses import dataclass
 
-import image2matrix as i2m
-import matrix2image as m2i
+import numpy as np
+
+import adjacency as adj
+import connectivity
+import formats
+import search
+from cache import MazeCache
+from graph import JunctionGraph
+from prune import fill_dead_ends
+from solution import Solution
 from errors import (
     MatrixSizeError,
     PathCornerError,
+    PathDisconnectedError,
     PathExitAmountError,
     PathExitSpacingError,
 )
@@ -19,13 +28,8 @@ class Type:
     Row = tuple[bool, ...]
     Col = tuple[bool, ...]
     Matrix = tuple[Row, ...]
-
-
-@dataclass
-class Node:
-    cell: Type.Cell
-    origin: Optional["WindRose"]
-    checked: list["WindRose"]
+    Grid = np.ndarray
+    Cells = tuple[np.ndarray, np.ndarray]
 
 
 class WindRose(enum.Enum):
@@ -36,121 +40,393 @@ class WindRose(enum.Enum):
 
     @staticmethod
     def opposite(direction: "WindRose") -> "WindRose":
-        match direction:
-            case(WindRose.N):
-                return WindRose.S
-            case(WindRose.E):
-                return WindRose.W
-            case(WindRose.S):
-                return WindRose.N
-            case(WindRose.W):
-                return WindRose.E
+        return OPPOSITE[direction]
 
     @staticmethod
-    def all():
-        return [direction for direction in WindRose]
+    def all() -> tuple["WindRose", ...]:
+        return DIRECTIONS
+
+
+# WindRose of every adjacency.py direction code, and the other way around.
+# Codes map to themselves, so the solver core can pass either
+DIRECTIONS = tuple(WindRose)
+DIRECTION_CODE = {**{direction: code for code, direction in enumerate(DIRECTIONS)}, **{code: code for code in range(4)}}
+OPPOSITE = {direction: DIRECTIONS[adj.OPPOSITE[code]] for code, direction in enumerate(DIRECTIONS)}
+
+# Work counted while an instrument.Instrument is active, reported with zeros
+# for what didn't happen. `counters` is None otherwise, so the solver only pays
+# for a None check per corridor and node lookup
+COUNTS = (
+    "adjacency_lookups",
+    "corridors_walked",
+    "cells_walked",
+    "nodes_created",
+    "nodes_indexed",
+    "node_lookups",
+    "bst_searches",
+    "max_stack",
+    "vertices_settled",
+)
+counters: Optional[Counter] = None
+
+# Adjacency map bit of every direction and vice versa
+DIRECTION_BIT = {direction: bit for direction, bit in zip(WindRose, adj.BITS)}
+BIT_DIRECTION = {bit: direction for direction, bit in DIRECTION_BIT.items()}
+
+
+class Node:
+    """Junction, dead end or exit found by create_nodes. Stores its origin as
+    a direction code (-1 for none) and the directions already searched as an
+    adjacency style bitmask; `origin` and `checked` present them as WindRoses."""
+    __slots__ = ("cell", "origin_code", "mask")
+
+    def __init__(
+        self,
+        cell: Type.Cell,
+        origin: "Optional[WindRose | int]" = None,
+        checked: "Iterable[WindRose | int] | int" = (),
+    ):
+        self.cell = cell
+        self.origin_code = -1 if origin is None else DIRECTION_CODE[origin]
+        if not isinstance(checked, int):
+            checked = sum(adj.BITS[code] for code in {DIRECTION_CODE[direction] for direction in checked})
+        self.mask = checked
+
+    @property
+    def origin(self) -> Optional[WindRose]:
+        return None if self.origin_code < 0 else DIRECTIONS[self.origin_code]
+
+    @origin.setter
+    def origin(self, direction: "Optional[WindRose | int]") -> None:
+        self.origin_code = -1 if direction is None else DIRECTION_CODE[direction]
+
+    @property
+    def checked(self) -> "Checked":
+        return Checked(self)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Node):
+            return NotImplemented
+        return (self.cell, self.origin_code, self.mask) == (other.cell, other.origin_code, other.mask)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Node(cell={self.cell}, origin={self.origin}, checked={list(self.checked)})"
+
+
+class Checked:
+    """Live view of the directions a Node has searched, list-like for the
+    callers that used to get a list of WindRoses."""
+    __slots__ = ("node",)
+
+    def __init__(self, node: Node):
+        self.node = node
+
+    def __contains__(self, direction: "WindRose | int") -> bool:
+        return bool(self.node.mask & adj.BITS[DIRECTION_CODE[direction]])
+
+    def __len__(self) -> int:
+        return adj.DEGREE[self.node.mask]
+
+    def __iter__(self):
+        return (direction for code, direction in enumerate(DIRECTIONS) if self.node.mask & adj.BITS[code])
+
+    def append(self, direction: "WindRose | int") -> None:
+        self.node.mask |= adj.BITS[DIRECTION_CODE[direction]]
 
 
 class Matrix:
-    def __init__(self, matrix: Type.Matrix):
-        self.matrix = matrix
-        self.width = len(matrix[0])
-        self.height = len(matrix)
+    """Maze matrix stored as a contiguous boolean array (1 byte per cell)."""
+    def __init__(self, matrix: Type.Matrix | Type.Grid):
+        self.matrix = np.ascontiguousarray(matrix, dtype=bool)
+        self.height, self.width = self.matrix.shape
+
+    @property
+    def array(self) -> Type.Grid:
+        return self.matrix
 
-    def row(self, index: int) -> Type.Row:
+    def row(self, index: int) -> Type.Grid:
         i = index if index >= 0 else (index * -1) - 1  # equalize negative index
         if i >= self.height:
             raise IndexError(f"Index out of bounds: {index}")
         return self.matrix[index]
 
-    def col(self, index: int) -> Type.Col:
+    def col(self, index: int) -> Type.Grid:
         i = index if index >= 0 else (index * -1) - 1  # equalize negative index
         if i >= self.width:
             raise IndexError(f"Index out of bounds: {index}")
-        return tuple([row[index] for row in self.matrix])
+        return self.matrix[:, index]
 
     def cell(self, cell: Type.Cell):
-        row, col = cell
-        return self.matrix[row][col]
+        return self.matrix[cell]
+
+    def cells(self) -> Type.Cells:
+        return np.nonzero(self.matrix)
+
+
+class PackedMatrix(Matrix):
+    """Maze matrix stored bit-packed along its rows (1 bit per cell)."""
+    def __init__(self, matrix: Type.Matrix | Type.Grid):
+        grid = np.asarray(matrix, dtype=bool)
+        self.height, self.width = grid.shape
+        self.packed = np.packbits(grid, axis=1)
+
+    @classmethod
+    def from_packed(cls, packed: np.ndarray, width: int) -> "PackedMatrix":
+        """Wrap rows that were already packed with `np.packbits(..., axis=1)`."""
+        matrix = cls.__new__(cls)
+        matrix.packed = packed
+        matrix.height = packed.shape[0]
+        matrix.width = width
+        return matrix
+
+    @property
+    def array(self) -> Type.Grid:
+        return np.unpackbits(self.packed, axis=1, count=self.width).view(bool)
+
+    @property
+    def matrix(self) -> Type.Grid:
+        return self.array
+
+    def row(self, index: int) -> Type.Grid:
+        i = index if index >= 0 else (index * -1) - 1  # equalize negative index
+        if i >= self.height:
+            raise IndexError(f"Index out of bounds: {index}")
+        return np.unpackbits(self.packed[index], count=self.width).view(bool)
+
+    def col(self, index: int) -> Type.Grid:
+        i = index if index >= 0 else (index * -1) - 1  # equalize negative index
+        if i >= self.width:
+            raise IndexError(f"Index out of bounds: {index}")
+        col = index % self.width
+        return (self.packed[:, col >> 3] >> (7 - (col & 7)) & 1).view(bool)
 
-    def cells(self) -> list[Type.Cell]:
-        cells = []
-        for row in range(self.height):
-            for col in range(self.width):
-                if self.matrix[row][col]:
-                    cells.append((row, col))
-        return cells
+    def cell(self, cell: Type.Cell):
+        row, col = cell
+        col %= self.width
+        return bool(self.packed[row, col >> 3] >> (7 - (col & 7)) & 1)
 
 
 class Maze:
-    def __init__(self, matrix: Matrix):
+    INDEXES = ("dense", "sparse", "bst")
+    ENGINES = ("nodes", "graph", "bfs", "astar", "dijkstra")
+
+    def __init__(
+        self,
+        matrix: Matrix,
+        index: str = "dense",
+        adjacency: Optional[np.ndarray] = None,
+        exits: Optional[list[Type.Cell]] = None,
+        workers: int = 1,
+    ):
+        if index not in Maze.INDEXES:
+            raise ValueError(f"Unknown node index: {index}")
         self.mx = matrix
-        self.bst_root: BST = None
-        self.solution: list = []
+        self.adjacency = adj.adjacency_map(matrix.array) if adjacency is None else adjacency
+        self.index = index
+        self.exits = list(exits) if exits is not None else None  # as found by find_exit_cells
+        self.workers = workers  # processes building the junction graph
+        self.node_index: NodeIndex | BST = None
+        self.graph: JunctionGraph = None
+        self.solution: Solution = Solution()
+        self.solution_length: int = None
         self.node_start: Node = None
         self.node_end: Node = None
 
     WALL = False
     PATH = True
 
-    def solve(self):
+    def solve(self, engine: str = "nodes", prune: bool = False, crop: bool = False):
+        if engine not in Maze.ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        if crop:
+            self.solve_cropped(engine=engine, prune=prune)
+            return
+        if prune:
+            self.prune_dead_ends()
+        if engine == "graph":
+            self.solve_graph()
+            return
+        if engine in ("bfs", "astar"):
+            self.solve_search(method=engine)
+            return
+        if engine == "dijkstra":
+            self.solve_shortest()
+            return
         self.find_exit_cells()
         self.create_nodes()
         self.find_solution()
 
-    def find_solution(self) -> list[Type.Cell]:
-        solution = [self.node_end.cell]
+    def solve_cropped(self, engine: str = "nodes", prune: bool = False, labels: Optional[np.ndarray] = None) -> Solution:
+        """Solve only the bounding box of the component the exits are in, then
+        place the solution back in this maze. Takes the `labels` of
+        connectivity.label_components when they are known already."""
+        cell_start, cell_end = self.find_exit_cells()
+        if labels is None:
+            labels = connectivity.label_components(self.mx.array)
+        if labels[cell_start] != labels[cell_end]:
+            raise PathDisconnectedError("Exits are not connected")
+        grid, (row, col) = connectivity.crop_to_component(self.mx.array, cell_start, labels=labels)
+        exits = [(cell_row - row, cell_col - col) for cell_row, cell_col in (cell_start, cell_end)]
+        cropped = Maze(type(self.mx)(grid), index=self.index, exits=exits, workers=self.workers)
+        cropped.solve(engine=engine, prune=prune)
+        self.solution = cropped.solution.shifted(row, col)
+        self.solution_length = cropped.solution_length
+        return self.solution
+
+    def prune_dead_ends(self) -> None:
+        """Fill in every dead end except the exits, so that solving only has to
+        deal with the solution corridor and loops."""
+        grid = fill_dead_ends(self.mx.array, keep=self.find_exit_cells())
+        self.mx = type(self.mx)(grid)
+        self.adjacency = adj.adjacency_map(grid)
+        self.graph = None
+
+    def build_graph(self) -> JunctionGraph:
+        if self.workers > 1:
+            self.graph = JunctionGraph.build_parallel(self.mx.array, adjacency=self.adjacency, workers=self.workers)
+        else:
+            self.graph = JunctionGraph.build(self.mx.array, adjacency=self.adjacency)
+        return self.graph
+
+    def solve_graph(self) -> Solution:
+        """Search the junction graph and only walk the corridors of the route found,
+        keeping them as straight runs."""
+        cell_start, cell_end = self.find_exit_cells()
+        graph = self.graph or self.build_graph()
+        path = graph.find_path(graph.vertex(cell_end), graph.vertex(cell_start))
+        if not path:
+            raise PathDisconnectedError("Exits are not connected")
+        self.solution = Solution(cell_end, *zip(*graph.runs(path)))
+        self.solution_length = self.solution.length
+        return self.solution
+
+    def solve_search(self, method: str = "astar") -> Solution:
+        """Search from start to end, following corridors only when a junction is
+        expanded, and stop as soon as the end is reached."""
+        cell_start, cell_end = self.find_exit_cells()
+        walker = search.CorridorWalker(self.adjacency)
+        source, target = walker.flat(cell_start), walker.flat(cell_end)
+        if method == "bfs":
+            route = search.bfs(walker.neighbours, source, target, walker.size)
+        else:
+            heuristic = search.manhattan(walker, target)
+            route = search.astar(walker.neighbours, source, target, walker.size, heuristic)
+        if route is None:
+            raise PathDisconnectedError("Exits are not connected")
+        if counters is not None:
+            counters["vertices_settled"] += route.settled
+
+        self.solution = Solution(cell_start, *zip(*walker.runs(route))).reversed()  # end to start, like find_solution
+        self.solution_length = route.length
+        return self.solution
+
+    def solve_shortest(self) -> Solution:
+        """Shortest route by corridor length on the junction graph, also in mazes
+        with loops. The "dijkstra" engine; the search is A* with a Manhattan
+        heuristic, which finds the same lengths as Dijkstra but settles fewer
+        vertices."""
+        solutions = self.alternatives(k=1)
+        if not solutions:
+            raise PathDisconnectedError("Exits are not connected")
+        return solutions[0]
+
+    def alternatives(self, k: int) -> list[Solution]:
+        """Up to `k` shortest loopless routes from end to start, shortest first.
+        The shortest becomes the solution."""
+        cell_start, cell_end = self.find_exit_cells()
+        graph = self.graph or self.build_graph()
+        routes = search.k_shortest_paths(graph, graph.vertex(cell_end), graph.vertex(cell_start), k)
+        if not routes:
+            return []
+        if counters is not None:
+            counters["vertices_settled"] += routes[0].settled
+        solutions = [Solution(cell_end, *zip(*graph.runs(route.vertices, route.via))) for route in routes]
+        self.solution = solutions[0]
+        self.solution_length = routes[0].length
+        return solutions
+
+    def find_solution(self) -> Solution:
+        """Trace back from the end to the start, keeping the route as straight
+        runs instead of single cells."""
+        runs = []
         cell = self.node_end.cell
-        direction = self.node_end.origin
+        direction = self.node_end.origin_code
         while True:
-            node = self.creep(cell, direction, traceback=True, save_path_to=solution)
+            node = self.creep(cell, direction, traceback=True, save_runs_to=runs)
             if node is self.node_start:
                 break
             cell = node.cell
-            direction = node.origin
+            direction = node.origin_code
 
-        self.solution = solution
-        return solution
+        self.solution = Solution(self.node_end.cell, *zip(*runs))
+        self.solution_length = self.solution.length
+        return self.solution
 
     def creep(
         self,
         cell: Type.Cell,
-        direction: WindRose,
+        direction: WindRose | int,
         save_path_to: list = None,
         traceback: bool = False,
+        save_runs_to: list = None,
     ) -> Node:
         """Creep down a path and around corners to find the next junction or dead end."""
+        adjacency, bits, opposite, degree = self.adjacency, adj.BITS, adj.OPPOSITE, adj.DEGREE
+        counts = counters
+        code = DIRECTION_CODE[direction]
         while True:
-            cell = self.walk(cell, direction, save_path_to=save_path_to)
-            if self.is_node(cell):  # TODO: optimize by pruning dead ends?
+            cell = self.walk(cell, code, save_path_to=save_path_to, save_runs_to=save_runs_to)
+            mask = adjacency.item(cell)
+            if counts is not None:
+                counts["adjacency_lookups"] += 1
+            if degree[mask] != 2:
                 if traceback:
-                    return self.bst_root.find(cell)
-                return self.create_node(cell, origin=WindRose.opposite(direction))
-            direction = self.find_adjacent(cell, except_=WindRose.opposite(direction))[0]
+                    return self.node_index.find(cell)
+                return self.create_node(cell, origin=opposite[code])
+            code = adj.BIT_DIRECTION[mask ^ bits[opposite[code]]]
 
     def walk(
         self,
         cell: Type.Cell,
-        direction: WindRose,
+        direction: WindRose | int,
         save_path_to: list = None,
+        save_runs_to: list = None,
     ) -> Type.Cell:
         """Walk from a point until you find a node, hit a wall or move outside the matrix.
-        Return row, col of the cell before either happens."""
-        cell_next = self.take_step(cell, direction, save_path_to=save_path_to)
-        while self.take_step(cell_next, direction):
-            if self.is_node(cell_next):
-                break
-            cell_next = self.take_step(cell_next, direction, save_path_to=save_path_to)
-        return cell_next
+        Return row, col of the cell before either happens. Cells walked are
+        appended to `save_path_to`, the (direction code, steps) to `save_runs_to`."""
+        adjacency = self.adjacency
+        degree = adj.DEGREE
+        code = DIRECTION_CODE[direction]
+        bit = adj.BITS[code]
+        d_row, d_col = adj.DELTAS[code]
+        row, col = cell
+        while True:
+            row += d_row
+            col += d_col
+            if save_path_to is not None:
+                save_path_to.append((row, col))
+            mask = adjacency.item(row, col)
+            if not mask & bit or degree[mask] != 2:
+                steps = abs(row - cell[0]) + abs(col - cell[1])
+                if save_runs_to is not None:
+                    save_runs_to.append((code, steps))
+                if counters is not None:
+                    counters["corridors_walked"] += 1
+                    counters["cells_walked"] += steps
+                    counters["adjacency_lookups"] += steps
+                return row, col
 
     def take_step(
         self,
         cell: Type.Cell,
-        direction: WindRose,
+        direction: WindRose | int,
         save_path_to: list = None,
     ) -> Type.Cell:
         row, col = cell
-        d_row, d_col = direction.value
+        d_row, d_col = adj.DELTAS[DIRECTION_CODE[direction]]
         cell_next = (row + d_row, col + d_col)
         if self.is_traversable(cell_next):
             if save_path_to is not None:
@@ -160,91 +436,77 @@ class Maze:
     def find_adjacent(
         self, cell: Type.Cell, except_: Optional[WindRose] = None
     ) -> list[WindRose]:
-        directions = []
-        for direction in WindRose:
-            cell_adj = self.take_step(cell, direction)
-            if cell_adj is None:
-                continue
-            if self.mx.cell(cell_adj) is Maze.PATH:
-                directions.append(direction)
+        mask = self.adjacency[cell]
+        if counters is not None:
+            counters["adjacency_lookups"] += 1
+        directions = [direction for direction in WindRose if mask & DIRECTION_BIT[direction]]
         if except_ and except_ in directions:
             directions.remove(except_)
         return directions
 
-    def create_nodes(self) -> "BST":
+    def create_nodes(self) -> "NodeIndex | BST":
         cell_start, cell_end = self.find_exit_cells()
         self.node_start = self.create_node(cell_start, origin=None)
 
-        self.bst_root = BST(self.node_start)
+        self.node_index = self.create_index(self.node_start)
 
-        # While checking a node, append all existing neighbour Nodes to the stack.
-        # After having checked all directions, remove the node from the stack and
+        # While checking a node, append all existing neighbour Nodes to the queue.
+        # After having checked all directions, remove the node from the queue and
         # repeat the proces with the first encountered neighbour node
-        recursion_stack = [self.node_start]
+        # Directions are codes and checked directions a bitmask in this loop, so
+        # visiting a node allocates nothing besides the nodes it finds
+        adjacency, bits, counts = self.adjacency, adj.BITS, counters
+        recursion_stack = deque([self.node_start])
         while True:
             node = recursion_stack[0]
-            for direction in WindRose:
-                if direction in node.checked:
-                    continue
-                if not self.take_step(node.cell, direction):
-                    node.checked.append(direction)
-                    continue
-
-                next_node = self.creep(node.cell, direction)
-                recursion_stack.append(next_node)
-                node.checked.append(direction)
-
-            self.bst_root.add(node)
-
-            if len(node.checked) == 4:
-                recursion_stack.remove(node)
+            open_ = adjacency.item(node.cell) & ~node.mask
+            for code in range(4):
+                if open_ & bits[code]:
+                    recursion_stack.append(self.creep(node.cell, code))
+            node.mask = 15  # every direction checked
+            if counts is not None:
+                counts["adjacency_lookups"] += 1
+                counts["max_stack"] = max(counts["max_stack"], len(recursion_stack))
+
+            self.node_index.add(node)
+            recursion_stack.popleft()
 
             if not recursion_stack:
                 break
 
         # Set origin of ending Node to set up traceback
-        self.node_end = self.bst_root.find(cell_end)
+        self.node_end = self.node_index.find(cell_end)
+        if self.node_end is None:
+            raise PathDisconnectedError("Exits are not connected")
         self.node_end.origin = self.find_adjacent(cell_end)[0]  # only possible neighbour
 
-        return self.bst_root
+        return self.node_index
+
+    def create_index(self, maze_node: Node) -> "NodeIndex | BST":
+        if self.index == "bst":
+            return BST(maze_node)
+        if self.index == "sparse":
+            return NodeIndex(maze_node)
+        return NodeIndex(maze_node, shape=(self.mx.height, self.mx.width))
 
     def find_exit_cells(self) -> tuple[Type.Cell, Type.Cell]:
-        cells = []
-        north_border = self.mx.row(0)
-        east_border = self.mx.col(-1)
-        south_border = self.mx.row(-1)
-        west_border = self.mx.col(0)
-
-        for i in range(self.mx.width):
-            if north_border[i] is Maze.PATH:
-                cells.append((0, i))
-            if south_border[i] is Maze.PATH:
-                cells.append((self.mx.height - 1, i))
-
-        for i in range(self.mx.height):
-            if east_border[i] is Maze.PATH:
-                cells.append((i, self.mx.width - 1))
-            if west_border[i] is Maze.PATH:
-                cells.append((i, 0))
-
-        return cells
+        if self.exits is None:
+            grid = self.mx.array
+            self.exits = adj.border_exits(grid[0], grid[:, -1], grid[-1], grid[:, 0])
+        return list(self.exits)
 
     @staticmethod
     def create_node(
             cell: Type.Cell,
-            origin: Optional[WindRose],
-            checked: Iterable[WindRose] = None,
+            origin: Optional[WindRose | int],
+            checked: Iterable[WindRose | int] = (),
     ) -> Node:
-        if checked is None:
-            checked = []
-        if origin not in checked and origin is not None:
-            checked.append(origin)
-
-        return Node(
-            cell=cell,
-            origin=origin,
-            checked=list(checked),
-        )
+        node = Node(cell=cell, origin=origin, checked=checked)
+        if counters is not None:
+            counters["nodes_created"] += 1
+        if origin is not None:
+            node.mask |= adj.BITS[node.origin_code]
+        return node
 
     def is_traversable(self, cell: Type.Cell):
         row, col = cell
@@ -254,17 +516,49 @@ class Maze:
             col < 0,
             col >= self.mx.width,
         )
-        return not any(crossed_borders) and self.mx.cell(cell) is Maze.PATH
+        return not any(crossed_borders) and bool(self.mx.cell(cell))
 
     def is_node(self, cell: Type.Cell):
-        return len(self.find_adjacent(cell)) != 2
+        return adj.DEGREE[self.adjacency[cell]] != 2
 
     def is_junction(self, cell: Type.Cell):
-        return len(self.find_adjacent(cell)) in (3, 4)
+        return adj.DEGREE[self.adjacency[cell]] in (3, 4)
+
+
+class NodeIndex:
+    """Cell to node lookup in O(1). Backed by a dense id array of the matrix
+    shape, or by a dict when no shape is given (sparse mazes)."""
+    def __init__(self, maze_node: Node, shape: Optional[tuple[int, int]] = None) -> None:
+        self.nodes: list[Node] = []
+        self.ids = np.full(shape, -1, dtype=np.int32) if shape else None
+        self.ids_sparse: dict[Type.Cell, int] = {}
+        self.add(maze_node)
+
+    def add(self, maze_node: Node) -> None:
+        if self.find(maze_node.cell) is not None:
+            return
+        if counters is not None:
+            counters["nodes_indexed"] += 1
+        if self.ids is not None:
+            self.ids[maze_node.cell] = len(self.nodes)
+        else:
+            self.ids_sparse[maze_node.cell] = len(self.nodes)
+        self.nodes.append(maze_node)
+
+    def find(self, cell: Type.Cell) -> Optional[Node]:
+        if counters is not None:
+            counters["node_lookups"] += 1
+        if self.ids is not None:
+            node_id = self.ids.item(cell)
+        else:
+            node_id = self.ids_sparse.get(cell, -1)
+        if node_id < 0:
+            return
+        return self.nodes[node_id]
 
 
 class BST:
-    """Binary Search Tree"""
+    """Binary Search Tree, kept for comparison with NodeIndex"""
     def __init__(self, maze_node: Node) -> None:
         self.key = sum(maze_node.cell)
         self.maze_nodes = [maze_node]
@@ -272,6 +566,8 @@ class BST:
         self.right = None
 
     def _search(self, key) -> tuple["BST", bool]:
+        if counters is not None:
+            counters["bst_searches"] += 1
         bst = self
         while True:
             if key < bst.key:
@@ -294,15 +590,20 @@ class BST:
     def add(self, maze_node: Node) -> None:
         key = sum(maze_node.cell)
         bst, found = self._search(key)
-        if found and maze_node not in bst.maze_nodes:
-            bst.maze_nodes.append(maze_node)
+        if found and maze_node in bst.maze_nodes:
             return
-        if not found and key < bst.key:
+        if counters is not None:
+            counters["nodes_indexed"] += 1
+        if found:
+            bst.maze_nodes.append(maze_node)
+        elif key < bst.key:
             bst.left = BST(maze_node)
-        if not found and key > bst.key:
+        else:
             bst.right = BST(maze_node)
 
     def find(self, cell: Type.Cell):
+        if counters is not None:
+            counters["node_lookups"] += 1
         bst_node, found = self._search(sum(cell))
         if not found:
             return
@@ -313,13 +614,34 @@ class BST:
 
 class Validator:
     @staticmethod
-    def validate(matrix: Type.Matrix):
-        Validator.size(matrix)
-        Validator.corners(matrix)
-        Validator.exit_amt(matrix)
+    def validate(matrix: Type.Matrix | Type.Grid, connected: bool = True) -> list[Type.Cell]:
+        """Check size, corners and exits in one pass over the borders of the grid,
+        then that a route joins the exits by labelling the components of the
+        grid, so an unsolvable maze fails before any walk. Without `connected`,
+        the engines raise PathDisconnectedError when they find no route.
+        Returns the exit cells, in the order Maze.find_exit_cells finds them."""
+        if not isinstance(matrix, Matrix):
+            try:
+                grid = np.asarray(matrix, dtype=bool)
+            except ValueError:
+                raise MatrixSizeError("Matrix rows must be of equal length")
+            if grid.ndim != 2:
+                raise MatrixSizeError("Matrix must be at least 3x3")
+            matrix = Matrix(grid)
+        if matrix.height < 3 or matrix.width < 3:
+            raise MatrixSizeError("Matrix must be at least 3x3")
+        # only the borders are read, so a PackedMatrix stays packed
+        north, east, south, west = matrix.row(0), matrix.col(-1), matrix.row(-1), matrix.col(0)
+        if north[[0, -1]].any() or south[[0, -1]].any():
+            raise PathCornerError("Corner cannot be path")
 
-        maze = Maze(Matrix(matrix))
-        Validator.exit_pos(maze)
+        exits = adj.border_exits(north, east, south, west)
+        if len(exits) != 2:
+            raise PathExitAmountError("Expecting exactly 2 exits")
+        Validator.exit_spacing(*exits)
+        if connected:
+            Validator.connected(matrix.array, *exits)
+        return exits
 
     @staticmethod
     def size(matrix: Type.Matrix) -> None:
@@ -353,6 +675,15 @@ class Validator:
     @staticmethod
     def exit_pos(maze: Maze) -> None:
         node_start, node_end = maze.find_exit_cells()
+        Validator.exit_spacing(node_start, node_end)
+
+    @staticmethod
+    def connected(grid: Type.Grid, node_start: Type.Cell, node_end: Type.Cell) -> None:
+        if not connectivity.connected(grid, node_start, node_end):
+            raise PathDisconnectedError("Exits are not connected")
+
+    @staticmethod
+    def exit_spacing(node_start: Type.Cell, node_end: Type.Cell) -> None:
         row_start, col_start = node_start
         row_end, col_end = node_end
         d_y = abs(row_start - row_end)
@@ -361,18 +692,106 @@ class Validator:
             raise PathExitSpacingError("Exits must be at least 1 cell apart")
 
 
+def load_matrix(source: formats.Source) -> Matrix:
+    """Matrix of a maze file, or of its bytes. The bit-packed formats become a
+    PackedMatrix without unpacking, memory-mapped for .mzb files."""
+    if formats.extension(source) in formats.PACKED:
+        return PackedMatrix.from_packed(*formats.load_packed(source))
+    return Matrix(formats.load_grid(source))
+
+
+def solve_file(
+    path: formats.Source,
+    engine: str = "nodes",
+    cache: Optional[MazeCache] = None,
+    crop: bool = False,
+    workers: int = 1,
+) -> Maze:
+    """Load, validate and solve a maze file: a PNG, or a .pbm, .npy or .mzb file
+    (see formats.py), which are memory-mapped rather than decoded and, for the
+    bit-packed ones, kept packed (see load_matrix). `path` may be the bytes of
+    such a file too. With a cache, a maze seen
+    before is memory-mapped from it instead, and only solved again for a new
+    engine. With `crop`, only the part of the maze the exits are connected
+    through is solved. `workers` processes build the junction graph of the
+    graph based engines."""
+    key = cache.key(path) if cache else None
+    cached = cache.load(key) if cache else None
+    if cached:
+        meta, arrays = cached
+        exits = [tuple(cell) for cell in meta["exits"]] if "exits" in meta else None
+        maze = Maze(
+            PackedMatrix.from_packed(arrays["grid"], width=meta["width"]),
+            adjacency=arrays["adjacency"],
+            exits=exits,
+            workers=workers,
+        )
+        if "graph_vertices" in arrays:
+            maze.graph = JunctionGraph(
+                adjacency=arrays["adjacency"],
+                **{name: arrays[f"graph_{name}"] for name in GRAPH_ARRAYS},
+            )
+        if f"solution_{engine}" in arrays:
+            maze.solution = Solution.from_bytes(arrays[f"solution_{engine}"])
+            maze.solution_length = maze.solution.length
+            return maze
+    else:
+        matrix = load_matrix(path)
+        exits = Validator.validate(matrix=matrix, connected=not crop)  # cropping labels the grid itself
+        maze = Maze(matrix, exits=exits, workers=workers)
+
+    maze.solve(engine=engine, crop=crop)
+    if cache:
+        arrays = {
+            "grid": maze.mx.packed if isinstance(maze.mx, PackedMatrix) else np.packbits(maze.mx.array, axis=1),
+            "adjacency": maze.adjacency,
+            f"solution_{engine}": np.frombuffer(maze.solution.to_bytes(), dtype=np.uint8),
+        }
+        if maze.graph is not None:
+            arrays.update({f"graph_{name}": getattr(maze.graph, name) for name in GRAPH_ARRAYS})
+        meta = {"width": maze.mx.width, "height": maze.mx.height, "exits": maze.find_exit_cells()}
+        cache.store(key, meta=meta, arrays=arrays)
+    return maze
+
+
+GRAPH_ARRAYS = ("vertices", "indptr", "indices", "lengths", "directions")
+
+
 if __name__ == "__main__":
-    assert sys.argv[1], "Missing argument or not running through CLI"
-    file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Solve a maze image")
+    parser.add_argument("file", help="maze image (.png, .pbm, .npy or .mzb), relative to this directory")
+    parser.add_argument(
+        "--engine",
+        choices=Maze.ENGINES,
+        default="nodes",
+        help="'dijkstra' finds shortest routes through loops, by A* with a Manhattan heuristic",
+    )
+    parser.add_argument("--cache-dir", help="reuse parsed mazes and solutions from this directory")
+    parser.add_argument("--cache-size", type=int, default=1 << 30, help="cache size limit in bytes")
+    parser.add_argument("--crop", action="store_true", help="only solve the part of the maze connected to the exits")
+    parser.add_argument("--workers", type=int, default=1, help="processes building the junction graph")
+    parser.add_argument("--profile", action="store_true", help="print call counts, phase times and memory peaks as JSON")
+    parser.add_argument("--profile-output", help="write a cProfile of the solve phase to this file")
+    args = parser.parse_args()
+
+    file = args.file
     path = os.path.join(os.path.dirname(__file__), file)
+    cache = MazeCache(args.cache_dir, max_bytes=args.cache_size) if args.cache_dir else None
+
+    # generate your own maze img with: https://keesiemeijer.github.io/maze-generator/ or generate.py
+    if args.profile or args.profile_output:
+        import sys
+        from instrument import Instrument
 
-    # generate your own maze img with: https://keesiemeijer.github.io/maze-generator/
-    maze_path = i2m.get_maze_path(png=path)
+        with Instrument(profile=args.profile_output, module=sys.modules[__name__]) as instrument:
+            maze = solve_file(path, engine=args.engine, cache=cache, crop=args.crop, workers=args.workers)
+        if args.profile:
+            print(instrument.to_json(indent=2))
+    else:
+        maze = solve_file(path, engine=args.engine, cache=cache, crop=args.crop, workers=args.workers)
 
-    Validator.validate(matrix=maze_path)
-    maze = Maze(Matrix(maze_path))
-    maze.solve()
+    import matrix2image as m2i
 
     target_file = f"{file.split('.')[0]} - solved.png"
     target = os.path.join(os.path.dirname(__file__), target_file)
-    m2i.create_png(target, (maze.mx.width, maze.mx.height), maze.mx.cells(), maze.solution)
+    m2i.create_png(target, maze.mx, maze.solution)
@@ -1,13 +1,47 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch, MagicMock
+from typing import Optional
+from unittest.mock import patch, MagicMock, PropertyMock
+
+import numpy as np
+from PIL import Image
+
+import adjacency as adj
+import batch
+import bench
+import connectivity
+import formats
+from dynamic import DynamicMaze
+import generate
+from instrument import Instrument
+from graph import JunctionGraph
+from prune import fill_dead_ends
+import search
+import solve
+from cache import MazeCache
+from server import Client, SolveServer
+from prepared import PreparedMaze
+from solution import Solution
+from tiled import TiledMaze, open_bitmap, write_bitmap
+import image2matrix as i2m
+import matrix2image as m2i
 
 from errors import (
     MatrixSizeError,
     PathCornerError,
+    PathDisconnectedError,
     PathExitAmountError,
     PathExitSpacingError,
 )
-from solve import Maze, Matrix, Validator, WindRose, BST, Type
+from solve import Maze, Matrix, Node, PackedMatrix, Validator, WindRose, BST, NodeIndex, Type, load_matrix, solve_file
 
 
 class BSTMock:
@@ -75,8 +109,8 @@ class TestMatrix(unittest.TestCase):
             (0, 1, 0),
         )
         matrix = Matrix(matrix)
-        assert matrix.row(1) == (0, 0, 1)
-        assert matrix.row(-1) == (0, 1, 0)
+        assert tuple(matrix.row(1)) == (0, 0, 1)
+        assert tuple(matrix.row(-1)) == (0, 1, 0)
 
     def test_col_out_of_bounds(self):
         matrix = (
@@ -95,8 +129,103 @@ class TestMatrix(unittest.TestCase):
             (0, 1, 0),
         )
         matrix = Matrix(matrix)
-        assert matrix.col(1) == (0, 0, 1)
-        assert matrix.col(-1) == (0, 1, 0)
+        assert tuple(matrix.col(1)) == (0, 0, 1)
+        assert tuple(matrix.col(-1)) == (0, 1, 0)
+
+    def test_col_is_view(self):
+        matrix = Matrix(((1, 0, 0), (0, 0, 1), (0, 1, 0)))
+        assert np.shares_memory(matrix.col(1), matrix.matrix)
+
+    def test_cells_returns_nonzero(self):
+        matrix = Matrix(((0, 1, 0), (0, 1, 1), (0, 0, 0)))
+        rows, cols = matrix.cells()
+        assert list(zip(rows.tolist(), cols.tolist())) == [(0, 1), (1, 1), (1, 2)]
+
+
+class TestPackedMatrix(unittest.TestCase):
+    matrix = (
+        (0, 1, 0, 0, 0, 0, 0, 0, 0, 0),
+        (0, 1, 1, 1, 1, 1, 1, 1, 1, 1),
+        (0, 0, 0, 0, 0, 0, 0, 0, 1, 0),
+    )
+
+    def test_matches_dense_matrix(self):
+        dense = Matrix(self.matrix)
+        packed = PackedMatrix(self.matrix)
+        assert (packed.width, packed.height) == (dense.width, dense.height)
+        for i in (0, 1, -1):
+            assert np.array_equal(packed.row(i), dense.row(i))
+        for i in (0, 1, 8, 9, -1):
+            assert np.array_equal(packed.col(i), dense.col(i))
+        for cell in ((0, 1), (1, 9), (2, 8), (2, 9), (2, -2)):
+            assert packed.cell(cell) == dense.cell(cell)
+        for a, b in zip(packed.cells(), dense.cells()):
+            assert np.array_equal(a, b)
+
+    def test_stores_one_bit_per_cell(self):
+        grid = np.ones((64, 800), dtype=bool)
+        assert PackedMatrix(grid).packed.nbytes == grid.size // 8
+
+    def test_from_packed_wraps_without_copy(self):
+        packed = np.packbits(np.array(self.matrix, dtype=bool), axis=1)
+        matrix = PackedMatrix.from_packed(packed, width=10)
+        assert matrix.packed is packed
+        assert np.array_equal(matrix.array, np.array(self.matrix, dtype=bool))
+
+    def test_row_out_of_bounds(self):
+        matrix = PackedMatrix(self.matrix)
+        self.assertRaises(IndexError, matrix.row, 3)
+        self.assertRaises(IndexError, matrix.col, -11)
+
+
+class ValidatorTest(unittest.TestCase):
+    def test_validate_returns_exits(self):
+        matrix = (
+            (0, 0, 0, 1, 0),
+            (0, 1, 1, 1, 0),
+            (1, 1, 0, 0, 0),
+            (0, 0, 0, 0, 0),
+        )
+        assert Validator.validate(matrix) == [(0, 3), (2, 0)]
+        assert Validator.validate(np.array(matrix, dtype=bool)) == Maze(Matrix(matrix)).find_exit_cells()
+
+    def test_validate_raises_every_error(self):
+        cases = (
+            (MatrixSizeError, ((0, 1, 0), (0, 0), (0, 1, 0))),
+            (MatrixSizeError, ((0, 1, 0), (0, 0, 1))),
+            (PathCornerError, ((1, 0, 0), (0, 0, 0), (0, 0, 0))),
+            (PathExitAmountError, ((0, 1, 0), (1, 0, 0), (0, 1, 0))),
+            (PathExitSpacingError, ((0, 1, 1, 0), (0, 0, 0, 0), (0, 0, 0, 0))),
+            (PathDisconnectedError, ((0, 1, 0), (0, 0, 0), (0, 1, 0))),
+        )
+        for error, matrix in cases:
+            self.assertRaises(error, Validator.validate, matrix)
+        assert Validator.validate(((0, 1, 0), (0, 0, 0), (0, 1, 0)), connected=False) == [(0, 1), (2, 1)]
+
+    def test_border_exits_order(self):
+        grid = np.array(
+            (
+                (0, 1, 0, 0),
+                (1, 0, 0, 1),
+                (0, 0, 0, 1),
+                (0, 1, 1, 0),
+            ),
+            dtype=bool,
+        )
+        exits = adj.border_exits(grid[0], grid[:, -1], grid[-1], grid[:, 0])
+        assert exits == [(0, 1), (3, 1), (3, 2), (1, 3), (1, 0), (2, 3)]
+
+    @patch("adjacency.border_exits")
+    def test_maze_reuses_given_exits(self, border_exits):
+        matrix = (
+            (0, 1, 0),
+            (0, 1, 0),
+            (0, 1, 0),
+        )
+        maze = Maze(Matrix(matrix), exits=[(0, 1), (2, 1)])
+        maze.solve()
+        border_exits.assert_not_called()
+        assert maze.solution == [(2, 1), (1, 1), (0, 1)]
 
 
 class MazeTest(unittest.TestCase):
@@ -268,6 +397,67 @@ class MazeTest(unittest.TestCase):
         assert maze2.find_solution() == [(3, 0), (3, 1), (3, 2), (2, 2), (1, 2), (0, 2)]
 
 
+class NodeTest(unittest.TestCase):
+    def test_checked_is_a_bitmask_behind_a_list_facade(self):
+        node = Maze.create_node((1, 1), origin=WindRose.N, checked=[WindRose.E])
+        assert node.mask == adj.BITS[adj.N] | adj.BITS[adj.E]
+        assert list(node.checked) == [WindRose.N, WindRose.E] and len(node.checked) == 2
+        node.checked.append(WindRose.W)
+        node.checked.append(adj.W)  # codes work too, checking twice changes nothing
+        assert WindRose.W in node.checked and WindRose.S not in node.checked
+        assert len(node.checked) == 3
+
+    def test_origin_is_stored_as_a_code(self):
+        node = Node((0, 1), origin=None)
+        assert node.origin is None and node.origin_code == -1
+        node.origin = WindRose.S
+        assert node.origin is WindRose.S and node.origin_code == adj.S
+        assert Node((0, 1), adj.S, adj.BITS[adj.S]) == Maze.create_node((0, 1), origin=WindRose.S)
+        assert not hasattr(node, "__dict__")
+
+    def test_wind_rose_tables(self):
+        assert [WindRose.opposite(direction) for direction in WindRose] == [WindRose.S, WindRose.W, WindRose.N, WindRose.E]
+        assert WindRose.all() == tuple(WindRose) and WindRose.all() is WindRose.all()
+        assert [direction.value for direction in WindRose] == list(adj.DELTAS)
+
+
+class NodeIndexTest(unittest.TestCase):
+    def test_dense_and_sparse_find_nodes(self):
+        for shape in ((300, 300), None):
+            node1 = MagicMock(cell=(0, 225))
+            node2 = MagicMock(cell=(225, 0))  # same anti-diagonal as node1
+            index = NodeIndex(node1, shape=shape)
+            index.add(node2)
+            assert index.find((0, 225)) is node1
+            assert index.find((225, 0)) is node2
+            assert index.find((1, 1)) is None
+
+    def test_first_node_for_a_cell_is_kept(self):
+        node1 = MagicMock(cell=(1, 1))
+        node2 = MagicMock(cell=(1, 1))
+        index = NodeIndex(node1, shape=(3, 3))
+        index.add(node2)
+        assert index.find((1, 1)) is node1
+        assert index.nodes == [node1]
+
+    def test_maze_index_types_find_same_solution(self):
+        matrix = (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 1, 0, 0),
+            (0, 1, 1, 1, 1),
+            (0, 0, 0, 0, 0),
+        )
+        solutions = []
+        for index in Maze.INDEXES:
+            maze = Maze(Matrix(matrix), index=index)
+            maze.solve()
+            solutions.append(maze.solution)
+        assert solutions[0] == solutions[1] == solutions[2]
+        assert isinstance(Maze(Matrix(matrix)).create_nodes(), NodeIndex)
+        self.assertRaises(ValueError, Maze, Matrix(matrix), index="avl")
+
+
 class BinarySearchTreeTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -359,6 +549,1249 @@ class BinarySearchTreeTest(unittest.TestCase):
         assert node is None
 
 
+class AdjacencyTest(unittest.TestCase):
+    matrix = (
+        (0, 1, 0, 0),
+        (0, 1, 1, 1),
+        (0, 1, 0, 0),
+        (0, 0, 0, 0),
+    )
+
+    def test_adjacency_map_sets_direction_bits(self):
+        adjacency = adj.adjacency_map(np.array(self.matrix, dtype=bool))
+        n, e, s, w = adj.BITS
+        assert adjacency[0, 1] == s
+        assert adjacency[1, 1] == n | e | s
+        assert adjacency[1, 3] == w
+        assert adjacency[0, 0] == 0
+        assert adjacency[3, 1] == 0
+
+    def test_degree_map_counts_neighbours(self):
+        degree = adj.degree_map(adj.adjacency_map(np.array(self.matrix, dtype=bool)))
+        assert degree.tolist() == [
+            [0, 1, 0, 0],
+            [0, 3, 2, 1],
+            [0, 1, 0, 0],
+            [0, 0, 0, 0],
+        ]
+
+    def test_maze_reads_adjacency_map(self):
+        maze = Maze(Matrix(self.matrix))
+        assert maze.is_junction((1, 1))
+        assert maze.is_node((1, 3))
+        assert not maze.is_node((1, 2))
+        assert maze.find_adjacent((1, 1), except_=WindRose.N) == [WindRose.E, WindRose.S]
+
+
+class JunctionGraphTest(unittest.TestCase):
+    matrix = (
+        (0, 1, 0, 0, 0),
+        (0, 1, 1, 1, 0),
+        (0, 0, 1, 0, 0),
+        (0, 1, 1, 1, 1),
+        (0, 0, 0, 0, 0),
+    )
+
+    def test_build_reduces_corridors_to_edges(self):
+        graph = JunctionGraph.build(np.array(self.matrix, dtype=bool))
+        cells = [graph.cell(v) for v in range(graph.n_vertices)]
+        assert cells == [(0, 1), (1, 2), (1, 3), (3, 1), (3, 2), (3, 4)]
+
+        top, junction = graph.vertex((0, 1)), graph.vertex((1, 2))
+        edge = graph.edge(top, junction)
+        assert graph.lengths[edge] == 2
+        assert graph.directions[edge] == adj.S
+        assert graph.lengths[graph.edge(junction, graph.vertex((3, 2)))] == 2
+        assert graph.n_edges == 10  # 5 corridors, both ways
+
+    def test_vertex_raises_for_corridor_cell(self):
+        graph = JunctionGraph.build(np.array(self.matrix, dtype=bool))
+        self.assertRaises(KeyError, graph.vertex, (1, 1))
+
+    def test_forced_cells_become_vertices(self):
+        forced = np.zeros((5, 5), dtype=bool)
+        forced[1, 1] = True
+        graph = JunctionGraph.build(np.array(self.matrix, dtype=bool), forced=forced)
+        assert graph.lengths[graph.edge(graph.vertex((0, 1)), graph.vertex((1, 1)))] == 1
+
+    def test_loop_corridor_is_found_from_both_ends(self):
+        matrix = (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 1, 0, 1, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 0, 0, 0),
+        )
+        graph = JunctionGraph.build(np.array(matrix, dtype=bool))
+        junction = graph.vertex((1, 1))
+        targets = [int(graph.indices[e]) for e in graph.edges(junction)]
+        assert targets == [graph.vertex((0, 1)), junction, junction]
+
+    def test_expand_walks_corridors(self):
+        graph = JunctionGraph.build(np.array(self.matrix, dtype=bool))
+        path = graph.find_path(graph.vertex((3, 4)), graph.vertex((0, 1)))
+        assert graph.expand(path) == [(3, 4), (3, 3), (3, 2), (2, 2), (1, 2), (1, 1), (0, 1)]
+
+    def test_graph_engine_matches_nodes_engine(self):
+        matrix2 = (
+            (0, 0, 1, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 1, 0, 0),
+            (1, 1, 1, 1, 0),
+            (0, 0, 0, 0, 0),
+        )
+        for matrix in (self.matrix, matrix2):
+            maze1 = Maze(Matrix(matrix))
+            maze2 = Maze(Matrix(matrix))
+            maze1.solve(engine="nodes")
+            maze2.solve(engine="graph")
+            assert maze1.solution == maze2.solution
+
+    def test_build_parallel_matches_build(self):
+        loop = (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 1, 0, 1, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 0, 0, 0),
+        )
+        braided = generate.generate(31, 41, braid=0.5, seed=3)
+        rooms = braided.copy()
+        rooms[5:12, 7:20] = True
+        for grid, strips in ((self.matrix, 5), (loop, 3), (loop, 5), (braided, 4), (braided, 31), (rooms, 7)):
+            grid = np.array(grid, dtype=bool)
+            expected = JunctionGraph.build(grid)
+            graph = JunctionGraph.build_parallel(grid, workers=2, strips=strips)
+            for name in ("vertices", "indptr", "indices", "lengths", "directions"):
+                assert np.array_equal(getattr(graph, name), getattr(expected, name)), (strips, name)
+
+    def test_maze_builds_graph_with_workers(self):
+        grid = generate.generate(21, 21, seed=4)
+        maze1, maze2 = Maze(Matrix(grid)), Maze(Matrix(grid), workers=2)
+        maze1.solve(engine="dijkstra")
+        maze2.solve(engine="dijkstra")
+        assert maze1.solution == maze2.solution
+
+
+class DeadEndFillingTest(unittest.TestCase):
+    def test_fill_dead_ends_leaves_route_between_exits(self):
+        matrix = (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 1, 0, 0),
+            (0, 1, 1, 1, 1),
+            (0, 0, 0, 0, 0),
+        )
+        grid = fill_dead_ends(np.array(matrix, dtype=bool), keep=[(0, 1), (3, 4)])
+        assert grid.astype(int).tolist() == [
+            [0, 1, 0, 0, 0],
+            [0, 1, 1, 0, 0],
+            [0, 0, 1, 0, 0],
+            [0, 0, 1, 1, 1],
+            [0, 0, 0, 0, 0],
+        ]
+
+    def test_fill_dead_ends_keeps_loops(self):
+        matrix = (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 1, 0, 1, 0),
+            (0, 1, 1, 1, 0),
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 0, 0),
+        )
+        grid = fill_dead_ends(np.array(matrix, dtype=bool), keep=[(0, 1), (4, 1)])
+        expected = np.array(matrix, dtype=bool)
+        expected[5] = False
+        assert np.array_equal(grid, expected)
+
+    def test_solve_with_pruning_finds_same_solution(self):
+        matrix = (
+            (0, 0, 1, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 1, 0, 0),
+            (1, 1, 1, 1, 0),
+            (0, 0, 0, 0, 0),
+        )
+        for engine in Maze.ENGINES:
+            maze = Maze(Matrix(matrix))
+            maze.solve(engine=engine, prune=True)
+            assert maze.solution == [(3, 0), (3, 1), (3, 2), (2, 2), (1, 2), (0, 2)]
+            assert maze.mx.array.sum() == 6
+
+
+class ConnectivityTest(unittest.TestCase):
+    grid = np.array(
+        (
+            (0, 1, 0, 0, 0, 0, 0),
+            (0, 1, 1, 1, 0, 1, 0),
+            (0, 0, 0, 1, 0, 1, 0),
+            (0, 1, 1, 1, 0, 0, 0),
+            (0, 1, 0, 0, 0, 1, 0),
+            (0, 1, 0, 0, 0, 1, 0),
+            (0, 0, 0, 0, 0, 0, 0),
+        ),
+        dtype=bool,
+    )
+    grid[6, 1] = True
+
+    def test_label_components(self):
+        labels = connectivity.label_components(self.grid)
+        assert (labels[~self.grid] == -1).all()
+        assert len(np.unique(labels[self.grid])) == 3
+        assert labels[0, 1] == labels[6, 1] == labels[3, 3]
+        assert labels[1, 5] == labels[2, 5] != labels[4, 5]
+        assert connectivity.connected(self.grid, (0, 1), (6, 1))
+        assert not connectivity.connected(self.grid, (0, 1), (4, 5))
+        assert not connectivity.connected(self.grid, (0, 0), (0, 0))
+
+    def test_labels_match_a_flood_fill_on_a_generated_maze(self):
+        grid = generate.generate(41, 41, braid=0.3, seed=5)
+        grid[1:-1:4, 1:-1] = False  # cut it into many components
+        labels = connectivity.label_components(grid)
+        for cell in zip(*np.nonzero(grid[::7, ::7])):
+            cell = (cell[0] * 7, cell[1] * 7)
+            seen, stack = {cell}, [cell]
+            while stack:
+                row, col = stack.pop()
+                for d_row, d_col in adj.DELTAS:
+                    nxt = (row + d_row, col + d_col)
+                    if 0 <= nxt[0] < 41 and 0 <= nxt[1] < 41 and grid[nxt] and nxt not in seen:
+                        seen.add(nxt)
+                        stack.append(nxt)
+            assert set(zip(*np.nonzero(labels == labels[cell]))) == seen
+
+    def test_crop_to_component(self):
+        grid, offset = connectivity.crop_to_component(self.grid, (0, 1))
+        assert offset == (0, 0) and grid.shape == (7, 5)
+        assert grid.sum() == 11 and not grid[1:-1, [0, -1]].any()
+        grid, offset = connectivity.crop_to_component(self.grid, (2, 5))
+        assert offset == (0, 4) and grid.tolist() == [[False] * 3, [False, True, False], [False, True, False], [False] * 3]
+
+    def test_maze_solves_cropped(self):
+        grid = np.zeros((9, 12), dtype=bool)
+        grid[:7, :7] = self.grid
+        grid[6, 1] = False
+        grid[3, 4:9] = grid[3:9, 8] = True  # leave through the bottom at (8, 8)
+        grid[1:3, 10] = True  # unreachable room
+        maze, cropped = Maze(Matrix(grid)), Maze(Matrix(grid))
+        maze.solve()
+        cropped.solve(crop=True)
+        assert cropped.solution == maze.solution and cropped.solution[0] == (8, 8)
+        assert cropped.solution_length == maze.solution_length == 15
+
+    def test_disconnected_exits_raise(self):
+        grid = self.grid.copy()
+        grid[3, 2] = False
+        with self.assertRaises(PathDisconnectedError):
+            Validator.validate(grid)
+        for engine in Maze.ENGINES:
+            for crop in (False, True):
+                with self.assertRaises(PathDisconnectedError):
+                    Maze(Matrix(grid)).solve(engine=engine, crop=crop)
+
+    def test_solve_file_rejects_disconnected_exits_before_walking(self):
+        grid = self.grid.copy()
+        grid[3, 2] = False
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "maze.npy")
+            formats.save_grid(path, grid)
+            with patch.object(Maze, "create_nodes") as create_nodes, patch.object(JunctionGraph, "build") as build:
+                for engine in Maze.ENGINES:
+                    with self.assertRaises(PathDisconnectedError):
+                        solve_file(path, engine=engine)
+                create_nodes.assert_not_called()
+                build.assert_not_called()
+
+    def test_solve_cropped_takes_known_labels(self):
+        labels = connectivity.label_components(self.grid)
+        with patch("connectivity.label_components") as label_components:
+            maze = Maze(Matrix(self.grid))
+            maze.solve_cropped(engine="graph", labels=labels)
+            label_components.assert_not_called()
+        plain = Maze(Matrix(self.grid))
+        plain.solve(engine="graph")
+        assert maze.solution == plain.solution
+
+
+class SearchTest(unittest.TestCase):
+    matrix = (
+        (0, 1, 0, 0, 0, 0, 0),
+        (0, 1, 1, 1, 1, 1, 0),
+        (0, 1, 0, 0, 0, 1, 0),
+        (0, 1, 1, 1, 0, 1, 0),
+        (0, 1, 0, 1, 0, 1, 0),
+        (0, 1, 0, 1, 1, 1, 0),
+        (0, 0, 0, 1, 0, 0, 0),
+    )
+
+    def walker(self) -> search.CorridorWalker:
+        return search.CorridorWalker(adj.adjacency_map(np.array(self.matrix, dtype=bool)))
+
+    def test_astar_finds_shortest_route(self):
+        walker = self.walker()
+        source, target = walker.flat((0, 1)), walker.flat((6, 3))
+        route = search.astar(walker.neighbours, source, target, walker.size, search.manhattan(walker, target))
+        assert route.length == 8
+        assert walker.expand(route) == [
+            (0, 1), (1, 1), (2, 1), (3, 1), (3, 2), (3, 3), (4, 3), (5, 3), (6, 3),
+        ]
+
+    def test_bfs_finds_route_with_fewest_corridors(self):
+        walker = self.walker()
+        route = search.bfs(walker.neighbours, walker.flat((0, 1)), walker.flat((6, 3)), walker.size)
+        assert [walker.cell(v) for v in route.vertices] == [(0, 1), (1, 1), (5, 3), (6, 3)]
+        assert route.length == 12
+
+    def test_search_stops_at_target(self):
+        walker = self.walker()
+        route = search.bfs(walker.neighbours, walker.flat((0, 1)), walker.flat((1, 1)), walker.size)
+        assert route.settled == 1
+        assert search.bfs(walker.neighbours, 1, 1, walker.size).vertices == [1]
+
+    def test_search_returns_none_without_route(self):
+        walker = self.walker()
+        assert search.astar(walker.neighbours, walker.flat((0, 1)), 0, walker.size) is None
+
+    def test_search_engines_match_nodes_engine(self):
+        matrix = (
+            (0, 0, 1, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 1, 0, 0),
+            (1, 1, 1, 1, 0),
+            (0, 0, 0, 0, 0),
+        )
+        for engine in ("bfs", "astar"):
+            maze = Maze(Matrix(matrix))
+            maze.solve(engine=engine)
+            assert maze.solution == [(3, 0), (3, 1), (3, 2), (2, 2), (1, 2), (0, 2)]
+
+    def test_search_engines_raise_without_route(self):
+        matrix = ((0, 1, 0), (0, 0, 0), (0, 1, 0))
+        for engine in ("bfs", "astar"):
+            with self.assertRaises(PathDisconnectedError):
+                Maze(Matrix(matrix)).solve(engine=engine)
+
+
+class ShortestPathTest(unittest.TestCase):
+    # two routes from the top exit to the bottom exit, the eastern one is longer
+    matrix = (
+        (0, 1, 0, 0, 0, 0, 0),
+        (0, 1, 1, 1, 1, 1, 0),
+        (0, 1, 0, 0, 0, 1, 0),
+        (0, 1, 0, 0, 0, 1, 0),
+        (0, 1, 1, 0, 0, 1, 0),
+        (0, 0, 1, 1, 1, 1, 0),
+        (0, 0, 1, 0, 0, 0, 0),
+    )
+
+    def test_dijkstra_engine_finds_shortest_route_through_loops(self):
+        maze = Maze(Matrix(self.matrix))
+        maze.solve(engine="dijkstra")
+        assert maze.solution_length == 7
+        assert maze.solution == [(6, 2), (5, 2), (4, 2), (4, 1), (3, 1), (2, 1), (1, 1), (0, 1)]
+
+    def test_alternatives_are_ordered_by_length(self):
+        maze = Maze(Matrix(self.matrix))
+        routes = maze.alternatives(k=3)
+        assert [len(route) - 1 for route in routes] == [7, 13]
+        assert routes[1][:3] == [(6, 2), (5, 2), (5, 3)]
+        assert maze.solution == routes[0]
+
+    def test_dijkstra_engine_raises_without_route(self):
+        with self.assertRaises(PathDisconnectedError):
+            Maze(Matrix(((0, 1, 0), (0, 0, 0), (0, 1, 0)))).solve(engine="dijkstra")
+
+    def test_distances_reach_every_vertex(self):
+        graph = JunctionGraph.build(np.array(self.matrix, dtype=bool))
+        dist = search.distances(graph, graph.vertex((0, 1)))
+        assert dist[graph.vertex((1, 1))] == 1
+        assert dist[graph.vertex((5, 2))] == 6
+        assert dist[graph.vertex((6, 2))] == 7
+
+    def test_distances_between_avoid_the_other_vertices(self):
+        graph = JunctionGraph.build(np.array(self.matrix, dtype=bool))
+        top, bottom, junction = (graph.vertex(cell) for cell in ((0, 1), (6, 2), (5, 2)))
+        assert search.distances_between(graph, [top, bottom]).tolist() == [[0, 7], [7, 0]]
+        assert search.distances_between(graph, [top, bottom, junction]).tolist() == [[0, -1, 6], [-1, 0, 1], [6, 1, 0]]
+
+    def test_dijkstra_engine_matches_nodes_engine_on_perfect_maze(self):
+        matrix = (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 1, 0, 0),
+            (0, 1, 1, 1, 1),
+            (0, 0, 0, 0, 0),
+        )
+        maze1 = Maze(Matrix(matrix))
+        maze2 = Maze(Matrix(matrix))
+        maze1.solve(engine="nodes")
+        maze2.solve(engine="dijkstra")
+        assert maze1.solution == maze2.solution
+        assert maze1.solution_length == maze2.solution_length == 6
+
+
+class SolutionTest(unittest.TestCase):
+    cells = [(6, 2), (5, 2), (4, 2), (4, 1), (3, 1), (2, 1), (1, 1), (0, 1)]
+
+    def test_reversed_walks_back(self):
+        solution = Solution.from_cells(self.cells)
+        assert solution.reversed() == self.cells[::-1]
+        assert solution.reversed().reversed() == solution
+        assert Solution((3, 4)).reversed() == [(3, 4)]
+        assert len(Solution().reversed()) == 0
+
+    def test_runs_of_graph_and_walker_routes_match_their_cells(self):
+        grid = generate.generate(41, 41, braid=0.5, seed=5)
+        graph = JunctionGraph.build(grid)
+        walker = search.CorridorWalker(graph.adjacency)
+        source, target = (0, 1), (40, 39)
+        route = search.shortest_path(graph, graph.vertex(source), graph.vertex(target))
+        expected = Solution.from_cells(graph.expand(route.vertices, route.via))
+        assert Solution(source, *zip(*graph.runs(route.vertices, route.via))) == expected
+        route = search.bfs(walker.neighbours, walker.flat(source), walker.flat(target), walker.size)
+        assert Solution(source, *zip(*walker.runs(route))) == Solution.from_cells(walker.expand(route))
+
+    def test_from_cells_merges_straight_runs(self):
+        solution = Solution.from_cells(self.cells)
+        assert solution.start == (6, 2)
+        assert solution.directions.tolist() == [adj.N, adj.W, adj.N]
+        assert solution.runs.tolist() == [2, 1, 4]
+        assert solution.turns().tolist() == [[4, 2], [4, 1]]
+        assert len(solution) == 8 and solution.length == 7
+
+    def test_behaves_like_the_cell_list(self):
+        solution = Solution((6, 2), [adj.N, adj.N, adj.W, adj.N], [1, 1, 1, 4])
+        assert solution == self.cells and self.cells == solution
+        assert list(solution) == self.cells
+        assert [solution[i] for i in range(-8, 8)] == self.cells + self.cells
+        assert solution[2:4] == self.cells[2:4]
+        assert solution.to_cells().tolist() == [list(cell) for cell in self.cells]
+        assert np.array_equal(np.asarray(solution, dtype=np.int32), self.cells)
+        assert solution != self.cells[:-1]
+        with self.assertRaises(IndexError):
+            solution[8]
+
+    def test_serializes(self):
+        solution = Solution.from_cells(self.cells)
+        assert Solution.from_bytes(solution.to_bytes()) == solution
+        assert json.loads(solution.to_json()) == {"start": [6, 2], "directions": "NWN", "runs": [2, 1, 4]}
+        assert Solution.from_json(solution.to_json()) == solution
+        with self.assertRaises(ValueError):
+            Solution.from_bytes(b"nope" + solution.to_bytes()[4:])
+
+    def test_empty_and_single_cell(self):
+        assert Solution() == [] and len(Solution()) == 0 and Solution().to_cells().shape == (0, 2)
+        assert Solution.from_bytes(Solution().to_bytes()) == Solution()
+        single = Solution.from_cells([(0, 1)])
+        assert single == [(0, 1)] and single.length == 0
+
+    def test_rejects_cells_that_are_not_neighbours(self):
+        with self.assertRaises(ValueError):
+            Solution.from_cells([(0, 1), (1, 2)])
+
+    def test_find_solution_stores_runs(self):
+        maze = Maze(Matrix(ImageToMatrixTest.grid))
+        maze.solve()
+        assert isinstance(maze.solution, Solution)
+        assert len(maze.solution.runs) == len(maze.solution.turns()) + 1
+        assert maze.solution_length == maze.solution.length == len(maze.solution.to_cells()) - 1
+
+
+class PreparedMazeTest(unittest.TestCase):
+    matrix = (
+        (0, 1, 0, 0, 0, 0, 0),
+        (0, 1, 1, 1, 1, 1, 0),
+        (0, 1, 0, 0, 0, 1, 0),
+        (0, 1, 0, 0, 0, 1, 0),
+        (0, 1, 1, 0, 0, 1, 0),
+        (0, 0, 1, 1, 1, 1, 0),
+        (0, 0, 1, 0, 0, 0, 1),
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        cls.maze = PreparedMaze(Matrix(cls.matrix), landmarks=2)
+
+    def test_distance_between_corridor_cells(self):
+        assert self.maze.distance((1, 3), (5, 4)) == 7
+        assert self.maze.distance((2, 1), (4, 5)) == 8
+        assert self.maze.distance((6, 2), (6, 2)) == 0
+
+    def test_distance_within_one_corridor(self):
+        assert self.maze.distance((1, 2), (1, 4)) == 2
+        assert self.maze.distance((2, 5), (5, 3)) == 5
+
+    def test_shortest_path_cells(self):
+        assert self.maze.shortest_path((1, 3), (4, 5)) == [(1, 3), (1, 4), (1, 5), (2, 5), (3, 5), (4, 5)]
+        assert self.maze.shortest_path((2, 5), (1, 3)) == [(2, 5), (1, 5), (1, 4), (1, 3)]
+        path = self.maze.shortest_path((0, 1), (6, 2))
+        assert len(path) == 8 and path[0] == (0, 1) and path[-1] == (6, 2)
+
+    def test_unreachable_cells(self):
+        assert self.maze.distance((0, 1), (6, 6)) is None
+        assert self.maze.shortest_path((0, 1), (6, 6)) == []
+        self.assertRaises(ValueError, self.maze.distance, (0, 0), (0, 1))
+
+    def test_batch_distances_match_single_queries(self):
+        pairs = [((1, 3), (5, 4)), ((1, 3), (1, 4)), ((0, 1), (6, 6)), ((6, 2), (1, 5))]
+        expected = [self.maze.distance(a, b) for a, b in pairs]
+        assert self.maze.distances(pairs).tolist() == [-1 if d is None else d for d in expected]
+
+
+    def test_loops_without_junctions(self):
+        grid = np.zeros((8, 9), dtype=bool)
+        grid[1:5, 1:5] = True
+        grid[2:4, 2:4] = False  # a ring of 12 cells
+        grid[5:7, 6:8] = True  # a block of 4
+        maze = PreparedMaze(grid, landmarks=2)
+        assert maze.distance((1, 1), (4, 4)) == 6
+        assert maze.distance((1, 2), (1, 1)) == 1
+        assert maze.distance((3, 4), (2, 1)) == 6
+        assert maze.distance((6, 6), (5, 7)) == 2
+        assert maze.distance((1, 1), (5, 6)) is None
+        path = maze.shortest_path((1, 3), (4, 2))
+        assert len(path) == 7 and path[0] == (1, 3) and path[-1] == (4, 2) and grid[tuple(np.array(path).T)].all()
+        assert maze.shortest_path((5, 6), (6, 7))[::2] == [(5, 6), (6, 7)]
+        pairs = [((1, 1), (4, 4)), ((1, 1), (1, 2)), ((6, 7), (5, 6)), ((6, 7), (1, 1))]
+        assert maze.distances(pairs).tolist() == [6, 1, 2, -1]
+
+class TiledMazeTest(unittest.TestCase):
+    @staticmethod
+    def grid() -> np.ndarray:
+        rng = np.random.default_rng(7)
+        grid = rng.random((30, 37)) < 0.7
+        grid[[0, -1], :] = False
+        grid[:, [0, -1]] = False
+        grid[0, 1] = grid[1, 1] = grid[-1, -2] = grid[-2, -2] = True
+        return grid
+
+    def tiled(self, grid: np.ndarray, tile: int) -> TiledMaze:
+        path = os.path.join(self.directory.name, "maze.raw")
+        write_bitmap(path, grid, strip=7)
+        return TiledMaze(open_bitmap(path, *grid.shape), grid.shape[1], tile=tile)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_route(self, grid: np.ndarray, cells: np.ndarray, start, end):
+        assert tuple(cells[0]) == start and tuple(cells[-1]) == end
+        assert grid[tuple(cells.T)].all()
+        assert (np.abs(np.diff(cells, axis=0)).sum(axis=1) == 1).all()
+
+    def test_bitmap_round_trip(self):
+        grid = self.grid()
+        maze = self.tiled(grid, 8)
+        assert (maze.read(0, grid.shape[0], 0, grid.shape[1]) == grid).all()
+        assert (maze.read(5, 20, 8, 33) == grid[5:20, 8:33]).all()
+
+    def test_exits_match_maze(self):
+        grid = self.grid()
+        assert self.tiled(grid, 8).find_exit_cells() == Maze(Matrix(grid)).find_exit_cells()
+
+    def test_shortest_paths_match_prepared_maze(self):
+        grid = self.grid()
+        prepared = PreparedMaze(grid)
+        cells = list(zip(*np.nonzero(grid)))
+        pairs = [(cells[0], cells[-1]), (cells[10], cells[200]), (cells[300], cells[310]), (cells[50], cells[50])]
+        for tile in (8, 16, 64):
+            maze = self.tiled(grid, tile)
+            for a, b in pairs:
+                route = maze.shortest_path(a, b)
+                expected = prepared.distance(a, b)
+                if expected is None:
+                    assert route is None
+                else:
+                    assert len(route) - 1 == expected
+                    self.assert_route(grid, route, a, b)
+
+    def test_abstract_graph_joins_crossings_only(self):
+        grid = generate.generate(81, 81, algorithm="kruskal", braid=1.0, seed=2)
+        maze = self.tiled(grid, 16)
+        maze.prepare()
+        rows, cols = np.divmod(maze.nodes, grid.shape[1])
+        assert ((rows % 16 == 0) | (rows % 16 == 15) | (cols % 16 == 0) | (cols % 16 == 15)).all()
+        assert isinstance(maze.edges, np.memmap) and len(maze.edges) == maze.indptr[-1]
+        prepared = PreparedMaze(grid)
+        for u in range(0, len(maze.nodes), 7):
+            for v, length in maze.edges[maze.indptr[u]:maze.indptr[u + 1]].tolist():
+                assert prepared.distance(maze.cell(maze.nodes[u]), maze.cell(maze.nodes[v])) <= length
+        expected = Maze(Matrix(grid))
+        expected.solve(engine="dijkstra")
+        assert len(maze.solve()) - 1 == expected.solution_length
+
+    def test_solve_perfect_maze(self):
+        grid = np.array((
+            (0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+            (0, 1, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0),
+            (0, 0, 0, 0, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0),
+            (0, 1, 1, 1, 0, 1, 1, 1, 0, 1, 1, 1, 1, 1, 0, 1, 0),
+            (0, 1, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 1, 0),
+            (0, 1, 0, 1, 1, 1, 1, 1, 1, 1, 0, 1, 0, 1, 1, 1, 0),
+            (0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0),
+            (0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0),
+            (0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0),
+            (0, 1, 1, 1, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 0, 1, 0),
+            (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0),
+        ), dtype=bool)
+        maze = Maze(Matrix(grid))
+        maze.solve()
+        route = self.tiled(grid, 8).solve()
+        assert [tuple(cell) for cell in route.tolist()][::-1] == maze.solution
+
+    def test_tile_must_be_byte_aligned(self):
+        self.assertRaises(ValueError, TiledMaze, np.zeros((8, 1), dtype=np.uint8), 8, tile=12)
+
+
+class DynamicMazeTest(unittest.TestCase):
+    grid = np.array(
+        (
+            (0, 1, 0, 0, 0, 0, 0),
+            (0, 1, 1, 1, 1, 1, 0),
+            (0, 1, 0, 0, 0, 1, 0),
+            (0, 1, 1, 1, 0, 1, 0),
+            (0, 0, 0, 1, 1, 1, 0),
+            (0, 0, 0, 1, 0, 0, 0),
+            (0, 0, 0, 1, 0, 0, 0),
+        ),
+        dtype=bool,
+    )
+
+    @staticmethod
+    def length(grid: np.ndarray) -> Optional[int]:
+        maze = Maze(Matrix(grid))
+        try:
+            maze.solve(engine="dijkstra")
+        except KeyError:  # an exit cut off inside a corridor
+            return None
+        return maze.solution_length if len(maze.solution) else None
+
+    def test_replans_after_edits(self):
+        maze = DynamicMaze(self.grid)
+        assert maze.solve() == [(6, 3), (5, 3), (4, 3), (3, 3), (3, 2), (3, 1), (2, 1), (1, 1), (0, 1)]
+        maze.clear_cell((3, 2))
+        assert maze.solve().length == 12 and maze.solution[5] == (3, 5)
+        maze.set_cell((2, 3))  # a shortcut from the corridor above
+        assert maze.solution_length == 12 and maze.solve().length == 8
+        maze.clear_cell((1, 1))
+        assert maze.solve() == [] and maze.solution_length is None
+        maze.set_cell((1, 1))
+        maze.set_cell((3, 2))
+        assert maze.solve().length == 8
+
+    def test_edits_away_from_the_route_stay_local(self):
+        grid = generate.generate(61, 61, braid=0.3, seed=2)
+        maze = DynamicMaze(grid)
+        maze.solve()
+        length, full = maze.solution_length, maze.expanded
+        on_route = set(maze.solution)
+        degree = adj.degree_map(maze.adjacency)
+        dead_ends = [(row, col) for row, col in zip(*np.nonzero(degree == 1)) if (row, col) not in on_route]
+        maze.clear_cell(dead_ends[len(dead_ends) // 2])
+        assert maze.solve().length == length and maze.expanded < full // 10
+
+    def test_matches_a_fresh_build_after_random_edits(self):
+        rng = np.random.default_rng(3)
+        for seed in range(4):
+            grid = generate.generate(21, 25, braid=0.5, seed=seed)
+            maze = DynamicMaze(grid)
+            for _ in range(25):
+                cell = (int(rng.integers(1, 20)), int(rng.integers(1, 24)))
+                maze.set_cell(cell, bool(rng.random() < 0.6))
+                maze.solve()
+                assert maze.solution_length == self.length(maze.grid)
+                assert maze.edges == DynamicMaze(maze.grid).edges
+                assert np.array_equal(maze.adjacency, adj.adjacency_map(maze.grid))
+
+    def test_border_cells_cannot_change(self):
+        maze = DynamicMaze(self.grid)
+        with self.assertRaises(ValueError):
+            maze.clear_cell((0, 1))
+
+
+class MazeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = MazeCache(os.path.join(self.tmp.name, "cache"), max_bytes=1 << 20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_store_and_load_memory_maps_arrays(self):
+        self.cache.store("key", meta={"width": 3}, arrays={"grid": np.arange(6).reshape(2, 3)})
+        meta, arrays = self.cache.load("key")
+        assert meta["width"] == 3
+        assert isinstance(arrays["grid"], np.memmap)
+        assert arrays["grid"].tolist() == [[0, 1, 2], [3, 4, 5]]
+
+    def test_store_extends_existing_entry(self):
+        self.cache.store("key", meta={"width": 3}, arrays={"grid": np.zeros(3)})
+        self.cache.store("key", meta={}, arrays={"solution": np.ones(2)})
+        meta, arrays = self.cache.load("key")
+        assert meta["width"] == 3
+        assert set(arrays) == {"grid", "solution"}
+
+    def test_store_leaves_mapped_generation_alone(self):
+        self.cache.store("key", meta={"width": 3}, arrays={"grid": np.arange(3)})
+        _, mapped = self.cache.load("key")
+        first = self.cache.entry("key")
+        self.cache.store("key", meta={}, arrays={"solution": np.ones(2)})
+        assert self.cache.entry("key") != first
+        assert os.path.isfile(os.path.join(first, "grid.npy"))
+        assert mapped["grid"].tolist() == [0, 1, 2]
+        assert set(self.cache.load("key")[1]) == {"grid", "solution"}
+
+    def test_store_keeps_existing_entry_when_move_fails(self):
+        self.cache.store("key", meta={"width": 3}, arrays={"grid": np.zeros(3)})
+        with patch("cache.os.replace", side_effect=PermissionError):
+            self.cache.store("key", meta={}, arrays={"solution": np.ones(2)})
+        assert set(self.cache.load("key")[1]) == {"grid"}
+        assert not [name for name in os.listdir(self.cache.directory) if name.startswith(".staging-")]
+
+    def test_superseded_generations_are_evicted_first(self):
+        self.cache.max_bytes = 5000
+        array = np.zeros(400)  # 3328 bytes as .npy
+        self.cache.store("a", meta={}, arrays={"a": array})
+        self.cache.store("a", meta={}, arrays={"b": np.zeros(1)})
+        assert self.cache.generations("a") == [1]
+        assert self.cache.load("a") is not None
+
+    def test_outdated_version_is_a_miss(self):
+        self.cache.store("key", meta={}, arrays={"grid": np.zeros(3)})
+        with open(os.path.join(self.cache.entry("key"), "meta.json"), "w") as file:
+            json.dump({"version": -1}, file)
+        assert self.cache.load("key") is None
+        assert self.cache.load("missing") is None
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.max_bytes = 5000
+        array = np.zeros(2000, dtype=np.uint8)
+        self.cache.store("old", meta={}, arrays={"a": array})
+        self.cache.store("used", meta={}, arrays={"a": array})
+        os.utime(os.path.join(self.cache.entry("old"), "meta.json"), (0, 0))
+        os.utime(os.path.join(self.cache.entry("used"), "meta.json"), (1, 1))
+        self.cache.store("new", meta={}, arrays={"a": array})
+        assert self.cache.load("old") is None
+        assert self.cache.load("used") is not None
+        assert self.cache.load("new") is not None
+
+    def test_solve_file_reuses_cached_maze(self):
+        matrix = (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 1, 0, 0),
+            (0, 1, 1, 1, 1),
+            (0, 0, 0, 0, 0),
+        )
+        path = os.path.join(self.tmp.name, "maze.png")
+        Image.fromarray(np.array(matrix, dtype=np.uint8) * 255).save(path)
+        solved = solve_file(path, engine="graph", cache=self.cache)
+        with patch("solve.formats.load_grid") as load_grid, patch.object(Maze, "solve") as maze_solve:
+            cached = solve_file(path, engine="graph", cache=self.cache)
+            load_grid.assert_not_called()
+            maze_solve.assert_not_called()
+        assert cached.solution == solved.solution
+        assert cached.graph.n_edges == solved.graph.n_edges
+        assert isinstance(cached.mx, PackedMatrix)
+
+
+class BatchTest(unittest.TestCase):
+    maze = (
+        (0, 1, 0, 0, 0),
+        (0, 1, 1, 1, 0),
+        (0, 0, 1, 0, 0),
+        (0, 1, 1, 1, 1),
+        (0, 0, 0, 0, 0),
+    )
+    invalid = (
+        (0, 1, 0, 1, 0),
+        (0, 1, 1, 1, 0),
+        (0, 0, 1, 0, 0),
+        (0, 1, 1, 1, 1),
+        (0, 0, 0, 0, 0),
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name, matrix in (("a.png", self.maze), ("b.png", self.invalid), ("a - solved.png", self.maze)):
+            Image.fromarray(np.array(matrix, dtype=np.uint8) * 255).save(os.path.join(self.tmp.name, name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_find_mazes_skips_solved_images(self):
+        files = batch.find_mazes([self.tmp.name])
+        assert [os.path.basename(file) for file in files] == ["a.png", "b.png"]
+        assert batch.find_mazes([os.path.join(self.tmp.name, "b*")]) == [os.path.join(self.tmp.name, "b.png")]
+
+    def test_solve_one_reports_result_or_error(self):
+        solved = batch.solve_one(os.path.join(self.tmp.name, "a.png"), render=False)
+        failed = batch.solve_one(os.path.join(self.tmp.name, "b.png"), render=False)
+        assert solved["length"] == 6 and "error" not in solved
+        assert failed["error"] == "PathExitAmountError" and "crashed" not in failed
+
+    def test_main_streams_json_lines_and_keeps_going(self):
+        output = os.path.join(self.tmp.name, "out")
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            code = batch.main([self.tmp.name, "--jobs", "2", "--output-dir", output])
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        assert code == 1
+        assert sorted(os.path.basename(record["file"]) for record in records) == ["a.png", "b.png"]
+        assert os.listdir(output) == ["a - solved.png"]
+
+
+class ServerTest(unittest.TestCase):
+    @staticmethod
+    def serve(scenario, **kwargs) -> None:
+        async def run():
+            with tempfile.TemporaryDirectory() as directory:
+                server = SolveServer(os.path.join(directory, "solve.sock"), workers=0, **kwargs)
+                await server.start()
+                try:
+                    await scenario(server)
+                finally:
+                    await server.close()
+                assert not os.path.exists(server.path)
+        asyncio.run(run())
+
+    def test_solves_paths_and_bytes_and_caches(self):
+        with open("maze_small.png", "rb") as file:
+            data = file.read()
+        maze = Maze(Matrix(i2m.load_grid("maze_small.png")))
+        maze.solve()
+
+        def requests(path: str) -> list[dict]:
+            with Client(path) as client:
+                return [client.solve(path="maze_small.png"), client.solve(data=data), client.stats()]
+
+        async def scenario(server):
+            first, second, stats = await asyncio.to_thread(requests, server.path)
+            assert first["ok"] and not first["cached"] and second["cached"]
+            assert Solution.from_json(json.dumps(first["solution"])) == maze.solution
+            assert first["length"] == second["length"] == maze.solution_length
+            assert (stats["cache_hits"], stats["cache_misses"], stats["solved"]) == (1, 1, 1)
+            assert stats["queue_depth"] == stats["in_flight"] == 0
+
+        self.serve(scenario)
+
+    def test_detects_the_format_of_data(self):
+        grid = i2m.load_grid("maze_small.png")
+        expected = solve_file("maze_small.png", engine="graph").solution_length
+        with tempfile.TemporaryDirectory() as directory:
+            payloads = []
+            for ext in (".pbm", ".npy", ".mzb"):
+                formats.save_grid(os.path.join(directory, "maze" + ext), grid)
+                with open(os.path.join(directory, "maze" + ext), "rb") as file:
+                    payloads.append({"data": base64.b64encode(file.read()).decode()})
+            payloads.append({"path": os.path.join(directory, "maze.mzb")})
+
+            async def scenario(server):
+                for request in payloads:
+                    result = await server.solve(request)
+                    assert result["ok"] and result["length"] == expected, result
+                    assert result["shape"] == list(grid.shape)
+
+            self.serve(scenario)
+
+    def test_reports_bad_mazes_and_requests(self):
+        grid = np.zeros((5, 5), dtype=np.uint8)
+        grid[0, 2] = 255
+        image = io.BytesIO()
+        Image.fromarray(grid).save(image, format="PNG")
+
+        def requests(path: str) -> list[dict]:
+            with Client(path) as client:
+                return [
+                    client.solve(data=image.getvalue()),
+                    client.request({"id": 7, "op": "solve", "path": "missing.png"}),
+                    client.request({"op": "shutdown"}),
+                    client.request([1]),
+                    client.request("x"),
+                    client.request({"op": "ping"}),
+                    client.solve(data=looped.getvalue()),
+                ]
+
+        looped = io.BytesIO()  # the default engine must terminate on loops
+        Image.fromarray(np.array(ShortestPathTest.matrix, dtype=np.uint8) * 255).save(looped, format="PNG")
+
+        async def scenario(server):
+            invalid, missing, unknown, array, string, ping, loop = await asyncio.to_thread(requests, server.path)
+            assert invalid["error"] == "PathExitAmountError" and not invalid.get("crashed")
+            assert missing["error"] == "FileNotFoundError" and missing["id"] == 7
+            assert not unknown["ok"] and ping["ok"]
+            assert array["error"] == string["error"] == "ValueError"
+            assert loop["ok"] and loop["length"] in (7, 13)
+            assert server.stats["errors"] == 1
+
+        self.serve(scenario)
+
+    def test_identical_requests_share_a_solve(self):
+        with open("maze_small.png", "rb") as file:
+            request = {"data": base64.b64encode(file.read()).decode(), "engine": "graph"}
+
+        async def scenario(server):
+            results = await asyncio.gather(server.solve(request), server.solve(request))
+            assert [result["cached"] for result in results] == [False, True]
+            assert server.stats["solved"] == 1 and not server.running
+
+        self.serve(scenario)
+
+    def test_new_engines_reuse_the_prepared_maze(self):
+        async def scenario(server):
+            first = await server.solve({"path": "maze_small.png", "engine": "dijkstra"})
+            with patch.object(JunctionGraph, "build") as build, patch("solve.load_matrix") as load_matrix:
+                second = await server.solve({"path": "maze_small.png", "engine": "graph"})
+            assert first["ok"] and second["ok"] and not second["cached"]
+            assert first["length"] == second["length"]
+            build.assert_not_called()
+            load_matrix.assert_not_called()
+            assert os.listdir(server.cache_dir)
+
+        self.serve(scenario)
+        with tempfile.TemporaryDirectory() as directory:
+            self.serve(lambda server: server.solve({"path": "maze_small.png"}), cache_dir=directory)
+            assert os.listdir(directory)  # kept, only temporary directories are removed
+
+    def test_paths_are_hashed_off_the_event_loop(self):
+        threads = []
+        key = MazeCache.key
+
+        def hash_file(source):
+            threads.append(threading.current_thread())
+            return key(source)
+
+        async def scenario(server):
+            with patch("server.MazeCache.key", side_effect=hash_file):
+                result = await server.solve({"path": "maze_small.png"})
+            assert result["ok"] and threads and threading.main_thread() not in threads
+
+        self.serve(scenario)
+
+    def test_backpressure_turns_requests_away(self):
+        async def scenario(server):
+            result = await server.solve({"path": "maze_small.png"})
+            assert result["error"] == "Busy"
+            assert server.metrics()["rejected"] == 1 and server.metrics()["cache_entries"] == 0
+
+        self.serve(scenario, max_queue=0)
+
+
+class MatrixToImageTest(unittest.TestCase):
+    grid = np.array(
+        (
+            (0, 1, 0, 0, 0),
+            (0, 1, 1, 1, 0),
+            (0, 0, 0, 1, 0),
+        ),
+        dtype=bool,
+    )
+    solution = [(0, 1), (1, 1), (1, 2), (1, 3), (2, 3)]
+
+    def test_render_draws_walls_paths_and_gradient(self):
+        pixels = m2i.render(Matrix(self.grid), self.solution[:3])
+        assert pixels.shape == (3, 5, 3)
+        assert pixels[0, 0].tolist() == [0, 0, 0] and pixels[1, 3].tolist() == [255, 255, 255]
+        assert [pixels[cell].tolist() for cell in self.solution[:3]] == [[255, 0, 0], [170, 85, 0], [85, 170, 0]]
+
+    def test_render_keeps_rows_and_cols_apart(self):
+        pixels = m2i.render(self.grid, np.array(self.solution[-1:]))
+        assert pixels[2, 3].tolist() == [255, 0, 0] and pixels[1, 3].tolist() == [255, 255, 255]
+
+    def test_create_png(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "solved.png")
+            m2i.create_png(path, self.grid, self.solution)
+            with Image.open(path) as png:
+                assert png.size == (5, 3)
+                assert np.array_equal(np.array(png), m2i.render(self.grid, self.solution))
+
+    def test_stream_png_matches_create_png(self):
+        solution = np.array(self.solution)
+        with tempfile.TemporaryDirectory() as directory:
+            expected, path = os.path.join(directory, "expected.png"), os.path.join(directory, "streamed.png")
+            m2i.create_png(expected, self.grid, solution)
+            for grid, width in ((self.grid, None), (PackedMatrix(self.grid), None), (np.packbits(self.grid, axis=1), 5)):
+                m2i.stream_png(path, grid, solution, width=width, strip=2)
+                with Image.open(path) as streamed, Image.open(expected) as png:
+                    assert streamed.mode == "RGB"
+                    assert np.array_equal(np.array(streamed), np.array(png))
+
+    def test_stream_png_with_solution_layer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, layer_path = os.path.join(directory, "maze.png"), os.path.join(directory, "layer.png")
+            m2i.stream_png(path, self.grid, self.solution, strip=2, layer_path=layer_path)
+            with Image.open(path) as maze, Image.open(layer_path) as layer:
+                assert maze.mode == "P" and np.array_equal(np.array(maze).astype(bool), self.grid)
+                assert layer.mode == "P" and layer.info["transparency"] == 0
+                indexes = np.array(layer)
+                assert indexes[0, 0] == 0 and indexes[0, 1] == 1
+                assert [indexes[cell] for cell in self.solution] == sorted(indexes[cell] for cell in self.solution)
+                colours = np.array(layer.convert("RGB"))
+                assert colours[0, 1].tolist() == [255, 0, 0]
+
+
+class GenerateTest(unittest.TestCase):
+    @staticmethod
+    def edges(grid: np.ndarray) -> int:
+        return int(adj.degree_map(adj.adjacency_map(grid))[grid].sum()) // 2
+
+    def test_mazes_are_valid_and_reproducible(self):
+        for algorithm in generate.ALGORITHMS:
+            for height, width in ((3, 3), (21, 30), (40, 11)):
+                grid = generate.generate(height, width, algorithm=algorithm, seed=5)
+                assert grid.shape == (height - 1 + height % 2, width - 1 + width % 2)
+                assert Validator.validate(grid) == [(0, 1), (grid.shape[0] - 1, grid.shape[1] - 2)]
+                assert np.array_equal(grid, generate.generate(height, width, algorithm=algorithm, seed=5))
+
+    def test_perfect_mazes_are_spanning_trees(self):
+        for algorithm in generate.ALGORITHMS:
+            grid = generate.generate(61, 41, algorithm=algorithm, seed=1)
+            assert self.edges(grid) == grid.sum() - 1, algorithm
+            maze = Maze(Matrix(grid))
+            maze.solve(engine="graph")
+            assert maze.solution[-1] == (0, 1)
+
+    def test_braid_removes_dead_ends(self):
+        for algorithm in generate.ALGORITHMS:
+            grid = generate.generate(61, 61, algorithm=algorithm, braid=1.0, seed=1)
+            degree = adj.degree_map(adj.adjacency_map(grid))
+            assert ((degree == 1) & grid).sum() == 2  # the exits
+            assert self.edges(grid) > grid.sum() - 1
+
+    def test_eller_streams_rows(self):
+        streamed = np.array(list(generate.eller_rows(30, 10, np.random.default_rng(3), braid=0.5)))
+        assert np.array_equal(streamed, generate.generate(61, 21, algorithm="eller", braid=0.5, seed=3))
+        strips = np.array(list(generate.eller_rows(30, 10, np.random.default_rng(3), braid=1.0, strip=8)))
+        assert Validator.validate(strips) and ((adj.degree_map(adj.adjacency_map(strips)) == 1) & strips).sum() == 2
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "maze.raw")
+            height = generate.write_raw(path, iter(streamed))
+            assert height == 61
+            assert np.array_equal(np.unpackbits(open_bitmap(path, 61, 21), axis=1, count=21).view(bool), streamed)
+
+    def test_components(self):
+        labels = generate.components(6, np.array([4, 1, 5]), np.array([1, 3, 2]))
+        assert labels.tolist() == [0, 1, 2, 1, 1, 2]
+
+
+class BenchTest(unittest.TestCase):
+    def test_generators_make_valid_mazes(self):
+        for topology, generate in bench.GENERATORS.items():
+            grid = generate(20, np.random.default_rng(1))
+            assert grid.shape == (21, 21)
+            assert Validator.validate(grid) == [(0, 1), (20, 19)], topology
+
+    def test_run_case_times_every_stage(self):
+        record = bench.run_case(20, "corridor", "nodes")
+        assert list(record["stages"]) == [
+            "load", "validate", "maze", "find_exit_cells", "create_nodes", "find_solution", "create_png",
+        ]
+        assert list(record["tracemalloc"]) == list(record["stages"])
+        assert record["length"] == 182 and record["rss"] > 0
+        assert "skipped" in bench.run_case(20, "braided", "nodes")
+        assert "solve" in bench.run_case(20, "braided", "dijkstra", memory=False)["stages"]
+
+    def test_rss_falls_back_to_tracemalloc_without_resource(self):
+        with patch.dict("sys.modules", {"resource": None}):  # as on Windows
+            assert bench._peak_rss() is None
+            record = bench.run_case(20, "corridor", "graph")
+            assert record["rss"] == max(record["tracemalloc"].values())
+            assert "rss" not in bench.run_case(20, "corridor", "graph", memory=False)
+
+    def test_compare_flags_regressions(self):
+        def results(seconds: float, rss: int) -> dict:
+            return {"results": [
+                {"size": 100, "topology": "perfect", "engine": "nodes", "stages": {"load": seconds}, "rss": rss},
+                {"size": 100, "topology": "braided", "engine": "nodes", "skipped": "loops"},
+            ]}
+
+        assert bench.compare(results(1.0, 100), results(1.05, 105)) == []
+        assert bench.compare(results(0.001, 100), results(0.003, 100)) == []  # below the noise floor
+        regressions = bench.compare(results(1.0, 100), results(1.5, 200))
+        assert len(regressions) == 2 and "load" in regressions[0] and "rss" in regressions[1]
+
+
+class InstrumentTest(unittest.TestCase):
+    def test_counts_lookups_phases_and_stack(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profile = os.path.join(directory, "solve.prof")
+            with Instrument(profile=profile) as instrument:
+                maze = solve_file("maze_small.png")
+            assert os.path.getsize(profile) > 0
+
+        report = json.loads(instrument.to_json())
+        counts = report["counts"]
+        assert list(counts) == list(solve.COUNTS)
+        assert counts["nodes_created"] >= counts["nodes_indexed"] > 0
+        assert counts["node_lookups"] > counts["nodes_indexed"]
+        assert counts["corridors_walked"] > 0 and counts["cells_walked"] >= counts["corridors_walked"]
+        assert counts["adjacency_lookups"] > counts["cells_walked"]
+        assert counts["max_stack"] > 0
+        assert counts["bst_searches"] == counts["vertices_settled"] == 0  # reported, not left out
+        assert ["load_grid", "validate", "find_exit_cells", "create_nodes", "find_solution", "solve"] == list(report["phases"])
+        assert report["phases"]["solve"]["time"] >= report["phases"]["create_nodes"]["time"]
+        assert report["phases"]["solve"]["peak"] >= report["phases"]["create_nodes"]["peak"] > 0
+        plain = Maze(Matrix(i2m.load_grid("maze_small.png")))
+        plain.solve()
+        assert maze.solution_length == plain.solution_length
+
+    def test_counts_bst_searches(self):
+        with Instrument(memory=False) as instrument:
+            Maze(Matrix(ImageToMatrixTest.grid), index="bst").solve()
+        assert instrument.counts["bst_searches"] > 0
+        assert "peak" not in instrument.report()["phases"]["solve"]
+
+    def test_counts_settled_vertices_of_searches(self):
+        with Instrument(memory=False) as instrument:
+            Maze(Matrix(ShortestPathTest.matrix)).solve(engine="astar")
+        assert instrument.counts["vertices_settled"] > 0
+        assert instrument.counts["nodes_created"] == 0
+
+    def test_restores_methods_and_counters(self):
+        solve_method, validate, create_nodes = Maze.solve, Validator.validate, Maze.create_nodes
+        with Instrument(memory=False):
+            assert Maze.solve is not solve_method
+            assert solve.counters is not None
+        assert (Maze.solve, Validator.validate, Maze.create_nodes) == (solve_method, validate, create_nodes)
+        assert solve.counters is None
+        assert isinstance(vars(Maze)["create_node"], staticmethod)
+
+
+class ImageToMatrixTest(unittest.TestCase):
+    grid = np.array(
+        (
+            (0, 1, 0, 0),
+            (0, 1, 1, 0),
+            (0, 0, 1, 0),
+        ),
+        dtype=bool,
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self, mode: str) -> str:
+        path = os.path.join(self.tmp.name, f"maze_{mode}.png")
+        Image.fromarray(self.grid.astype(np.uint8) * 255).convert(mode).save(path)
+        return path
+
+    def test_load_grid_reads_all_modes(self):
+        for mode in ("1", "L", "RGB", "RGBA", "P"):
+            grid = i2m.load_grid(self.save(mode))
+            assert grid.dtype == bool
+            assert np.array_equal(grid, self.grid), mode
+
+    def test_load_grid_packed(self):
+        packed = i2m.load_grid(self.save("L"), packed=True)
+        assert np.array_equal(packed, np.packbits(self.grid, axis=1))
+
+    def test_load_grid_inverted(self):
+        assert np.array_equal(i2m.load_grid(self.save("RGB"), inverted=True), ~self.grid)
+
+    def test_get_maze_path_returns_tuple_matrix(self):
+        matrix = i2m.get_maze_path(self.save("RGB"))
+        assert matrix == tuple(tuple(row) for row in self.grid.tolist())
+        assert type(matrix[0][0]) is bool
+
+
+class FormatsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.grid = np.random.default_rng(3).random((13, 11)) < 0.5  # width not a multiple of 8
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def test_round_trip(self):
+        for ext in formats.EXTENSIONS:
+            formats.save_grid(self.path("maze" + ext), self.grid)
+            grid = formats.load_grid(self.path("maze" + ext))
+            assert grid.dtype == bool
+            assert np.array_equal(grid, self.grid), ext
+
+    def test_bytes_by_magic_number(self):
+        for ext in formats.EXTENSIONS:
+            formats.save_grid(self.path("maze" + ext), self.grid)
+            with open(self.path("maze" + ext), "rb") as file:
+                data = file.read()
+            assert formats.extension(data) == ext
+            assert np.array_equal(formats.load_grid(data), self.grid), ext
+            assert np.array_equal(load_matrix(data).array, self.grid), ext
+        with self.assertRaises(ValueError):
+            formats.load_grid(data[:-1])  # truncated .mzb rows
+
+    def test_memory_mapped(self):
+        formats.write_npy(self.path("maze.npy"), self.grid)
+        assert isinstance(formats.load_grid(self.path("maze.npy")), np.memmap)
+        formats.write_mzb(self.path("maze.mzb"), self.grid)
+        packed, width = formats.load_packed(self.path("maze.mzb"))
+        assert isinstance(packed, np.memmap)
+        assert np.array_equal(PackedMatrix.from_packed(packed, width).array, self.grid)
+
+    def test_pbm_matches_pil(self):
+        formats.write_pbm(self.path("maze.pbm"), self.grid)
+        with Image.open(self.path("maze.pbm")) as img:
+            assert np.array_equal(np.array(img), self.grid)  # black pixels are wall
+
+    def test_pbm_header_comments(self):
+        rows = np.packbits(~self.grid, axis=1).tobytes()
+        with open(self.path("maze.pbm"), "wb") as file:
+            file.write(b"P4\n# made elsewhere\n11\t13\n" + rows)
+        assert np.array_equal(formats.load_grid(self.path("maze.pbm")), self.grid)
+
+    def test_rejects_other_files(self):
+        with open(self.path("maze.mzb"), "wb") as file:
+            file.write(b"P4\n11 13\n" + bytes(64))
+        with self.assertRaises(ValueError):
+            formats.load_grid(self.path("maze.mzb"))
+        with self.assertRaises(ValueError):
+            formats.load_grid(self.path("maze.gif"))
+
+    def test_solve_file_reads_every_format(self):
+        grid = i2m.load_grid("maze_small.png")
+        expected = solve_file("maze_small.png").solution
+        for ext in (".pbm", ".npy", ".mzb"):
+            formats.save_grid(self.path("maze_small" + ext), grid)
+            assert solve_file(self.path("maze_small" + ext)).solution == expected, ext
+
+    def test_solve_file_keeps_packed_formats_packed(self):
+        grid = i2m.load_grid("maze_small.png")
+        for ext in (".pbm", ".mzb"):
+            path = self.path("maze_small" + ext)
+            formats.save_grid(path, grid)
+            matrix = load_matrix(path)
+            assert isinstance(matrix, PackedMatrix) and matrix.packed.shape[1] == -(-grid.shape[1] // 8)
+            with patch.object(PackedMatrix, "array", new_callable=PropertyMock) as array:
+                assert Validator.validate(matrix, connected=False) == Validator.validate(grid)
+                array.assert_not_called()
+            assert isinstance(solve_file(path).mx, PackedMatrix)
+        assert isinstance(load_matrix(self.path("maze_small.mzb")).packed, np.memmap)
+
+    def test_convert_directory(self):
+        formats.save_grid(self.path("a.png"), self.grid)
+        formats.save_grid(self.path("b.png"), ~self.grid)
+        output = self.path("out")
+        os.mkdir(output)
+        with patch("sys.stdout", io.StringIO()):
+            assert formats.main(["convert", self.tmp.name, "--to", "pbm", "--output-dir", output]) == 0
+        assert sorted(os.listdir(output)) == ["a.pbm", "b.pbm"]
+        assert np.array_equal(formats.load_grid(os.path.join(output, "b.pbm")), ~self.grid)
+
+    def test_solver_imports_without_pil(self):
+        code = "import sys, solve; print('PIL' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == "False"
+
+
 if __name__ == "__main__":
     # overwrite constants to allow for more readable test matrices
     Maze.WALL = 0
@@ -0,0 +1,276 @@
+import argparse
+import math
+import sys
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+import adjacency as adj
+import matrix2image as m2i
+import search
+from graph import JunctionGraph
+from prune import fill_dead_ends
+
+Cell = tuple[int, int]
+
+
+def write_bitmap(path: str, grid: np.ndarray, strip: int = 4096) -> None:
+    """Write a grid as a raw bitmap: rows packed 8 cells per byte, no header."""
+    with open(path, "wb") as file:
+        for row in range(0, grid.shape[0], strip):
+            file.write(np.packbits(np.asarray(grid[row:row + strip], dtype=bool), axis=1).tobytes())
+
+
+def open_bitmap(path: str, height: int, width: int) -> np.memmap:
+    """Memory-map a raw bitmap written by `write_bitmap`."""
+    return np.memmap(path, dtype=np.uint8, mode="r", shape=(height, math.ceil(width / 8)))
+
+
+# Edges of the abstract graph as they are kept on disk: target vertex and length
+EDGE = np.dtype([("index", "<i8"), ("length", "<i4")])
+
+
+class TiledMaze:
+    """Hierarchical (HPA*) solver for mazes too large to hold in memory.
+
+    The bit-packed grid is split into square tiles that are read one at a time.
+    Path cells on either side of a tile boundary, the crossings, are the only
+    vertices of an abstract graph, crossing a boundary costs 1. Inside a tile,
+    crossings are joined by edges as long as the shortest route between them
+    that avoids the other crossings of the tile. The edges are written to a
+    temporary file in `directory` and memory-mapped, so only the crossings,
+    one tile and its graph are held in memory. Searches run on the abstract
+    graph and only the tiles along the route found are read again to turn it
+    into cells."""
+    def __init__(self, packed: np.ndarray, width: int, tile: int = 256, directory: Optional[str] = None):
+        if tile % 8:
+            raise ValueError("Tile size must be a multiple of 8")
+        self.packed = packed
+        self.height = packed.shape[0]
+        self.width = width
+        self.tile = tile
+        self.tile_rows = math.ceil(self.height / tile)
+        self.tile_cols = math.ceil(self.width / tile)
+        self.directory = directory
+
+        self.nodes: np.ndarray = None  # flat cell index of every crossing, by tile, then cell
+        self.tile_ptr: np.ndarray = None  # crossings of tile t are tile_ptr[t]:tile_ptr[t + 1]
+        self.indptr: np.ndarray = None
+        self.edges: np.ndarray = None  # EDGE records, memory-mapped
+
+    def read(self, row_start: int, row_end: int, col_start: int, col_end: int) -> np.ndarray:
+        """Unpack a rectangle of the grid, `col_start` must be a multiple of 8."""
+        packed = self.packed[row_start:row_end, col_start // 8:math.ceil(col_end / 8)]
+        return np.unpackbits(packed, axis=1, count=col_end - col_start).view(bool)
+
+    def bounds(self, tile: tuple[int, int]) -> tuple[int, int, int, int]:
+        tile_row, tile_col = tile
+        row_start, col_start = tile_row * self.tile, tile_col * self.tile
+        return (
+            row_start,
+            min(row_start + self.tile, self.height),
+            col_start,
+            min(col_start + self.tile, self.width),
+        )
+
+    def tile_of(self, cell: Cell) -> tuple[int, int]:
+        row, col = cell
+        return row // self.tile, col // self.tile
+
+    def cell(self, flat: int) -> Cell:
+        row, col = divmod(int(flat), self.width)
+        return row, col
+
+    def find_exit_cells(self) -> list[Cell]:
+        """Path cells on the border of the maze, in the order Maze.find_exit_cells
+        returns them."""
+        north, south = self.read(0, 1, 0, self.width)[0], self.read(self.height - 1, self.height, 0, self.width)[0]
+        west = (self.packed[:, 0] >> 7 & 1).astype(bool)
+        last = self.width - 1
+        east = (self.packed[:, last // 8] >> (7 - last % 8) & 1).astype(bool)
+        return adj.border_exits(north, east, south, west)
+
+    def prepare(self) -> None:
+        """Find the crossings of all tile boundaries, then join the crossings of
+        every tile by their distances inside it, one tile at a time. Only a row
+        or column of boundary cells, or one tile, is unpacked at a time."""
+        crossings = [self._horizontal_crossings(row) for row in range(self.tile, self.height, self.tile)]
+        crossings += [self._vertical_crossings(col) for col in range(self.tile, self.width, self.tile)]
+        a = np.concatenate([pair[0] for pair in crossings] or [np.zeros(0, dtype=np.int64)])
+        b = np.concatenate([pair[1] for pair in crossings] or [np.zeros(0, dtype=np.int64)])
+        boundary = np.unique(np.concatenate([a, b]))
+
+        rows, cols = np.divmod(boundary, self.width)
+        tiles = (rows // self.tile) * self.tile_cols + cols // self.tile
+        order = np.argsort(tiles, kind="stable")
+        self.nodes = boundary[order]
+        self.tile_ptr = np.searchsorted(tiles[order], np.arange(self.tile_rows * self.tile_cols + 1))
+        ids = np.empty(len(boundary), dtype=np.int64)
+        ids[order] = np.arange(len(boundary))
+        a, b = ids[np.searchsorted(boundary, a)], ids[np.searchsorted(boundary, b)]
+        across = np.argsort(np.concatenate([a, b]), kind="stable")
+        across_sources, across_targets = np.concatenate([a, b])[across], np.concatenate([b, a])[across]
+
+        self.indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        with tempfile.TemporaryFile(dir=self.directory) as store:  # the mapping outlives the file
+            for tile in range(self.tile_rows * self.tile_cols):
+                first, last = self.tile_ptr[tile], self.tile_ptr[tile + 1]
+                if first == last:
+                    continue
+                sources, targets, lengths = self._tile_edges(divmod(tile, self.tile_cols), first, last)
+                lo, hi = np.searchsorted(across_sources, (first, last))
+                sources = np.concatenate([sources, across_sources[lo:hi]])
+                targets = np.concatenate([targets, across_targets[lo:hi]])
+                lengths = np.concatenate([lengths, np.ones(hi - lo, dtype=np.int64)])
+
+                by_source = np.argsort(sources, kind="stable")
+                edges = np.empty(len(sources), dtype=EDGE)
+                edges["index"], edges["length"] = targets[by_source], lengths[by_source]
+                store.write(edges.tobytes())
+                self.indptr[first + 1:last + 1] = np.bincount(sources - first, minlength=last - first)
+            np.cumsum(self.indptr, out=self.indptr)
+            store.flush()
+            if self.indptr[-1]:
+                self.edges = np.memmap(store, dtype=EDGE, mode="r", shape=(int(self.indptr[-1]),))
+            else:
+                self.edges = np.zeros(0, dtype=EDGE)
+
+    def _tile_edges(self, tile: tuple[int, int], first: int, last: int) -> tuple[np.ndarray, ...]:
+        """Sources, targets and lengths of the edges between the crossings
+        `first:last` of one tile. Routes through another crossing are left to
+        the edges on either side of it."""
+        if last - first < 2:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        row_start, row_end, col_start, col_end = self.bounds(tile)
+        rows, cols = np.divmod(self.nodes[first:last], self.width)
+        keep = list(zip((rows - row_start).tolist(), (cols - col_start).tolist()))
+        grid = fill_dead_ends(self.read(row_start, row_end, col_start, col_end), keep=keep)
+        forced = np.zeros(grid.shape, dtype=bool)
+        forced[rows - row_start, cols - col_start] = True
+        graph = JunctionGraph.build(grid, forced=forced)
+
+        dist = search.distances_between(graph, [graph.vertex(cell) for cell in keep])
+        np.fill_diagonal(dist, -1)
+        sources, targets = np.nonzero(dist >= 0)
+        return first + sources, first + targets, dist[sources, targets]
+
+    def solve(self) -> np.ndarray:
+        """Cells from the first to the second exit, as an (n, 2) array."""
+        cell_start, cell_end = self.find_exit_cells()
+        return self.shortest_path(cell_start, cell_end)
+
+    def shortest_path(self, start: Cell, end: Cell) -> Optional[np.ndarray]:
+        """Cells from `start` to `end` as an (n, 2) array, None if unreachable."""
+        if self.nodes is None:
+            self.prepare()
+        n = len(self.nodes)
+        source, target = n, n + 1
+        links = {source: self._links(start, end, target), target: []}
+        for v, length in self._links(end, None, None):
+            links.setdefault(v, []).append((target, length))
+
+        indptr, edges, nodes = self.indptr, self.edges, self.nodes
+        flats = {source: start[0] * self.width + start[1], target: end[0] * self.width + end[1]}
+
+        def neighbours(u: int, _: int) -> list[tuple[int, int, int, int]]:
+            found = edges[indptr.item(u):indptr.item(u + 1)].tolist() if u < n else []
+            return [(v, length, -1, -1) for v, length in found + links.get(u, [])]
+
+        def heuristic(v: int) -> int:
+            row, col = divmod(nodes.item(v) if v < n else flats[v], self.width)
+            return abs(row - end[0]) + abs(col - end[1])
+
+        route = search.astar(neighbours, source, target, n + 2, heuristic)
+        if route is None:
+            return
+
+        # refine every visit of a tile at once, from where the route enters it
+        # to where it leaves: the route is shortest, so is every part of it
+        cells = [np.array([start])]
+        path = [self.cell(nodes.item(v) if v < n else flats[v]) for v in route.vertices]
+        entered = path[0]
+        for a, b in zip(path, path[1:]):
+            if self.tile_of(a) != self.tile_of(b):
+                if a != entered:
+                    cells.append(self._refine(entered, a)[1:])
+                cells.append(np.array([b]))
+                entered = b
+        if path[-1] != entered:
+            cells.append(self._refine(entered, path[-1])[1:])
+        return np.concatenate(cells).astype(np.int64)
+
+    def _links(self, cell: Cell, other: Optional[Cell], other_id: Optional[int]) -> list[tuple[int, int]]:
+        """Crossings (and `other`, if in the same tile) `cell` reaches inside its
+        own tile, with their distances."""
+        tile = self.tile_of(cell)
+        first, last = self.tile_ptr[tile[0] * self.tile_cols + tile[1]:][:2].tolist()
+        ids = list(range(first, last))
+        cells = [self.cell(flat) for flat in self.nodes[first:last].tolist()]
+        if other is not None and self.tile_of(other) == tile:
+            ids.append(other_id)
+            cells.append(other)
+        if not cells:
+            return []
+        dist = self._tile_distances(tile, [cell], cells)[0]
+        return [(v, d) for v, d in zip(ids, dist) if d >= 0]
+
+    def _tile_distances(self, tile: tuple[int, int], sources: list[Cell], targets: list[Cell]) -> list[list[int]]:
+        """Distances inside one tile from every source to every target, -1 where
+        the tile doesn't connect them."""
+        row_start, row_end, col_start, col_end = self.bounds(tile)
+        local = lambda cells: [(row - row_start, col - col_start) for row, col in cells]  # noqa: E731
+        sources, targets = local(sources), local(targets)
+
+        grid = fill_dead_ends(self.read(row_start, row_end, col_start, col_end), keep=sources + targets)
+        forced = np.zeros(grid.shape, dtype=bool)
+        forced[tuple(np.array(sources + targets).T)] = True
+        graph = JunctionGraph.build(grid, forced=forced)
+
+        target_ids = [graph.vertex(cell) for cell in targets]
+        return [search.distances(graph, graph.vertex(cell))[target_ids].tolist() for cell in sources]
+
+    def _refine(self, a: Cell, b: Cell) -> np.ndarray:
+        """Cells of the shortest path between two cells of the same tile. Corridors
+        are followed lazily from `a`, so only the part of the tile the search
+        reaches is walked."""
+        row_start, row_end, col_start, col_end = self.bounds(self.tile_of(a))
+        walker = search.CorridorWalker(adj.adjacency_map(self.read(row_start, row_end, col_start, col_end)))
+        source = walker.flat((a[0] - row_start, a[1] - col_start))
+        target = walker.flat((b[0] - row_start, b[1] - col_start))
+        walker.stops.update((source, target))
+        route = search.astar(walker.neighbours, source, target, walker.size, search.manhattan(walker, target))
+        return np.array(walker.expand(route), dtype=np.int64) + (row_start, col_start)
+
+    def _horizontal_crossings(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        above, below = self.read(row - 1, row + 1, 0, self.width)
+        cols = np.flatnonzero(above & below)
+        return (row - 1) * self.width + cols, row * self.width + cols
+
+    def _vertical_crossings(self, col: int) -> tuple[np.ndarray, np.ndarray]:
+        left, right = self.read(0, self.height, col - 8, min(col + 8, self.width))[:, [7, 8]].T
+        rows = np.flatnonzero(left & right)
+        return rows * self.width + col - 1, rows * self.width + col
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve a maze stored as a raw bitmap, one tile at a time")
+    parser.add_argument("file", help="raw bitmap, rows packed 8 cells per byte (white = path = 1)")
+    parser.add_argument("--height", type=int, required=True)
+    parser.add_argument("--width", type=int, required=True)
+    parser.add_argument("--tile", type=int, default=256, help="tile size, a multiple of 8")
+    parser.add_argument("--work-dir", help="keep the tile graphs here instead of the temporary directory")
+    parser.add_argument("--output", help="write the solution cells here as .npy")
+    parser.add_argument("--image", help="write the solved maze here as a png, strip by strip")
+    parser.add_argument("--solution-layer", help="with --image, write a 1-bit maze image and the solution here")
+    args = parser.parse_args()
+
+    maze = TiledMaze(open_bitmap(args.file, args.height, args.width), args.width, tile=args.tile, directory=args.work_dir)
+    solution = maze.solve()
+    if solution is None:
+        sys.exit("No route between the exits")
+    if args.output:
+        np.save(args.output, solution)
+    if args.image:
+        m2i.stream_png(args.image, maze.packed, solution, width=args.width, layer_path=args.solution_layer)
+    print(f"Solution length: {len(solution) - 1}")